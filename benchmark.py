@@ -0,0 +1,324 @@
+"""Benchmarks of the tagging hot paths on synthetic seasons of data.
+
+`synthetic_season` builds a deterministic tag history: seasons x World Cup events
+x genders x phases, four boats a race through eight gates, with upstream
+tactics, rolls, DNS, faults and the extra columns real files carry (Video Link,
+Contest Statistics). Each size is built from the same seed, so runs compare.
+
+For every size the suite times what the tagger does with a history that large:
+
+    load csv          parse the data file (startup without a current snapshot)
+    load snapshot     read the binary snapshot (normal startup)
+    index rebuild     build the race index for a loaded history
+    athlete roster    distinct athlete names for the dropdowns
+    write csv         rewrite the whole data file (save_all, batch tools)
+    export append     bring the CSV up to date after one race of tags
+    tag               one sequence tag: session rules, index and journal (median of a race's tags)
+    journal flush     write and fsync the journal after one tag
+    fault entry       one fault popup confirm, backfilling gate rows
+    athlete lookup    one athlete name lookup for a BIB in a race
+
+Results are the best of --repeat runs, in seconds per operation. --save writes
+them as the baseline (benchmark_baseline.json, kept with the code); otherwise
+they are compared with it and anything more than --tolerance times slower is
+reported as a regression, with exit status 1. Timings only compare on the
+machine that recorded the baseline, which the file names.
+
+    python benchmark.py                          10k, 100k and 1M rows
+    python benchmark.py --sizes 10000 --repeat 5
+    python benchmark.py --save                   record a new baseline
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from roster import athlete_roster
+from tag_archive import TagArchive, write_csv
+from tag_snapshot import read_snapshot, write_snapshot
+from tag_store import STANDARD_HEADERS, TagStore
+from tag_table import TagTable
+from tagging_session import BIB_DATA, GATE_ORDER, TaggingSession
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 1.5
+DEFAULT_SEED = 2026
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+EXTRA_HEADERS = ["Contest Statistics", "Video Link"]
+EVENTS_PER_SEASON = 6
+PHASES = [f"Heat {i}" for i in range(1, 9)] + [f"QF{i}" for i in range(1, 5)] + ["SF1", "SF2", "Final"]
+ATHLETES_PER_GENDER = 120
+UPSTREAM_GATES = {"Gate 2", "Gate 5"}
+DNS_RATE = 0.03
+FAULT_RATE = 0.08
+ROLL_RATE = 0.25
+# Races tagged through the session per run of the "tag" benchmark
+TAG_RACES = 3
+LOOKUPS = 2000
+
+
+# --- SYNTHETIC DATA ---
+def synthetic_races(seed=DEFAULT_SEED):
+    """Yields the rows of one race at a time, season after season, for as long as asked."""
+    rng = random.Random(seed)
+    athletes = {g: [f"ATHLETE {g}{k:03d}" for k in range(ATHLETES_PER_GENDER)] for g in ("M", "W")}
+    bibs = [info["csv_char"] for info in BIB_DATA.values()]
+    year = 2000
+    while True:
+        year += 1
+        for event in range(1, EVENTS_PER_SEASON + 1):
+            competition = f"World Cup {event}"
+            for gender in ("M", "W"):
+                for phase in PHASES:
+                    yield race_rows(rng, str(year), competition, gender, phase, bibs, rng.sample(athletes[gender], 4))
+
+
+def race_rows(rng, year, competition, gender, phase, bibs, names):
+    """The rows the tagger writes for one race, in the order it writes them."""
+    base = {"Year": year, "Competition": competition, "Gender": gender, "Phase": phase}
+    video = f"https://video.example/{year}/{competition.replace(' ', '')}/{gender}/{phase.replace(' ', '')}"
+    ramp = dict(zip(bibs, rng.sample(range(1, 5), 4)))
+    rows = []
+    for bib, name in zip(bibs, names):
+        rows.append(dict(base, Gate="Ramp", BIB=bib, **{"Ramp Position": ramp[bib], "Action": "Assigned",
+                                                       "Athlete Name": name, "Video Link": video}))
+    starters = [bib for bib in bibs if rng.random() >= DNS_RATE]
+    for bib in bibs:
+        if bib not in starters:
+            rows.append(dict(base, Gate="Start", BIB=bib, **{"Ramp Position": ramp[bib], "Action": "DNS", "Order": 0,
+                                                            "Final Position": "DNS", "Video Link": video}))
+    order = starters[:]
+    if rng.random() < ROLL_RATE:
+        for position, bib in enumerate(rng.sample(order, len(order)), start=1):
+            rows.append(dict(base, Gate="Course", BIB=bib, **{"Ramp Position": ramp[bib], "Action": "Roll",
+                                                             "Order": position, "Video Link": video}))
+    for gate in GATE_ORDER:
+        if rng.random() < 0.3:
+            rng.shuffle(order)  # Overtakes between gates
+        previous = None
+        for position, bib in enumerate(order, start=1):
+            side = rng.choice(["Left", "Right"])
+            if gate in UPSTREAM_GATES:
+                action = f"{side}-Up"
+                tactic = action if previous is None else "FOLLOW" if action == previous else "SPLIT"
+                previous = action
+            else:
+                action, tactic = rng.choice(["Down", f"Down-{side}", "Through"]), ""
+            rows.append(dict(base, Gate=gate, BIB=bib, **{"Ramp Position": ramp[bib], "Action": action, "Order": position,
+                                                         "Upstream Tactic": tactic, "Video Link": video}))
+    faulted = [bib for bib in order if rng.random() < FAULT_RATE]
+    finishers = [bib for bib in order if bib not in faulted] + faulted
+    for position, bib in enumerate(finishers, start=1):
+        stats = f"{rng.uniform(60, 75):.2f}s|{rng.randint(0, 3)} contacts"
+        rows.append(dict(base, Gate="Finish", BIB=bib, **{"Ramp Position": ramp[bib], "Action": "Finish", "Order": position,
+                                                         "Final Position": position, "Video Link": video,
+                                                         "Contest Statistics": stats}))
+    for bib in faulted:
+        gate = rng.choice(GATE_ORDER)
+        for row in rows:
+            if row["Gate"] == gate and row["BIB"] == bib:
+                row["Faults"] = f"FLT {gate.split()[1]}"
+                row["Final Position"] = finishers.index(bib) + 1
+    return rows
+
+
+def synthetic_season(n_rows, seed=DEFAULT_SEED):
+    """A TagTable of exactly `n_rows` synthetic rows (the last race may be cut short)."""
+    table = TagTable(STANDARD_HEADERS + EXTRA_HEADERS)
+    for rows in synthetic_races(seed):
+        for row in rows[:n_rows - len(table)]:
+            table.append(row)
+        if len(table) >= n_rows:
+            return table
+
+
+# --- BENCHMARKS ---
+def best_of(repeat, run):
+    """Best (smallest) result of `repeat` calls of run(), which returns seconds per operation."""
+    return min(run() for _ in range(repeat))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def tag_races(session, races, year, after_tag):
+    """Tags whole races through the session as the tagger would, calling after_tag() after each
+    sequence tag. Returns the seconds each sequence tag took and each after_tag() took."""
+    times, after_times = [], []
+    for race in range(races):
+        session.year, session.comp, session.gender, session.phase = year, "Benchmark Cup", "M", f"Heat {race + 1}"
+        session.change_phase(session.phase)
+        for position, p_key in zip((3, 1, 4, 2), BIB_DATA):
+            session.select_paddler_for_setup(p_key)
+            session.assign_ramp_position(position)
+        for gate in GATE_ORDER:
+            session.select_gate(gate)
+            session.select_action("Up" if gate in UPSTREAM_GATES else "Down")
+            session.select_action("Left")
+            for p_key in BIB_DATA:
+                times.append(timed(session.add_paddler_to_sequence, p_key))
+                after_times.append(timed(after_tag))
+        session.select_action("Finish")
+        for p_key in BIB_DATA:
+            times.append(timed(session.add_paddler_to_sequence, p_key))
+            after_times.append(timed(after_tag))
+    return times, after_times
+
+
+def run_size(n_rows, repeat, workdir, log):
+    """Times every benchmark on a history of `n_rows` rows. Returns {name: seconds per operation}."""
+    started = time.perf_counter()
+    table = synthetic_season(n_rows)
+    log(f"  generated {len(table)} rows in {time.perf_counter() - started:.1f}s")
+    csv_path = os.path.join(workdir, f"bench_{n_rows}.csv")
+    snapshot_path = os.path.join(workdir, f"bench_{n_rows}.snapshot")
+    results = {}
+
+    results["write csv"] = best_of(repeat, lambda: timed(write_csv, csv_path, table))
+    write_snapshot(snapshot_path, table, "benchmark", 0)
+    results["load csv"] = best_of(repeat, lambda: timed(TagArchive(csv_path).read_table))
+    results["load snapshot"] = best_of(repeat, lambda: timed(read_snapshot, snapshot_path))
+    results["index rebuild"] = best_of(repeat, lambda: timed(TagStore, table))
+    results["athlete roster"] = best_of(repeat, lambda: timed(athlete_roster, table))
+
+    races = [(r["Year"], r["Competition"], r["Phase"], r["BIB"]) for r in (table[i] for i in range(0, len(table), 37))]
+    rng = random.Random(DEFAULT_SEED)
+    lookups = [rng.choice(races) for _ in range(LOOKUPS)]
+    store = TagStore(table)
+
+    def athlete_lookups():
+        start = time.perf_counter()
+        for year, competition, phase, bib in lookups:
+            store.athlete_name((year, competition, phase), bib)
+        return (time.perf_counter() - start) / len(lookups)
+    results["athlete lookup"] = best_of(repeat, athlete_lookups)
+
+    def tagging():
+        # A fresh copy of the history each run, journalled as the tagger journals it
+        archive = TagArchive(csv_path)
+        archive.open_journal()
+        archive.journal.write_behind = True  # As in the tagger, which flushes on its writer thread
+        try:
+            session = TaggingSession(TagStore(table.copy(), journal=archive.journal))
+            tag_times, flush_times = tag_races(session, TAG_RACES, "2999", archive.journal.flush)
+            fault_times = []
+            for bibs, faults in ((["P2"], {"3", "Roll"}), (["P4"], {"7"})):
+                fault_times.append(timed(session.finalize_fault_tag, bibs, faults))
+            export = timed(archive.export, session.store.rows)
+            return statistics.median(tag_times), statistics.median(flush_times), statistics.median(fault_times), export
+        finally:
+            archive.close()
+            # Back to the plain history for the next run
+            os.remove(archive.journal.path)
+            write_csv(csv_path, table)
+
+    runs = [tagging() for _ in range(repeat)]
+    results["tag"] = min(run[0] for run in runs)
+    results["fault entry"] = min(run[2] for run in runs)
+    results["journal flush"] = min(run[1] for run in runs)
+    results["export append"] = min(run[3] for run in runs)
+    return results
+
+
+# --- BASELINE ---
+def read_baseline(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_baseline(path, results, repeat):
+    data = {
+        "written": datetime.now().isoformat(timespec="seconds"),
+        "machine": f"{platform.platform()}, {platform.processor() or platform.machine()}",
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "results": results,
+    }
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.write("\n")
+    os.replace(path + ".tmp", path)
+
+
+def compare(results, baseline, tolerance):
+    """Returns [(size, benchmark, seconds, baseline seconds)] for results over tolerance x baseline."""
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, seconds in benchmarks.items():
+            expected = baseline.get("results", {}).get(size, {}).get(name)
+            if expected and seconds > expected * tolerance:
+                regressions.append((size, name, seconds, expected))
+    return regressions
+
+
+def format_seconds(seconds):
+    return f"{seconds * 1000:10.3f} ms" if seconds < 1 else f"{seconds:10.3f} s "
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the tagging hot paths on synthetic seasons of data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="history sizes in rows (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs per benchmark, best counts (default: %(default)s)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline results file (default: %(default)s)")
+    parser.add_argument("--save", action="store_true", help="record these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="report results slower than this many times the baseline (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if args.repeat < 1 or any(size < 1 for size in args.sizes):
+        parser.error("--repeat and --sizes must be positive")
+
+    baseline = None if args.save else read_baseline(args.baseline)
+    workdir = tempfile.mkdtemp(prefix="kx_bench_")
+    results = {}
+    try:
+        for size in args.sizes:
+            print(f"{size} rows:")
+            results[str(size)] = run_size(size, args.repeat, workdir, print)
+            for name, seconds in results[str(size)].items():
+                expected = (baseline or {}).get("results", {}).get(str(size), {}).get(name)
+                versus = f"  ({seconds / expected:.2f}x baseline)" if expected else ""
+                print(f"  {name:16}{format_seconds(seconds)}{versus}")
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        try:
+            write_baseline(args.baseline, results, args.repeat)
+        except OSError as e:
+            print(f"ERROR: Could not write baseline {args.baseline}: {e}", file=sys.stderr)
+            return 1
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --save to record one.")
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for size, name, seconds, expected in regressions:
+        print(f"REGRESSION: {name} at {size} rows took {seconds / expected:.2f}x the baseline "
+              f"({format_seconds(seconds).strip()} vs {format_seconds(expected).strip()})")
+    if regressions:
+        return 1
+    print(f"No regressions beyond {args.tolerance}x the baseline from {baseline.get('written', '?')}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""Memory footprint of a loaded tag history, per row, with budgets.
+
+Loads synthetic histories (benchmark.synthetic_season) of increasing size in each
+of the ways the tag history can be held in memory:
+
+    dict rows          list(csv.DictReader): one dict per row, as the tagger used to
+    columns (csv)      TagTable parsed from the CSV (startup without a snapshot)
+    columns (snapshot) TagTable read from the binary snapshot (normal startup)
+    columns (sqlite)   TagTable read from the SQLite backend (tag_sqlite.py)
+    tagger             snapshot TagTable plus the race index: what the tagger holds
+
+Every load runs in a fresh Python process, twice: once under tracemalloc for the
+bytes Python allocates, once without it for the process RSS. Both are reported
+as bytes per row:
+
+    steady    still held after loading (the result kept, garbage collected)
+    peak      the most used while loading
+
+Budgets (memory_budgets.json next to this file, or --budgets) cap any of
+steady_traced, peak_traced, steady_rss and peak_rss per representation, in
+bytes per row, for histories of at least "min_rows" rows (below that the fixed
+cost of loading anything dominates). A result over its budget fails the run
+with exit status 1.
+RSS is measured where the platform reports it (peak everywhere but Windows,
+steady on Linux); tracemalloc figures are exact and the same on every machine.
+
+    python benchmark_memory.py                          10k, 100k and 1M rows
+    python benchmark_memory.py --sizes 10000 100000 --only tagger "dict rows"
+"""
+import argparse
+import csv
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+from benchmark import DEFAULT_SIZES, synthetic_season
+from tag_archive import TagArchive, write_csv
+from tag_snapshot import read_snapshot, write_snapshot
+from tag_sqlite import SqliteArchive
+from tag_store import TagStore
+
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "memory_budgets.json")
+METRICS = ("steady_traced", "peak_traced", "steady_rss", "peak_rss")
+CHILD_TIMEOUT_SECONDS = 1800
+
+
+# --- LOADING (in the child process) ---
+def load_dict_rows(paths):
+    with open(paths["csv"], "r", newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def load_csv_columns(paths):
+    return TagArchive(paths["csv"]).read_table()
+
+
+def load_snapshot_columns(paths):
+    return read_snapshot(paths["snapshot"])[0]
+
+
+def load_sqlite_columns(paths):
+    return SqliteArchive(paths["csv"]).read_table()
+
+
+def load_tagger(paths):
+    return TagStore(read_snapshot(paths["snapshot"])[0])
+
+
+REPRESENTATIONS = {
+    "dict rows": load_dict_rows,
+    "columns (csv)": load_csv_columns,
+    "columns (snapshot)": load_snapshot_columns,
+    "columns (sqlite)": load_sqlite_columns,
+    "tagger": load_tagger,
+}
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    """Most RSS this process has used so far, in bytes, or None without the resource module."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports kilobytes
+
+
+def measure(representation, paths, traced):
+    """Loads once and returns the memory figures in bytes (not per row)."""
+    load = REPRESENTATIONS[representation]
+    gc.collect()
+    if traced:
+        tracemalloc.start()
+        result = load(paths)
+        gc.collect()
+        steady, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {"steady_traced": steady, "peak_traced": peak}
+    rss_before, peak_before = current_rss(), peak_rss()
+    result = load(paths)
+    gc.collect()
+    rss_after, peak_after = current_rss(), peak_rss()
+    del result
+    # Without the current RSS, the peak so far stands in for it (so the load's peak may be understated)
+    base = rss_before if rss_before is not None else peak_before
+    return {
+        "steady_rss": None if rss_before is None else rss_after - rss_before,
+        "peak_rss": None if peak_after is None else peak_after - base,
+    }
+
+
+def child_main(representation, paths_json, traced):
+    print(json.dumps(measure(representation, json.loads(paths_json), traced)))
+    return 0
+
+
+# --- HARNESS ---
+def prepare(n_rows, workdir):
+    """Writes the CSV, snapshot and SQLite database of a synthetic history. Returns their paths."""
+    table = synthetic_season(n_rows)
+    csv_path = os.path.join(workdir, f"memory_{n_rows}.csv")
+    write_csv(csv_path, table)
+    snapshot_path = os.path.join(workdir, f"memory_{n_rows}.snapshot")
+    write_snapshot(snapshot_path, table, "benchmark", 0)
+    database = SqliteArchive(csv_path)
+    try:
+        database.open_journal()
+        database.save_all(table)
+    finally:
+        database.close()
+    return {"csv": csv_path, "snapshot": snapshot_path}
+
+
+def run_child(representation, paths, traced):
+    command = [sys.executable, os.path.abspath(__file__), "--child", representation, json.dumps(paths)]
+    if traced:
+        command.append("--traced")
+    done = subprocess.run(command, capture_output=True, text=True, timeout=CHILD_TIMEOUT_SECONDS)
+    if done.returncode != 0:
+        raise RuntimeError(f"loading {representation} failed:\n{done.stderr.strip()}")
+    return json.loads(done.stdout)
+
+
+def measure_per_row(representation, paths, n_rows):
+    figures = run_child(representation, paths, traced=True)
+    figures.update(run_child(representation, paths, traced=False))
+    return {metric: None if figures.get(metric) is None else figures[metric] / n_rows for metric in METRICS}
+
+
+def read_budgets(path):
+    """Returns {"min_rows": ..., "bytes_per_row": {representation: {metric: budget}}}, empty if there is no file."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            budgets = json.load(f)
+    except FileNotFoundError:
+        return {"min_rows": 0, "bytes_per_row": {}}
+    if not isinstance(budgets.get("bytes_per_row"), dict):
+        raise ValueError('no "bytes_per_row" budgets')
+    return budgets
+
+
+def over_budget(representation, n_rows, per_row, budgets):
+    """Returns [(metric, bytes per row, budget)] for every budgeted figure that is over."""
+    if n_rows < budgets.get("min_rows", 0):
+        return []
+    limits = budgets["bytes_per_row"].get(representation, {})
+    return [(metric, per_row[metric], limits[metric]) for metric in METRICS
+            if metric in limits and per_row.get(metric) is not None and per_row[metric] > limits[metric]]
+
+
+def format_bytes(value):
+    return f"{'-':>9}" if value is None else f"{value:9.0f}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the memory a loaded tag history takes, per row.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="history sizes in rows (default: %(default)s)")
+    parser.add_argument("--only", nargs="+", choices=list(REPRESENTATIONS), help="representations to measure (default: all)")
+    parser.add_argument("--budgets", default=BUDGETS_PATH, help="budgets file, bytes per row (default: %(default)s)")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--child", nargs=2, metavar=("REPRESENTATION", "PATHS"), help=argparse.SUPPRESS)
+    parser.add_argument("--traced", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        return child_main(args.child[0], args.child[1], args.traced)
+    if any(size < 1 for size in args.sizes):
+        parser.error("--sizes must be positive")
+
+    try:
+        budgets = read_budgets(args.budgets)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: Could not read budgets {args.budgets}: {e}", file=sys.stderr)
+        return 1
+    representations = args.only or list(REPRESENTATIONS)
+    workdir = tempfile.mkdtemp(prefix="kx_memory_")
+    results, failures = {}, []
+    try:
+        for size in args.sizes:
+            started = time.perf_counter()
+            paths = prepare(size, workdir)
+            print(f"{size} rows (prepared in {time.perf_counter() - started:.1f}s), bytes per row:")
+            print(f"  {'':20}" + "".join(f"{metric:>15}" for metric in METRICS))
+            results[str(size)] = {}
+            for representation in representations:
+                per_row = measure_per_row(representation, paths, size)
+                results[str(size)][representation] = per_row
+                over = over_budget(representation, size, per_row, budgets)
+                failures += [(size, representation) + item for item in over]
+                print(f"  {representation:20}" + "".join(f"{format_bytes(per_row[m]):>15}" for m in METRICS)
+                      + ("  OVER BUDGET" if over else ""))
+    except (OSError, ValueError, RuntimeError, subprocess.TimeoutExpired) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"budgets": budgets, "results": results}, f, indent=1)
+    for size, representation, metric, value, limit in failures:
+        print(f"BUDGET EXCEEDED: {representation} at {size} rows uses {value:.0f} bytes per row ({metric}), budget {limit}")
+    if failures:
+        return 1
+    print("All results within budget." if budgets["bytes_per_row"] else f"No budgets at {args.budgets}; nothing was checked.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
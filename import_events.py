@@ -0,0 +1,141 @@
+"""Merges per-event tag CSVs into the master tag file, parsing them in parallel.
+
+Each file (in the shape of kx_race_analysis_git.csv or
+Kayak_Cross_Data_IN_COMPETITION.csv) is parsed by its own worker process, so a
+season of event files loads in about the time of the biggest one. The merge
+itself is deterministic whichever worker finishes first:
+
+- every race (Year, Competition, Location, Gender, Phase) found in the imported
+  files replaces that race's rows in the master file, so importing a corrected
+  file twice is safe, and a file holding part of an event (one gender or one
+  venue) leaves the rest of the event alone; the races replaced are listed;
+- master rows of other events keep their order, and imported rows follow them,
+  file by file in the order given on the command line;
+- the columns are the union of all files, written standard headers first and
+  extra columns alphabetically, as the tagger writes them.
+
+The master file is rewritten atomically, together with any journalled tags not
+yet exported; close the tagger first. Data from an older version is used as it
+is, unless --upgrade is given; --dry-run writes nothing at all.
+
+    python import_events.py event1.csv [event2.csv ...] [--data PATH] [--workers N] [--dry-run | --upgrade]
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from tag_archive import DEFAULT_DATA_PATH, open_archive
+from tag_schema import RACE_FIELDS
+from tag_table import TagTable
+
+EVENT_FIELDS = ("Year", "Competition")  # How each file is summed up; rows are replaced race by race
+REQUIRED_HEADERS = ("Year", "Competition", "Gender", "Phase", "Gate", "BIB")
+
+
+class ImportFileError(Exception):
+    """An event file that is not a tag CSV."""
+
+
+def read_event_file(path):
+    """Parses one event CSV into a TagTable (runs in a worker process)."""
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        table = TagTable.from_csv(f)
+    missing = [h for h in REQUIRED_HEADERS if h not in table.columns]
+    if missing:
+        raise ImportFileError(f"{path}: not a tag file, missing columns: {', '.join(missing)}")
+    return table
+
+
+def read_event_files(paths, workers=None):
+    """Parses the files in a process pool. Tables come back in `paths` order."""
+    workers = workers or min(len(paths), os.cpu_count() or 1)
+    if workers <= 1 or len(paths) <= 1:
+        return [read_event_file(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(read_event_file, paths))
+
+
+def event_keys(table):
+    return table.distinct(*EVENT_FIELDS)
+
+
+def race_fields(table):
+    """The race fields a table has: all of RACE_FIELDS, or all but Location in files without it."""
+    return tuple(field for field in RACE_FIELDS if field in table.columns)
+
+
+def merge_events(master, tables):
+    """Returns (merged table, {master race: rows replaced}): master rows of races not being
+    imported in their original order, followed by each imported table in turn. A table
+    without a Location column replaces the races with its other fields at any venue."""
+    replaced = set()
+    for table in tables:
+        fields = race_fields(table)
+        imported = table.distinct(*fields)
+        master_races = zip(*(master.column_values(field) for field in fields))
+        replaced.update(i for i, race in enumerate(master_races) if race in imported)
+    keep = [i for i in range(len(master)) if i not in replaced]
+    dropped = {}
+    master_races = list(zip(*(master.column_values(field) for field in RACE_FIELDS)))
+    for i in sorted(replaced):
+        dropped[master_races[i]] = dropped.get(master_races[i], 0) + 1
+    merged = master.take(keep)
+    for table in tables:
+        merged.extend(table)
+    return merged, dropped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge per-event tag CSVs into the master tag file.")
+    parser.add_argument("files", nargs="+", help="event CSV files to import")
+    parser.add_argument("--data", default=DEFAULT_DATA_PATH, help="master tag CSV (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per file, up to the CPU count)")
+    parser.add_argument("--dry-run", action="store_true", help="merge and report, but do not write anything")
+    parser.add_argument("--upgrade", action="store_true", help="upgrade master data from an older version first")
+    args = parser.parse_args(argv)
+    if args.dry_run and args.upgrade:
+        parser.error("--upgrade rewrites the master file, so it cannot be combined with --dry-run")
+
+    archive = open_archive(args.data)
+    try:
+        started = time.perf_counter()
+        tables = read_event_files(args.files, args.workers)
+        parsed = time.perf_counter() - started
+
+        seen = {}
+        for path, table in zip(args.files, tables):
+            events = sorted(event_keys(table))
+            print(f"{path}: {len(table)} rows, events: {', '.join(' '.join(e) for e in events)}")
+            for race in sorted(table.distinct(*race_fields(table))):
+                if race in seen:
+                    print(f"WARNING: {' '.join(race)} is in both {seen[race]} and {path}; keeping both", file=sys.stderr)
+                seen.setdefault(race, path)
+
+        master = archive.load_all(upgrade=args.upgrade, readonly=args.dry_run)
+        for message in archive.migration_messages():
+            print(message)
+        for warning in archive.journal_warnings() + archive.schema_warnings():
+            print(warning, file=sys.stderr)
+        merged, dropped = merge_events(master, tables)
+        for race, rows in dropped.items():
+            print(f"Replacing {' '.join(part for part in race if part)}: {rows} master rows")
+        print(f"Parsed {len(args.files)} files in {parsed:.2f}s; replaced {sum(dropped.values())} existing rows "
+              f"in {len(dropped)} races, {len(master)} -> {len(merged)} rows")
+        if args.dry_run:
+            print("Dry run: nothing written.")
+        else:
+            archive.save_all(merged)
+            print(f"Saved {len(merged)} rows to {args.data}")
+    except (ImportFileError, OSError, ValueError, csv.Error) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    finally:
+        archive.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
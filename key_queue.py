@@ -0,0 +1,71 @@
+"""Timestamped, lossless queue of tagging keypresses.
+
+Tk stamps every key event with the time the windowing system saw the key
+(`event.time`: milliseconds from an arbitrary start, wrapping every ~49 days).
+`KeyQueue` turns that into wall-clock time as soon as the event reaches Python,
+so when four boats go through a gate within a second each tag keeps the time
+its key was pressed, however long the handlers before it took.
+
+Keys are handled strictly in arrival order. A key that arrives while another is
+being handled (from a nested event loop) waits its turn instead of jumping the
+queue, and a handler that fails leaves the keys behind it queued, not dropped.
+"""
+import time
+from collections import deque, namedtuple
+
+KeyPress = namedtuple("KeyPress", "char keysym time")
+
+# An event clock running this much further behind than before has wrapped or been
+# reset; it is not that late an event
+CLOCK_RESYNC_SECONDS = 60.0
+
+
+def format_key_time(timestamp):
+    """HH:MM:SS.mmm local time of a key press."""
+    return time.strftime("%H:%M:%S", time.localtime(timestamp)) + f".{int(timestamp * 1000) % 1000:03d}"
+
+
+class KeyQueue:
+    """Keypresses waiting to be handled, each with the wall-clock time it was pressed."""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.received = 0
+        self.handled = 0
+        self.max_backlog = 0
+        self._keys = deque()
+        self._offset = None   # Wall clock minus event clock, the smallest seen (least delayed)
+        self._draining = False
+
+    def __len__(self):
+        return len(self._keys)
+
+    def push(self, char, keysym, event_ms=0):
+        """Queues a key. `event_ms` is the event's own timestamp (Tk's event.time); without
+        one (synthetic events) the key is stamped with the time it was pushed."""
+        self._keys.append(KeyPress(char, keysym, self._press_time(self.clock(), event_ms)))
+        self.received += 1
+        self.max_backlog = max(self.max_backlog, len(self._keys))
+
+    def drain(self, handle):
+        """Calls handle(key) for every queued key in arrival order, including keys pushed
+        meanwhile. Does nothing if a drain further up the stack is already running it."""
+        if self._draining:
+            return
+        self._draining = True
+        try:
+            while self._keys:
+                key = self._keys.popleft()
+                self.handled += 1
+                handle(key)
+        finally:
+            self._draining = False
+
+    def _press_time(self, now, event_ms):
+        if not isinstance(event_ms, int) or event_ms <= 0:
+            return now
+        offset = now - event_ms / 1000
+        # Every event reaches us after it happened, so the smallest offset is the truest
+        if self._offset is None or offset < self._offset or offset > self._offset + CLOCK_RESYNC_SECONDS:
+            self._offset = offset
+        return event_ms / 1000 + self._offset
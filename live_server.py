@@ -0,0 +1,284 @@
+"""Optional local server that streams tags to report pages as they are saved.
+
+Started from the tagger (python tagger.py --live), it runs an asyncio loop on its
+own thread and speaks just enough HTTP for:
+
+    GET /events      Server-Sent Events: one "tag" event per add, undo or amend,
+                     {"seq", "op", "index", "row"}; a "reset" event when the
+                     whole history was replaced and clients should reload
+    GET /snapshot    the current tags as CSV, with the sequence number they are
+                     up to in the X-Live-Seq header, for pages joining late
+    GET /status      {"seq", "rows", "clients"}
+    GET /<file>      the report pages and the data files they load (PUBLIC_PAGES,
+                     publish.PUBLISHED_FILES and their published copies, the
+                     partition CSVs and course maps under data/), so coaches on
+                     the venue network can open http://<laptop>:8765/ directly;
+                     anything else in the checkout (journals, databases,
+                     dotfiles) is a 404
+
+A page loads /snapshot, then follows /events?since=<X-Live-Seq>. A client that
+reconnects gets the events it missed from a short backlog (EventSource sends
+Last-Event-ID by itself), or a "reset" if it was gone too long. The server keeps
+its own copy of the rows, so it never touches the tagger's table from its thread.
+"""
+import asyncio
+import json
+import mimetypes
+import os
+import posixpath
+import socket
+import threading
+from collections import deque
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from publish import HASHED_NAME_PATTERN, INDEX_NAME, PUBLISHED_DIR, PUBLISHED_FILES
+
+from tag_archive import render_csv
+from tag_journal import apply_records
+from tag_store import STANDARD_HEADERS
+from tag_table import TagTable
+
+DEFAULT_PORT = 8765
+# Events kept for clients that reconnect; a slower client is dropped and reconnects
+BACKLOG_EVENTS = 2000
+KEEPALIVE_SECONDS = 15
+STATIC_DIR = os.path.dirname(os.path.abspath(__file__))
+START_PAGE = "/in_competition.html?live"
+# Files the report pages need besides the data, relative to STATIC_DIR
+PUBLIC_PAGES = {"in_competition.html", "report_code.html", "whitewater_course.png"}
+PUBLIC_DATA = {f"data/{name}" for name in PUBLISHED_FILES} | {f"data/{INDEX_NAME}"}
+
+
+def lan_address():
+    """This machine's address on the local network, for telling coaches where to connect."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("10.255.255.255", 1))  # No packet is sent; this just picks the outgoing interface
+            return s.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+
+
+def is_public(path):
+    """True for the URL paths the server hands out files for: the report pages and the
+    published data. Everything else in the checkout stays private."""
+    path = unquote(path).lstrip("/")
+    parts = path.split("/")
+    if any(not part or part.startswith(".") for part in parts) or posixpath.normpath(path) != path:
+        return False
+    if path in PUBLIC_PAGES or path in PUBLIC_DATA:
+        return True
+    folder, name = posixpath.split(path)
+    if folder == f"data/{PUBLISHED_DIR}":
+        return bool(HASHED_NAME_PATTERN.search(name))
+    if folder == "data/course_maps":
+        return name.lower().endswith(".png")
+    # Partition files and the published copies of the manifest, not the journal or snapshot
+    return (path.startswith("data/partitions/")
+            and (name.endswith(".csv") or bool(HASHED_NAME_PATTERN.search(name))))
+
+
+class LiveServer:
+    """Streams tag changes to connected pages over SSE from a background asyncio loop."""
+
+    def __init__(self, host="0.0.0.0", port=DEFAULT_PORT, static_dir=STATIC_DIR):
+        self.host = host
+        self.port = port
+        self.static_dir = static_dir
+        # Only touched on the server thread
+        self.rows = TagTable(STANDARD_HEADERS)
+        self.seq = 0
+        self.backlog = deque(maxlen=BACKLOG_EVENTS)  # (seq, SSE message bytes)
+        self.clients = set()                         # One asyncio.Queue per /events connection
+        self._snapshot = (None, b"")                 # (seq, CSV bytes) of the last /snapshot
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+        self._start_error = None
+
+    @property
+    def url(self):
+        host = lan_address() if self.host in ("", "0.0.0.0") else self.host
+        return f"http://{host}:{self.port}/"
+
+    # --- CALLED FROM THE TAGGER ---
+    def start(self):
+        """Binds the port and starts serving on a daemon thread. Raises OSError if the port is taken."""
+        self._thread = threading.Thread(target=self._run, name="live-server", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        if self._start_error:
+            raise self._start_error
+
+    def stop(self):
+        if self._loop and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._stop)
+            self._thread.join(timeout=2)
+
+    def reset(self, table):
+        """Replaces all rows (a TagTable the caller no longer changes, e.g. a copy)."""
+        self._call(self._reset, table)
+
+    def row_changed(self, op, index, row):
+        """Publishes one store change; fits TagStore.on_row_change."""
+        record = {"op": op, "index": index}
+        if op != "undo":
+            record["row"] = {header: "" if value is None else str(value) for header, value in row.items()}
+        self._call(self._publish, record)
+
+    def _call(self, method, *args):
+        if self._loop and self._loop.is_running():
+            self._loop.call_soon_threadsafe(method, *args)
+
+    # --- SERVER THREAD ---
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        except OSError as e:
+            self._start_error = e
+            self._started.set()
+            return
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            # Let the connections still open finish, so nothing is left pending
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            if tasks:
+                self._loop.run_until_complete(asyncio.wait(tasks, timeout=1))
+            self._loop.close()
+
+    def _reset(self, table):
+        self.rows = table
+        self.seq += 1
+        self.backlog.clear()
+        self._broadcast(self.seq, f"id: {self.seq}\nevent: reset\ndata: {json.dumps({'seq': self.seq})}\n\n".encode("utf-8"))
+
+    def _publish(self, record):
+        if record["op"] == "amend":
+            apply_records(self.rows, [{"op": "amend", "index": record["index"], "fields": record["row"]}])
+        else:
+            apply_records(self.rows, [record])
+        self.seq += 1
+        data = json.dumps(dict(record, seq=self.seq), separators=(",", ":"))
+        message = f"id: {self.seq}\nevent: tag\ndata: {data}\n\n".encode("utf-8")
+        self.backlog.append((self.seq, message))
+        self._broadcast(self.seq, message)
+
+    def _stop(self):
+        for queue in list(self.clients):
+            self._hang_up(queue)
+        self._loop.stop()
+
+    def _broadcast(self, seq, message):
+        for queue in list(self.clients):
+            try:
+                queue.put_nowait((seq, message))
+            except asyncio.QueueFull:
+                # Too far behind to keep up; it reconnects and starts again from a reset
+                self._hang_up(queue)
+
+    def _hang_up(self, queue):
+        """Ends an /events stream after whatever it is sending now."""
+        self.clients.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait((None, None))
+
+    def _missed(self, since):
+        """SSE messages a client up to `since` needs, or None if the backlog does not reach back."""
+        if since >= self.seq:
+            return []
+        if not self.backlog or self.backlog[0][0] > since + 1:
+            return None
+        return [message for seq, message in self.backlog if seq > since]
+
+    # --- HTTP ---
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            parts = request.decode("latin-1").split()
+            if len(parts) < 2:
+                return
+            method, target = parts[0], urlsplit(parts[1])
+            if method == "OPTIONS":
+                await self._respond(writer, 204, b"")
+            elif method != "GET":
+                await self._respond(writer, 405, b"Method not allowed\n")
+            elif target.path == "/events":
+                await self._events(writer, target, headers)
+            elif target.path == "/snapshot":
+                await self._send_snapshot(writer)
+            elif target.path == "/status":
+                body = json.dumps({"seq": self.seq, "rows": len(self.rows), "clients": len(self.clients)}).encode("utf-8")
+                await self._respond(writer, 200, body, "application/json")
+            elif target.path == "/":
+                await self._respond(writer, 302, b"", extra={"Location": START_PAGE})
+            else:
+                await self._send_file(writer, target.path)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, body, content_type="text/plain; charset=utf-8", extra=None):
+        reason = {200: "OK", 204: "No Content", 302: "Found", 404: "Not Found", 405: "Method Not Allowed"}[status]
+        lines = [f"HTTP/1.1 {status} {reason}", f"Content-Type: {content_type}", f"Content-Length: {len(body)}",
+                 "Cache-Control: no-store", "Connection: close", "Access-Control-Allow-Origin: *",
+                 "Access-Control-Allow-Headers: Last-Event-ID", "Access-Control-Expose-Headers: X-Live-Seq"]
+        lines += [f"{name}: {value}" for name, value in (extra or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _send_snapshot(self, writer):
+        if self._snapshot[0] != self.seq:
+            self._snapshot = (self.seq, render_csv(self.rows))
+        seq, body = self._snapshot
+        await self._respond(writer, 200, body, "text/csv; charset=utf-8", extra={"X-Live-Seq": seq})
+
+    async def _send_file(self, writer, path):
+        full_path = os.path.realpath(os.path.join(self.static_dir, unquote(path).lstrip("/")))
+        if (not is_public(path) or not full_path.startswith(os.path.realpath(self.static_dir) + os.sep)
+                or not os.path.isfile(full_path)):
+            await self._respond(writer, 404, b"Not found\n")
+            return
+        with open(full_path, "rb") as f:
+            body = f.read()
+        await self._respond(writer, 200, body, mimetypes.guess_type(full_path)[0] or "application/octet-stream")
+
+    async def _events(self, writer, target, headers):
+        since = headers.get("last-event-id") or parse_qs(target.query).get("since", [""])[0]
+        queue = asyncio.Queue(BACKLOG_EVENTS)
+        writer.write(("HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-store\r\n"
+                      "Connection: keep-alive\r\nAccess-Control-Allow-Origin: *\r\n\r\n"
+                      "retry: 2000\n\n").encode("latin-1"))
+        missed = self._missed(int(since)) if since.isdigit() else None
+        if missed is None:
+            # New or too far behind: start from a fresh snapshot
+            writer.write(f"id: {self.seq}\nevent: reset\ndata: {json.dumps({'seq': self.seq})}\n\n".encode("utf-8"))
+        else:
+            writer.writelines(missed)
+        self.clients.add(queue)
+        try:
+            await writer.drain()
+            while True:
+                try:
+                    _, message = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    message = b": keepalive\n\n"
+                if message is None:
+                    break
+                writer.write(message)
+                await writer.drain()
+        finally:
+            self.clients.discard(queue)
@@ -0,0 +1,190 @@
+"""Publishes the report's data files under content-hash names, for browser caching.
+
+The report used to fetch every CSV with a cache-busting ?t= parameter, so each
+visit downloaded everything again. This copies each data file to
+data/published/<name>-<hash>.<ext> and writes data/published.json mapping the
+file names the report knows to those copies:
+
+    {"version": 1, "files": {"kx_race_analysis_git.csv": "published/kx_race_analysis_git-3f9c0a1b2d.csv", ...}}
+
+The report fetches only published.json fresh. A hashed copy never changes, so
+the browser keeps it until the data does. Partitioned data (tag_partitions.py)
+gets a hashed copy of its manifest beside it in partitions/; the partition
+files already have content-hash names.
+
+Copies the previous published.json referred to are kept, for visitors who are
+partway through loading it; older ones are removed.
+
+The tag data is checked race by race first (tag_integrity.py), the Full Report
+data wherever it is kept (partitions, SQLite or the CSV); nothing is published
+while it has violations, unless --skip-checks is given.
+
+race_analytics.json is rebuilt from the Full Report data (the partitions if
+there are any, else kx_race_analysis_git.csv) before anything is copied. The
+tagger keeps it current, but batch tools (tag_stations.py merge, tag_sqlite.py
+export, tag_partitions.py join) and hand edits change the data without it, and
+the report can only compare row counts.
+
+    python publish.py [DATA_DIR] [--skip-checks]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+
+from race_analytics import RaceAnalytics, save_analytics
+from tag_archive import TagArchive, open_archive
+from tag_integrity import check_table, format_violation
+from tag_partitions import MANIFEST_NAME, read_partitions
+from tag_table import TagTable
+
+# The data files report_code.html loads, relative to the data directory
+PUBLISHED_FILES = [
+    "kx_race_analysis_git.csv",
+    "Kayak_Cross_Data_IN_COMPETITION.csv",
+    "kayak_timetrial.csv",
+    "race_analytics.json",
+    f"partitions/{MANIFEST_NAME}",
+]
+# The Full Report data race_analytics.json summarises, as the report loads it
+ANALYTICS_SOURCE = "kx_race_analysis_git.csv"
+# The tag data among them; only the Full Report data (the tagger's) may be kept elsewhere
+TAG_FILES = [ANALYTICS_SOURCE, "Kayak_Cross_Data_IN_COMPETITION.csv"]
+ANALYTICS_NAME = "race_analytics.json"
+INDEX_NAME = "published.json"
+INDEX_VERSION = 1
+PUBLISHED_DIR = "published"
+HASHED_NAME_PATTERN = re.compile(r"-[0-9a-f]{10}\.(csv|json)$")
+VIOLATIONS_SHOWN = 20
+
+
+def hashed_name(name, data):
+    """Path of the published copy of `name`: published/<stem>-<hash><ext>, except that the
+    partition manifest stays in partitions/ so its relative partition paths still work."""
+    stem, ext = os.path.splitext(name)
+    digest = hashlib.sha1(data).hexdigest()[:10]
+    folder = os.path.dirname(name) or PUBLISHED_DIR
+    return f"{folder}/{os.path.basename(stem)}-{digest}{ext}"
+
+
+def check_data(data_dir):
+    """Integrity violations of each published tag dataset that has any, as {name: violations}."""
+    found = {}
+    for name in TAG_FILES:
+        path = os.path.join(data_dir, name)
+        # partitions/ belongs to the directory, not to every CSV in it
+        archive = open_archive(path) if name == ANALYTICS_SOURCE else TagArchive(path)
+        if not os.path.isfile(archive.csv_path):
+            continue
+        table = archive.read_table()
+        violations = check_table(table) if table is not None else []
+        if violations:
+            found[name] = violations
+    return found
+
+
+def refresh_analytics(data_dir):
+    """Rebuilds race_analytics.json from the rows the report loads. Returns their count,
+    or None if there is no Full Report data to summarise."""
+    if os.path.isfile(os.path.join(data_dir, "partitions", MANIFEST_NAME)):
+        table = read_partitions(os.path.join(data_dir, "partitions"))
+    elif os.path.isfile(os.path.join(data_dir, ANALYTICS_SOURCE)):
+        with open(os.path.join(data_dir, ANALYTICS_SOURCE), "r", newline="", encoding="utf-8-sig") as f:
+            table = TagTable.from_csv(f)
+    else:
+        return None
+    save_analytics(RaceAnalytics.from_table(table), os.path.join(data_dir, ANALYTICS_NAME))
+    return len(table)
+
+
+def read_index(data_dir):
+    try:
+        with open(os.path.join(data_dir, INDEX_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def publish(data_dir):
+    """Writes the hashed copies and published.json. Returns (index, copies written)."""
+    files, written = {}, 0
+    for name in PUBLISHED_FILES:
+        path = os.path.join(data_dir, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        target = hashed_name(name, data)
+        files[name] = target
+        target_path = os.path.join(data_dir, target)
+        if not os.path.isfile(target_path):
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            with open(target_path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(target_path + ".tmp", target_path)
+            written += 1
+
+    previous = read_index(data_dir)
+    index = {"version": INDEX_VERSION, "files": files}
+    index_path = os.path.join(data_dir, INDEX_NAME)
+    with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+    os.replace(index_path + ".tmp", index_path)
+
+    keep = set(files.values())
+    if previous:
+        keep.update(previous.get("files", {}).values())
+    remove_stale_copies(data_dir, keep)
+    return index, written
+
+
+def remove_stale_copies(data_dir, keep):
+    """Deletes hashed copies of published files that no index still refers to."""
+    stems = {os.path.splitext(os.path.basename(name))[0] for name in PUBLISHED_FILES}
+    keep = {os.path.normpath(path) for path in keep}
+    for folder in {PUBLISHED_DIR} | {os.path.dirname(name) for name in PUBLISHED_FILES if os.path.dirname(name)}:
+        try:
+            names = os.listdir(os.path.join(data_dir, folder))
+        except FileNotFoundError:
+            continue
+        for name in names:
+            match = HASHED_NAME_PATTERN.search(name)
+            path = os.path.normpath(os.path.join(folder, name))
+            if match and name[:match.start()] in stems and path not in keep:
+                os.remove(os.path.join(data_dir, path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publish the report's data files under content-hash names.")
+    parser.add_argument("data_dir", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"),
+                        help="data directory next to the report (default: %(default)s)")
+    parser.add_argument("--skip-checks", action="store_true", help="publish even if the tag CSVs fail the integrity checks")
+    args = parser.parse_args(argv)
+    try:
+        found = {} if args.skip_checks else check_data(args.data_dir)
+        if found:
+            for name, violations in found.items():
+                for violation in violations[:VIOLATIONS_SHOWN]:
+                    print(f"{name}: {format_violation(violation)}")
+                if len(violations) > VIOLATIONS_SHOWN:
+                    print(f"{name}: ... and {len(violations) - VIOLATIONS_SHOWN} more (python tag_integrity.py lists them all)")
+            total = sum(map(len, found.values()))
+            print(f"ERROR: {total} integrity violations, nothing published. Fix them or pass --skip-checks.", file=sys.stderr)
+            return 1
+        analytics_rows = refresh_analytics(args.data_dir)
+        index, written = publish(args.data_dir)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    if analytics_rows is not None:
+        print(f"Rebuilt {ANALYTICS_NAME} from {analytics_rows} rows")
+    for name, target in index["files"].items():
+        print(f"{name:<40} -> {target}")
+    print(f"Published {len(index['files'])} files ({written} new copies) in {os.path.join(args.data_dir, INDEX_NAME)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1014 @@
+"""Precomputed race analytics for the HTML report.
+
+`report_code.html` downloads the raw tag CSV and works out race results,
+upstream tactics, the 1st-upstream-by-position report and every athlete's
+season summary in the browser. This module computes the same aggregates once,
+in Python, and writes them to a compact JSON file the report loads instead, so
+opening the report no longer means re-ranking every race on a phone.
+
+The functions below follow their JavaScript namesakes in report_code.html rule
+for rule (calculateTacticLogic, getCalculatedRaceResults,
+buildFirstUpByPositionReport, generateSeasonSummary and their helpers) and use
+the same field names as the report's parsed rows. Columns are normalised once
+per distinct value and rows are grouped by race up front, so each race is
+ranked once however many summaries need it.
+
+    python race_analytics.py [data/kx_race_analysis_git.csv] [-o data/race_analytics.json]
+"""
+import argparse
+import functools
+import json
+import math
+import os
+import re
+import sys
+import unicodedata
+
+from tag_table import TagTable
+
+ANALYTICS_VERSION = 1
+SPECIAL_GATE_ID = "SG"
+BIB_FULL_NAMES = {"R": "RED", "G": "GREEN", "B": "BLUE", "Y": "YELLOW"}
+DEFAULT_GATE_ORDER = ["1", "2", "3", "4", "5", "6", "Roll", "7", "8"]
+DEFAULT_UPSTREAM_GATES = ["2", "8"]
+SEASON_COMPETITION_ORDER = ["WC1", "WC2", "WC3", "WC4", "WC5", "WCh", "OLY", "CCh", "NCh", "WRR", "AO"]
+PHASE_SORT_ORDER = {"TT": 0, "R": 1, "Rep": 2, "H": 3, "QF": 4, "SF": 5, "Small Final": 6, "Final": 7}
+POSITIONS = ["P1", "P2", "P3", "P4"]
+RESULT_COLUMNS = ["bib", "name", "rampPosition", "isDNS", "isDSQ", "faults", "deepestFaultIndex",
+                  "originalRank", "isRAL", "finishRank", "finishPosition"]
+SUMMARY_COLUMNS = ["competition", "location", "phase", "bib", "rampPosition", "phaseRank", "finalRank", "note"]
+
+NAN = float("nan")
+_SURNAME_LETTER = re.compile("[A-Za-zÀ-ÖØ-öø-ÿ]")
+_PHASE_PATTERN = re.compile(r"^([A-Za-z]+)(\d*)$")
+_FAULT_WORDS = ("FLT", "FAULT", "DSQ", "DNF", "RAL")
+
+
+# --- JS VALUE HELPERS ---
+def js_number(value):
+    """Unary plus on a CSV string: "" is 0, anything non-numeric is NaN."""
+    value = value.strip()
+    if not value:
+        return 0
+    try:
+        number = float(value)
+    except ValueError:
+        return NAN
+    return int(number) if number.is_integer() else number
+
+
+def is_finite(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def locale_key(text):
+    """Approximates String.localeCompare ordering: accents and case only break ties."""
+    text = str(text)
+    stripped = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return (stripped.casefold(), text)
+
+
+def parse_float(value):
+    """parseFloat(value): leading number of a string, or NaN."""
+    match = re.match(r"\s*([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)", str(value))
+    return float(match.group(1)) if match else NAN
+
+
+def parse_int(value):
+    """parseInt(value, 10): leading integer of a string, or None."""
+    match = re.match(r"\s*([+-]?\d+)", str(value))
+    return int(match.group(1)) if match else None
+
+
+# --- ROWS ---
+def _normalise_gate(gate):
+    if gate.startswith("Gate "):
+        return gate.replace("Gate ", "", 1)
+    if gate == "Course":
+        return "Roll"
+    if gate == "Special":
+        return "SG"
+    return gate
+
+
+def _first_column(table, *headers):
+    """Trimmed values of the first of `headers` with a non-empty value in each row (a || b || c)."""
+    columns = [[v.strip() for v in table.column_values(h)] for h in headers if h in table.columns]
+    if not columns:
+        return [""] * len(table)
+    if len(columns) == 1:
+        return columns[0]
+    return [next((v for v in values if v), "") for values in zip(*columns)]
+
+
+def _year(value):
+    year = js_number(value)
+    return year if is_finite(year) else 0
+
+
+# Report row field -> (CSV headers tried in turn, conversion of the trimmed value), as in parseCsvData
+REPORT_FIELDS = {
+    "Year": (("Year",), _year),
+    "Competition": (("Competition",), None),
+    "Location": (("Location",), None),
+    "Gender": (("Gender",), None),
+    "Phase": (("Phase",), None),
+    "Gate": (("Gate",), _normalise_gate),
+    "BIB": (("BIB", "Bib"), None),
+    "Position": (("Order", "Position"), js_number),
+    "RampPosition": (("Ramp Position", "RampPosition"), js_number),
+    "FinalPosition": (("Final Position", "FinalPosition"), js_number),
+    "UpstreamTactic": (("Upstream Tactic", "UpstreamTactic"), None),
+    "AthleteName": (("Athlete Name", "Athlete", "Name"), None),
+    "Action": (("Action", "action", "Notes", "notes"), None),
+    "FaultVal": (("Faults", "Fault", "fault"), None),
+    "FinishRank": (("Finish Rank", "FinishRank", "Rank", "rank", "Overall Rank", "OverallRank"), None),
+}
+
+
+def parse_rows(table):
+    """Report rows (as parseCsvData builds them) from a TagTable. Each column is decoded
+    once and converted once per distinct value rather than once per row."""
+    def mapped(values, convert):
+        lookup = {v: convert(v) for v in set(values)}
+        return [lookup[v] for v in values]
+
+    fields = {}
+    for name, (headers, convert) in REPORT_FIELDS.items():
+        values = _first_column(table, *headers)
+        fields[name] = mapped(values, convert) if convert else values
+    # formatAthleteName of every row, worked out once per distinct name
+    fields["Athlete"] = mapped(fields["AthleteName"], format_athlete_name)
+    names = list(fields)
+    return [dict(zip(names, values)) for values in zip(*fields.values())]
+
+
+def parse_row(row):
+    """One report row from a tag row mapping; the same result parse_rows gives for it."""
+    parsed = {}
+    for name, (headers, convert) in REPORT_FIELDS.items():
+        value = next((v for v in (str(row.get(h) or "").strip() for h in headers) if v), "")
+        parsed[name] = convert(value) if convert else value
+    parsed["Athlete"] = format_athlete_name(parsed["AthleteName"])
+    return parsed
+
+
+def race_of(row):
+    """Race key of a report row: (Year, Competition, Location, Gender, Phase)."""
+    return (row["Year"], row["Competition"], row["Location"], row["Gender"], row["Phase"])
+
+
+def group_races(rows):
+    """Rows grouped by race (Year, Competition, Location, Gender, Phase), in file order."""
+    races = {}
+    for row in rows:
+        races.setdefault(race_of(row), []).append(row)
+    return races
+
+
+# --- ROW CLASSIFICATION ---
+def is_special_gate(gate):
+    return gate == SPECIAL_GATE_ID or gate == "Special"
+
+
+def without_special_gate(upstream_gates):
+    return [g for g in upstream_gates or [] if not is_special_gate(g)]
+
+
+def is_dns_row(d):
+    # FinalPosition is numeric once parsed ("DNS" becomes NaN), so only the Action can say DNS
+    return d["Action"].strip().upper() == "DNS"
+
+
+def is_notes_row(d):
+    return d["Gate"].strip().lower() == "notes"
+
+
+def is_fault_only_row(d):
+    action = d["Action"].strip().upper()
+    if action in ("FLT", "RAL"):
+        return True
+    order = d["Position"]
+    if order > 0:
+        return False
+    if d["FaultVal"].strip() and re.search("FLT|FAULT|RAL|DSQ|DNF", d["FaultVal"], re.I):
+        return True
+    return d["Gate"].strip().upper() == "COURSE" and order == 0
+
+
+def is_live_race_tag_row(d):
+    if not d["BIB"]:
+        return False
+    if d["Gate"] in ("Ramp", "Start"):
+        return False
+    if is_notes_row(d) or is_dns_row(d) or is_fault_only_row(d):
+        return False
+    return d["Position"] > 0
+
+
+def live_tag_order(d):
+    return d["Position"]
+
+
+def finish_position_from_row(d):
+    position = d["FinalPosition"]
+    return position if is_finite(position) and position > 0 else NAN
+
+
+def athlete_finish_position(race_rows, bib):
+    rows = [d for d in race_rows if d["BIB"] == bib]
+    for row in [d for d in rows if d["Gate"] == "Finish"] + rows:
+        position = finish_position_from_row(row)
+        if is_finite(position):
+            return position
+    return NAN
+
+
+# --- NAMES ---
+def _is_all_caps_surname(token):
+    return bool(_SURNAME_LETTER.search(token)) and token == token.upper()
+
+
+def _title_word(token):
+    return "-".join(seg[:1].upper() + seg[1:].lower() for seg in token.split("-") if seg)
+
+
+def format_athlete_name(name):
+    """SURNAME(S) Given Names, as formatAthleteName in the report."""
+    if not name or not isinstance(name, str):
+        return ""
+    parts = name.split()
+    n = len(parts)
+    if not n:
+        return ""
+    if not _is_all_caps_surname(parts[0]):
+        if n == 1:
+            return _title_word(parts[0])
+        return " ".join(_title_word(p) for p in parts[:-1]) + " " + parts[-1].upper()
+    i = 0
+    while i < n and _is_all_caps_surname(parts[i]):
+        i += 1
+    if i >= n:
+        if n == 1:
+            return parts[0].upper()
+        if n == 2:
+            return f"{parts[0].upper()} {_title_word(parts[1])}"
+        return f"{parts[0].upper()} " + " ".join(_title_word(p) for p in parts[1:])
+    surnames = " ".join(p.upper() for p in parts[:i])
+    given = " ".join(_title_word(p) for p in parts[i:])
+    return f"{surnames} {given}".strip()
+
+
+def athlete_name_from_race_rows(rows, bib):
+    for row in rows:
+        if row["BIB"] == bib and row["AthleteName"].strip():
+            return format_athlete_name(row["AthleteName"])
+    return ""
+
+
+# --- COMPETITION STRUCTURE ---
+def scan_competition_structure(comp_rows):
+    """Course gate order and upstream gates of a competition (scanCompetitionStructure)."""
+    if not comp_rows:
+        return {"orderedGates": list(DEFAULT_GATE_ORDER), "upstreamGates": list(DEFAULT_UPSTREAM_GATES)}
+
+    detected_upstreams = {}
+    runs = {}
+    for d in comp_rows:
+        gate = d["Gate"]
+        if gate and gate not in ("Ramp", "Start", "Finish") and not is_fault_only_row(d) and gate != "SG":
+            action = d["Action"].strip().lower()
+            if "up" in action and action != "up":
+                detected_upstreams[gate] = True
+        run = runs.setdefault(f"{d['Phase']}-{d['Gender']}-{d['BIB']}", [])
+        if gate and gate not in ("Start", "Finish", "Ramp") and is_live_race_tag_row(d):
+            run.append(gate)
+
+    longest = []
+    for seq in runs.values():
+        if len(seq) > len(longest):
+            longest = seq
+    final_order = list(dict.fromkeys(longest))
+    if not final_order:
+        unique_gates = [g for g in dict.fromkeys(d["Gate"] for d in comp_rows)
+                        if g and g not in ("Start", "Finish", "Ramp") and g.lower() != "notes"]
+
+        def compare(a, b):
+            if a == "Roll":
+                return 0
+            difference = (parse_int(a) if parse_int(a) is not None else NAN) - (parse_int(b) if parse_int(b) is not None else NAN)
+            return 0 if math.isnan(difference) else difference
+
+        final_order = sorted(unique_gates, key=functools.cmp_to_key(compare))
+    return {"orderedGates": final_order, "upstreamGates": list(detected_upstreams)}
+
+
+def first_upstream_gate(structure):
+    upstream = list(dict.fromkeys(without_special_gate(structure.get("upstreamGates"))))
+    if not upstream:
+        return None
+    for gate in structure.get("orderedGates") or []:
+        if gate in upstream:
+            return gate
+    return upstream[0]
+
+
+def race_structure(race_rows, fallback_ordered_gates, competition_upstream_gates):
+    """Gate order and upstream gates actually used in one race (getRaceStructure)."""
+    if not race_rows:
+        return {"orderedGates": list(fallback_ordered_gates or []), "upstreamGates": []}
+    gates_in_race = {}
+    candidates = {}
+    ordered = []
+    for d in race_rows:
+        gate = d["Gate"]
+        if not gate or gate in ("Ramp", "Start", "Finish") or is_fault_only_row(d):
+            continue
+        gates_in_race[gate] = True
+        if gate not in ordered:
+            ordered.append(gate)
+        if gate != "SG" and "up" in d["Action"].lower():
+            candidates[gate] = True
+    comp_upstream = set(competition_upstream_gates or [])
+    upstream = [g for g in candidates if g in comp_upstream]
+    for gate in gates_in_race:
+        if gate not in ordered:
+            ordered.append(gate)
+    return {"orderedGates": ordered, "upstreamGates": without_special_gate(upstream)}
+
+
+def compare_season_phases(a, b):
+    def sort_key(phase):
+        p = str(phase or "").strip()
+        if p == "Final":
+            return "Final"
+        if is_small_final(p):
+            return "Small Final"
+        match = _PHASE_PATTERN.match(p)
+        return match.group(1) if match else p
+
+    def number(phase):
+        p = str(phase or "").strip()
+        if p == "Final" or is_small_final(p):
+            return 0
+        match = _PHASE_PATTERN.match(p)
+        return int((match and match.group(2)) or "0")
+
+    order_a = PHASE_SORT_ORDER.get(sort_key(a), 99)
+    order_b = PHASE_SORT_ORDER.get(sort_key(b), 99)
+    if order_a != order_b:
+        return order_a - order_b
+    return number(a) - number(b)
+
+
+def is_small_final(phase):
+    return bool(re.match(r"^small\s*final$", str(phase or "").strip(), re.I))
+
+
+def bracket_phase_kind(phase):
+    p = str(phase or "").strip()
+    if p == "Final":
+        return "Final"
+    if is_small_final(p):
+        return "SmallFinal"
+    for prefix, kind in (("SF", "SF"), ("QF", "QF"), ("H", "H"), ("Rep", "Rep"), ("R", "R"), ("TT", "TT")):
+        if p[:len(prefix)].lower() == prefix.lower():
+            return kind
+    return "Other"
+
+
+# --- TACTICS ---
+def calculate_tactic_logic(race_rows, upstream_gates):
+    """Display tactic of each live row: leader's tactic, FOLLOW or SPLIT at upstream gates,
+    L/R at the special gate and nothing elsewhere. Returns {id(row): tactic}."""
+    upstream_gates = without_special_gate(upstream_gates)
+    live_rows = [d for d in race_rows if is_live_race_tag_row(d)]
+    tactics = {}
+    for gate in upstream_gates:
+        gate_events = sorted((d for d in live_rows if d["Gate"] == gate), key=live_tag_order)
+        if not gate_events:
+            continue
+        tactics[id(gate_events[0])] = gate_events[0]["UpstreamTactic"]
+        for ahead, current in zip(gate_events, gate_events[1:]):
+            if current["Action"] and ahead["Action"]:
+                tactics[id(current)] = "FOLLOW" if current["Action"] == ahead["Action"] else f"SPLIT - {current['Action']}"
+            else:
+                tactics[id(current)] = current["UpstreamTactic"]
+    for d in live_rows:
+        if d["Gate"] not in upstream_gates:
+            tactics[id(d)] = ""
+        if is_special_gate(d["Gate"]):
+            action = d["Action"].lower()
+            if "left" in action:
+                tactics[id(d)] = "L"
+            elif "right" in action:
+                tactics[id(d)] = "R"
+    return tactics
+
+
+# --- RACE RESULTS ---
+def _has_fault_word(text):
+    return bool(text) and any(word in text.upper() for word in _FAULT_WORDS)
+
+
+def _clean_fault_gate(gate):
+    for word in _FAULT_WORDS:
+        gate = re.sub(word, "", gate, count=1, flags=re.I)
+    return gate.strip()
+
+
+def calculated_race_results(race_rows, ordered_gates):
+    """Per-athlete results of one race, ranked with faults, RAL, DSQ and DNS taken into
+    account (getCalculatedRaceResults)."""
+    fault_rows = [d for d in race_rows if _has_fault_word(d["Action"]) or _has_fault_word(d["Gate"]) or _has_fault_word(d["FaultVal"])]
+    race_has_faults = bool(fault_rows)
+
+    stats = []
+    for bib in dict.fromkeys(d["BIB"] for d in race_rows):
+        bib_rows = [d for d in race_rows if d["BIB"] == bib]
+        name = athlete_name_from_race_rows(race_rows, bib) or BIB_FULL_NAMES.get(bib) or bib
+        is_ral = is_dsq = False
+        deepest_fault_index = -1
+        fault_strings = []
+        for f in (d for d in fault_rows if d["BIB"] == bib):
+            combined_raw = f"{f['Gate']} {f['FaultVal']} {f['Action']}".upper()
+            is_ral = is_ral or "RAL" in combined_raw
+            is_dsq = is_dsq or "DSQ" in combined_raw
+            clean_gate = _clean_fault_gate(f["Gate"]) if f["Gate"] else ""
+            if not clean_gate and (f["FaultVal"] or f["Action"]):
+                combined = f"{f['FaultVal']} {f['Action']}".upper()
+                match = re.search(r"(?:FLT|FAULT|RAL)\s*(\d+|Roll|Upstream)", combined, re.I) or re.search(r"(\d+)", combined)
+                if match:
+                    clean_gate = match.group(1)
+            gate_index = ordered_gates.index(clean_gate) if clean_gate in ordered_gates else -1
+            deepest_fault_index = max(deepest_fault_index, gate_index)
+
+            if "RAL" in combined_raw:
+                fault_strings.append("RAL")
+            elif "DSQ" in combined_raw:
+                fault_strings.append("DSQ")
+            elif f["Gate"] and "FLT" not in f["Gate"].upper() and "FAULT" not in f["Gate"].upper():
+                fault_strings.append(f"FLT {f['Gate']}")
+            elif clean_gate:
+                fault_strings.append(f"FLT {clean_gate}")
+            else:
+                fault_strings.append(f["FaultVal"] or f["Action"] or "Fault")
+
+        dns_row = next((d for d in bib_rows if is_dns_row(d)), None)
+        finish_row = next((d for d in bib_rows if d["Gate"] == "Finish" and is_live_race_tag_row(d)), None)
+        finish_pos = athlete_finish_position(race_rows, bib)
+        if not is_dsq and finish_row and "DSQ" in str(finish_row["FaultVal"] or finish_row["Action"] or "").upper():
+            is_dsq = True
+
+        if dns_row:
+            original_rank = 999
+        elif race_has_faults:
+            if is_finite(finish_pos):
+                original_rank = finish_pos
+            else:
+                rank_row = next((d for d in bib_rows if d["FinishRank"].strip()), None)
+                rank = parse_float(rank_row["FinishRank"]) if rank_row else NAN
+                original_rank = rank if is_finite(rank) else 999
+        else:
+            original_rank = live_tag_order(finish_row) if finish_row else 999
+
+        ramp_row = next((d for d in bib_rows if d["Gate"] == "Ramp"), None)
+        ramp_position = "-"
+        if dns_row:
+            ramp_position = "DNS"
+        elif ramp_row and is_finite(ramp_row["RampPosition"]) and ramp_row["RampPosition"] > 0:
+            ramp_position = ramp_row["RampPosition"]
+        rank_row = next((d for d in bib_rows if d["FinishRank"]), None)
+
+        stats.append({
+            "bib": bib, "name": name, "rampPosition": ramp_position,
+            "isDNS": bool(dns_row), "isDSQ": is_dsq, "faults": fault_strings,
+            "faultCount": len(fault_strings), "deepestFaultIndex": deepest_fault_index,
+            "originalRank": original_rank, "isRAL": is_ral,
+            "finishRank": rank_row["FinishRank"] if rank_row else "-",
+            "finishPosition": finish_pos if is_finite(finish_pos) else None,
+        })
+
+    def compare(a, b):
+        if a["isDNS"] != b["isDNS"]:
+            return 1 if a["isDNS"] else -1
+        if race_has_faults:
+            a_pos, b_pos = a["finishPosition"], b["finishPosition"]
+            a_has = a_pos is not None and a_pos > 0
+            b_has = b_pos is not None and b_pos > 0
+            if a_has and b_has and a_pos != b_pos:
+                return a_pos - b_pos
+            if a_has != b_has:
+                return -1 if a_has else 1
+            return a["originalRank"] - b["originalRank"]
+        if a["isRAL"] != b["isRAL"]:
+            return 1 if a["isRAL"] else -1
+        if a["isRAL"] and b["isRAL"]:
+            if a["deepestFaultIndex"] != b["deepestFaultIndex"]:
+                return b["deepestFaultIndex"] - a["deepestFaultIndex"]
+            return a["originalRank"] - b["originalRank"]
+        if a["faultCount"] != b["faultCount"]:
+            group_a, group_b = min(a["faultCount"], 2), min(b["faultCount"], 2)
+            if group_a != group_b:
+                return group_a - group_b
+        if a["faultCount"] == 0 and b["faultCount"] == 0:
+            return a["originalRank"] - b["originalRank"]
+        if a["deepestFaultIndex"] != b["deepestFaultIndex"]:
+            return b["deepestFaultIndex"] - a["deepestFaultIndex"]
+        return a["originalRank"] - b["originalRank"]
+
+    ranked = sorted(stats, key=functools.cmp_to_key(compare))
+    for i, result in enumerate(ranked, start=1):
+        result["calculatedRank"] = i
+    return ranked
+
+
+# --- ANALYTICS OVER A WHOLE FILE ---
+class RaceAnalytics:
+    """Every aggregate the report needs, computed from one tag file's rows.
+
+    Structures, race results and tactics are cached per competition and race, so
+    each race is ranked once. As tags are added, undone or amended (`row_changed`)
+    only the caches of the race that changed are dropped; the whole competition's
+    only if the change moves its gate order or upstream gates.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows            # Report rows, in tag file order
+        self.races = group_races(rows)
+        self._competitions = {}     # (year, competition) -> report rows, in file order
+        for row in rows:
+            self._competitions.setdefault((row["Year"], row["Competition"]), []).append(row)
+        self._athlete_races = {}    # (year, athlete) -> {race key: the athlete's first row in it}
+        self._race_athletes = {}    # race key -> athletes named in it
+        for key in self.races:
+            self._index_athletes(key)
+        self._structures = {}
+        self._results = {}          # race key -> ranked results (with the competition's gate order)
+        self._tactics = {}          # race key -> display tactics
+        self._bundles = {}          # event -> (final rank by athlete, last phase by athlete)
+        self._counted = {}          # race key -> its share of the running totals below
+        self.ramp_totals = {}       # (year, gender) -> ramp position -> [starts, wins]
+        self.tactic_totals = {}     # (year, gender) -> {"FOLLOW": n, "SPLIT": n}
+        self.last_changed_race = None
+
+    @classmethod
+    def from_table(cls, table):
+        return cls(parse_rows(table))
+
+    def structure(self, year, competition):
+        key = (year, competition)
+        if key not in self._structures:
+            self._structures[key] = scan_competition_structure(self._competitions.get(key, []))
+        return self._structures[key]
+
+    def race_results(self, race_key):
+        """Ranked results of a race, with the competition's gate order (as the season summary ranks it)."""
+        if race_key not in self._results:
+            ordered_gates = self.structure(*race_key[:2])["orderedGates"]
+            self._results[race_key] = calculated_race_results(self.races.get(race_key, []), ordered_gates)
+        return self._results[race_key]
+
+    def event_races(self, year, competition, location, gender):
+        """Race keys of one event (year, competition, location, gender), in file order."""
+        return [key for key in self.races if key[:4] == (year, competition, location.strip(), gender)]
+
+    # --- INCREMENTAL UPDATES ---
+    def row_changed(self, op, index, row):
+        """Keeps the caches current after a tag store change: `op` is "add", "undo" or
+        "amend", `row` the tag row added, removed or amended (as TagStore.on_row_change)."""
+        if op == "add":
+            self.add_row(row)
+        elif op == "undo":
+            self.remove_last_row()
+        elif op == "amend":
+            self.amend_row(index, row)
+
+    def add_row(self, row):
+        parsed = parse_row(row)
+        self.rows.append(parsed)
+        key = race_of(parsed)
+        self.races.setdefault(key, []).append(parsed)
+        self._competitions.setdefault(key[:2], []).append(parsed)
+        self._invalidate(key)
+
+    def remove_last_row(self):
+        parsed = self.rows.pop()
+        key = race_of(parsed)
+        # The last tag is also the last row of its race and competition
+        for group, group_key in ((self.races, key), (self._competitions, key[:2])):
+            group[group_key].pop()
+            if not group[group_key]:
+                del group[group_key]
+        self._invalidate(key)
+
+    def amend_row(self, index, row):
+        old, parsed = self.rows[index], parse_row(row)
+        self.rows[index] = parsed
+        old_key, key = race_of(old), race_of(parsed)
+        if old_key == key:
+            for group in (self.races[key], self._competitions[key[:2]]):
+                group[next(i for i, r in enumerate(group) if r is old)] = parsed
+        else:
+            # Amends do not move rows between races in the tagger; regroup the two races from scratch
+            for k in (old_key, key):
+                self.races[k] = [r for r in self.rows if race_of(r) == k]
+                self._competitions[k[:2]] = [r for r in self.rows if r["Year"] == k[0] and r["Competition"] == k[1]]
+                if not self.races[k]:
+                    del self.races[k]
+            self._invalidate(old_key)
+        self._invalidate(key)
+
+    def _invalidate(self, key):
+        """Drops what depends on race `key`, and on its whole competition if the gate order
+        or upstream gates it implies have changed."""
+        self.last_changed_race = key
+        self._forget_race(key)
+        self._bundles.pop(key[:4], None)
+        self._index_athletes(key)
+        old_structure = self._structures.pop(key[:2], None)
+        if old_structure is not None and old_structure != self.structure(*key[:2]):
+            for race in [k for k in self.races if k[:2] == key[:2]]:
+                self._forget_race(race)
+            for event in [e for e in self._bundles if e[:2] == key[:2]]:
+                del self._bundles[event]
+
+    def _forget_race(self, key):
+        self._results.pop(key, None)
+        self._tactics.pop(key, None)
+        counted = self._counted.pop(key, None)
+        if counted:
+            self._add_to_totals(key, counted, -1)
+
+    def _index_athletes(self, key):
+        """Re-records which athletes raced in race `key` (the season summary's race list)."""
+        for athlete in self._race_athletes.pop(key, ()):
+            races = self._athlete_races[(key[0], athlete)]
+            del races[key]
+            if not races:
+                del self._athlete_races[(key[0], athlete)]
+        athletes = {}
+        for row in self.races.get(key, []):
+            if row["Athlete"] and row["Athlete"] not in athletes:
+                athletes[row["Athlete"]] = row
+                self._athlete_races.setdefault((key[0], row["Athlete"]), {})[key] = row
+        if athletes:
+            self._race_athletes[key] = athletes
+
+    # --- RAMP POSITION AND TACTIC TOTALS ---
+    def totals(self):
+        """Running totals by (year, gender): ramp position starts and wins, and FOLLOW/SPLIT
+        counts at upstream gates. Only races changed since the last call are recounted."""
+        for key in self.races:
+            if key not in self._counted:
+                self._counted[key] = self._race_counts(key)
+                self._add_to_totals(key, self._counted[key], 1)
+        return self.ramp_totals, self.tactic_totals
+
+    def _race_counts(self, key):
+        ramp = {}
+        for result in self.race_results(key):
+            position = result["rampPosition"]
+            if is_finite(position):
+                counts = ramp.setdefault(position, [0, 0])
+                counts[0] += 1
+                counts[1] += result["calculatedRank"] == 1
+        tactics = {"FOLLOW": 0, "SPLIT": 0}
+        for _, _, _, tactic in self.race_tactics(key):
+            if tactic == "FOLLOW":
+                tactics["FOLLOW"] += 1
+            elif tactic.startswith("SPLIT"):
+                tactics["SPLIT"] += 1
+        return ramp, tactics
+
+    def _add_to_totals(self, key, counted, sign):
+        ramp, tactics = counted
+        group = (key[0], key[3])
+        ramp_totals = self.ramp_totals.setdefault(group, {})
+        for position, (starts, wins) in ramp.items():
+            totals = ramp_totals.setdefault(position, [0, 0])
+            totals[0] += sign * starts
+            totals[1] += sign * wins
+        tactic_totals = self.tactic_totals.setdefault(group, {"FOLLOW": 0, "SPLIT": 0})
+        for tactic, count in tactics.items():
+            tactic_totals[tactic] += sign * count
+
+    # --- TACTICS (as the Full Report shows them) ---
+    def race_tactics(self, race_key):
+        """[bib, gate, order, tactic] of each tag with a display tactic, in tag order."""
+        if race_key not in self._tactics:
+            race_rows = self.races.get(race_key, [])
+            structure = self.structure(*race_key[:2])
+            live_rows = [d for d in race_rows if is_live_race_tag_row(d)]
+            upstream = race_structure(live_rows, structure["orderedGates"], structure["upstreamGates"])["upstreamGates"]
+            tactics = calculate_tactic_logic(race_rows, upstream)
+            self._tactics[race_key] = [[d["BIB"], d["Gate"], d["Position"], tactics[id(d)]]
+                                       for d in race_rows if tactics.get(id(d))]
+        return self._tactics[race_key]
+
+    # --- 1ST UP-STREAM BY POSITION ---
+    def first_up_by_position(self, year, competition, location, gender):
+        race_keys = self.event_races(year, competition, location, gender)
+        if not race_keys:
+            return None
+        first_up = first_upstream_gate(self.structure(year, competition))
+        if not first_up:
+            return {"error": "Could not detect the first upstream gate for this competition."}
+
+        by_phase = {}
+        for key in race_keys:
+            if key[4]:
+                by_phase.setdefault(key[4], []).extend(self.races[key])
+        summary = {p: {"left": 0, "right": 0} for p in POSITIONS}
+        phase_rows = []
+        for phase in sorted(by_phase, key=functools.cmp_to_key(compare_season_phases)):
+            positions = {p: None for p in POSITIONS}
+            for row in by_phase[phase]:
+                if row["Gate"] != first_up or not is_live_race_tag_row(row):
+                    continue
+                order = live_tag_order(row)
+                if order < 1 or order > 4:
+                    continue
+                direction = parse_upstream_direction(row)
+                if not direction:
+                    continue
+                pos_key = f"P{order}"
+                positions[pos_key] = direction
+                summary[pos_key]["left" if direction == "Left" else "right"] += 1
+            if any(positions.values()):
+                phase_rows.append({"phase": phase, "positions": positions})
+
+        total_left = sum(s["left"] for s in summary.values())
+        total_right = sum(s["right"] for s in summary.values())
+        return {
+            "year": year, "competition": competition, "location": location, "gender": gender,
+            "firstUpGate": first_up, "summary": summary, "phaseRows": phase_rows,
+            "phaseCount": len(phase_rows), "totalLeft": total_left, "totalRight": total_right,
+        }
+
+    # --- SEASON SUMMARY ---
+    def season_event_order(self, year):
+        events = {}
+        for (race_year, competition, location, _, _), race_rows in self.races.items():
+            if race_year == year and competition:
+                events.setdefault((competition, location), None)
+
+        def compare(a, b):
+            index_a, index_b = competition_sort_index(a[0]), competition_sort_index(b[0])
+            if index_a != index_b:
+                return index_a - index_b
+            if index_a >= 1000 and locale_key(a[0]) != locale_key(b[0]):
+                return -1 if locale_key(a[0]) < locale_key(b[0]) else 1
+            return (locale_key(a[1]) > locale_key(b[1])) - (locale_key(a[1]) < locale_key(b[1]))
+
+        return sorted(events, key=functools.cmp_to_key(compare))
+
+    def event_final_ranks(self, year, competition, location, gender):
+        """(final rank by athlete, last phase by athlete) for one event (computeEventFinalRankBundle)."""
+        key = (year, competition, location, gender)
+        if key in self._bundles:
+            return self._bundles[key]
+        race_keys = self.event_races(year, competition, location, gender)
+        event_rows = [row for k in race_keys for row in self.races[k]]
+
+        phases_by_athlete, bib_by_athlete_phase = {}, {}
+        for r in event_rows:
+            phase, bib, name = r["Phase"].strip(), r["BIB"].strip(), r["AthleteName"].strip()
+            if not phase or not bib or not name or r["Gate"].strip() != "Ramp":
+                continue
+            athlete = format_athlete_name(name)
+            if not athlete:
+                continue
+            phases_by_athlete.setdefault(athlete, {})[phase] = None
+            bib_by_athlete_phase.setdefault(athlete, {})[phase] = bib
+        athletes = list(phases_by_athlete)
+        if not athletes:
+            self._bundles[key] = ({}, {})
+            return self._bundles[key]
+
+        finish_ranks = {}
+        for athlete in athletes:
+            rank_row = next((r for r in event_rows if r["Athlete"] == athlete and r["FinishRank"].strip()), None)
+            rank = parse_int(rank_row["FinishRank"]) if rank_row else None
+            if rank is not None and rank > 0:
+                finish_ranks[athlete] = rank
+        last_phase = {a: sorted(p, key=functools.cmp_to_key(compare_season_phases))[-1]
+                      for a, p in phases_by_athlete.items() if p}
+        if len(finish_ranks) == len(athletes):
+            self._bundles[key] = (finish_ranks, last_phase)
+            return self._bundles[key]
+
+        placing = {}
+        for athlete in athletes:
+            phase = last_phase.get(athlete)
+            race_key = (year, competition, location, gender, phase)
+            if not phase or race_key not in self.races:
+                continue
+            ranked = self.race_results(race_key)
+            bib = bib_by_athlete_phase.get(athlete, {}).get(phase)
+            result = next((x for x in ranked if x["bib"] == bib), None) if bib else None
+            if result:
+                placing[athlete] = result["calculatedRank"]
+
+        overall = {}
+        bands = {"SF": [], "QF": [], "H": [], "TT": [], "Other": []}
+        for athlete in athletes:
+            phase = last_phase.get(athlete, "")
+            place = placing.get(athlete)
+            kind = bracket_phase_kind(phase)
+            if kind == "Final" and place is not None and 1 <= place <= 4:
+                overall[athlete] = place
+            elif kind == "SmallFinal" and place is not None and 1 <= place <= 4:
+                overall[athlete] = 4 + place
+            elif kind in ("SF", "QF", "H") and place is not None and place >= 3:
+                bands[kind].append((athlete, phase, place))
+            elif kind == "TT":
+                bands["TT"].append((athlete, phase, place or 99))
+            else:
+                bands["Other"].append((athlete, phase, place or 99))
+
+        def band_key(item):
+            athlete, phase, place = item
+            return (place if isinstance(place, int) else 99, functools.cmp_to_key(compare_season_phases)(phase), locale_key(athlete))
+
+        for band, start in (("SF", 5), ("QF", 9), ("H", 17), ("TT", 33), ("Other", 33 + len(bands["TT"]))):
+            for i, (athlete, _, _) in enumerate(sorted(bands[band], key=band_key)):
+                overall[athlete] = start + i
+        self._bundles[key] = (overall, last_phase)
+        return self._bundles[key]
+
+    def season_summary(self, year, athlete_name):
+        """Rows of an athlete's season summary, as generateSeasonSummary lists them:
+        [competition, location, phase, bib, ramp, phase rank, final rank, note]."""
+        athlete_races = self._athlete_races.get((year, athlete_name))
+        if not athlete_races:
+            return []
+
+        event_index = {event: i for i, event in enumerate(self.season_event_order(year))}
+
+        def compare(a, b):
+            order_a = event_index.get((a[1].strip(), a[2]), 9999)
+            order_b = event_index.get((b[1].strip(), b[2]), 9999)
+            if order_a != order_b:
+                return order_a - order_b
+            phase_cmp = compare_season_phases(a[4], b[4])
+            if phase_cmp:
+                return phase_cmp
+            return (locale_key(a[3]) > locale_key(b[3])) - (locale_key(a[3]) < locale_key(b[3]))
+
+        rows = []
+        event_genders = {}
+        for key in sorted(athlete_races, key=functools.cmp_to_key(compare)):
+            _, competition, location, gender, phase = key
+            target_bib = athlete_races[key]["BIB"]
+            structure = self.structure(year, competition)
+            ranked = self.race_results(key)
+            if target_bib:
+                result = next((r for r in ranked if r["bib"] == target_bib), None)
+            else:
+                result = next((r for r in ranked if r["name"] == athlete_name), None)
+            if not result:
+                continue
+            phase_rank = result["calculatedRank"]
+
+            # Final ranks come from the event's first race listed; a stray row of the other gender gets none
+            event_gender = event_genders.setdefault((competition, location), gender)
+            if gender and gender == event_gender:
+                final_ranks, last_phases = self.event_final_ranks(year, competition, location, gender)
+            else:
+                final_ranks, last_phases = {}, {}
+            final_rank = "-"
+            if last_phases.get(athlete_name) and str(last_phases[athlete_name]) == str(phase):
+                final_rank = result["finishRank"]
+                explicit = final_rank is not None and str(final_rank).strip() not in ("", "-")
+                if not explicit:
+                    if athlete_name in final_ranks:
+                        final_rank = final_ranks[athlete_name]
+                    elif phase == "Final":
+                        final_rank = phase_rank
+                    elif is_small_final(phase):
+                        final_rank = 4 + phase_rank
+                    else:
+                        final_rank = "-"
+
+            rows.append([competition, location, phase, result["bib"], result["rampPosition"], phase_rank,
+                         final_rank if final_rank not in (None, "", 0) else "-",
+                         result_note(result, structure["orderedGates"]) or "-"])
+        return rows
+
+    # --- EXPORT ---
+    def to_json(self):
+        """The compact precomputed structure the report loads."""
+        competitions = {}
+        for year, competition in dict.fromkeys(key[:2] for key in self.races):
+            structure = self.structure(year, competition)
+            competitions[f"{year}|{competition}"] = dict(structure, firstUpGate=first_upstream_gate(structure))
+
+        races = {}
+        for key in self.races:
+            races["|".join(map(str, key))] = {
+                "results": [[r[c] for c in RESULT_COLUMNS] for r in self.race_results(key)],
+                "tactics": self.race_tactics(key),
+            }
+
+        first_up = {}
+        for year, competition, location, gender in dict.fromkeys(key[:4] for key in self.races):
+            report = self.first_up_by_position(year, competition, location, gender)
+            if report:
+                first_up[f"{year}|{competition}|{location}|{gender}"] = report
+
+        summaries = {}
+        for year, athlete in sorted(self._athlete_races, key=lambda k: (-k[0], k[1])):
+            rows = self.season_summary(year, athlete)
+            if rows:
+                summaries[f"{year}|{athlete}"] = rows
+
+        ramp_totals, tactic_totals = self.totals()
+        groups = {f"{year}|{gender}": {
+            "rampPositions": {str(p): {"starts": s, "wins": w} for p, (s, w) in sorted(ramp_totals[(year, gender)].items()) if s},
+            "tactics": dict(tactic_totals[(year, gender)]),
+        } for year, gender in sorted(ramp_totals, key=lambda k: (-k[0], k[1]))}
+
+        return {
+            "version": ANALYTICS_VERSION,
+            "rows": len(self.rows),
+            "competitions": competitions,
+            "races": {"resultColumns": RESULT_COLUMNS, "races": races},
+            "firstUpByPosition": first_up,
+            "totals": groups,
+            "seasonSummary": {"columns": SUMMARY_COLUMNS, "athletes": summaries},
+        }
+
+
+def result_note(result, ordered_gates):
+    """DNS, RAL, DSQ or the faults of a ranked result, or "" for a clean run."""
+    if result["isDNS"]:
+        return "DNS"
+    if result["isRAL"]:
+        return "RAL"
+    if result["isDSQ"]:
+        return "DSQ"
+    if result["faultCount"] > 0:
+        index = result["deepestFaultIndex"]
+        gate_name = ordered_gates[index] if 0 <= index < len(ordered_gates) else "Start"
+        return f"1 Fault (Gate {gate_name})" if result["faultCount"] == 1 else f"{result['faultCount']} Faults"
+    return ""
+
+
+def parse_upstream_direction(row):
+    action = str(row["Action"] or row["UpstreamTactic"] or "").strip()
+    lower = action.lower()
+    if "left" in lower and ("up" in lower or "-" in lower):
+        return "Left"
+    if "right" in lower and ("up" in lower or "-" in lower):
+        return "Right"
+    if "left" in lower:
+        return "Left"
+    if "right" in lower:
+        return "Right"
+    return None
+
+
+def competition_sort_index(competition):
+    competition = str(competition or "").strip()
+    return SEASON_COMPETITION_ORDER.index(competition) if competition in SEASON_COMPETITION_ORDER else 1000
+
+
+def analytics_path_for(csv_path):
+    return os.path.join(os.path.dirname(csv_path), "race_analytics.json")
+
+
+def save_analytics(analytics, out_path):
+    """Writes the report JSON of a RaceAnalytics atomically. Raises OSError on failure."""
+    data = analytics.to_json()
+    with open(out_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"), ensure_ascii=False)
+    os.replace(out_path + ".tmp", out_path)
+
+
+def write_analytics(csv_path, out_path=None):
+    """Computes the analytics for a tag CSV and writes them. Returns the output path."""
+    with open(csv_path, "r", newline="", encoding="utf-8-sig") as f:
+        table = TagTable.from_csv(f)
+    out_path = out_path or analytics_path_for(csv_path)
+    save_analytics(RaceAnalytics.from_table(table), out_path)
+    return out_path
+
+
+def main(argv=None):
+    default_csv = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "kx_race_analysis_git.csv")
+    parser = argparse.ArgumentParser(description="Precompute the report's race analytics as JSON.")
+    parser.add_argument("csv", nargs="?", default=default_csv, help="tag CSV (default: %(default)s)")
+    parser.add_argument("-o", "--output", help="JSON file to write (default: race_analytics.json next to the CSV)")
+    args = parser.parse_args(argv)
+    try:
+        out_path = write_analytics(args.csv, args.output)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    print(f"Wrote {out_path} ({os.path.getsize(out_path)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,48 @@
+"""Small sidecar file next to the CSV holding the race being tagged.
+
+The tagger rewrites it (on the writer thread) whenever the race state changes:
+the race on screen, athlete names, ramp positions, the gate, actions and order
+so far, finish sequence, faults, DNS and upstream tactics. After a restart the
+race comes back from this file straight away instead of being entered again.
+
+The checkpoint carries the row count and last row of the history it goes with,
+so it is only used while no tags have been added or undone since it was written.
+"""
+import json
+import os
+
+
+def checkpoint_path_for(csv_path):
+    return os.path.splitext(csv_path)[0] + ".race.json"
+
+
+def row_marker(table):
+    """What identifies the end of a history: its row count and the filled-in cells of its last row."""
+    if not len(table):
+        return {"rows": 0, "last": None}
+    return {"rows": len(table), "last": {h: str(v) for h, v in table[-1].items() if v not in ("", None)}}
+
+
+def read_checkpoint(csv_path):
+    """Returns the checkpoint written for a CSV, or None if there is none or it is unreadable."""
+    try:
+        with open(checkpoint_path_for(csv_path), "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return checkpoint if isinstance(checkpoint, dict) and "race" in checkpoint else None
+
+
+def write_checkpoint(csv_path, race, marker):
+    """Writes the checkpoint atomically. `race` is TaggingSession.checkpoint(), `marker` row_marker()."""
+    path = checkpoint_path_for(csv_path)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(dict(marker, race=race), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def matches(checkpoint, table):
+    """True if the checkpoint was written for the history `table` holds."""
+    return {k: checkpoint.get(k) for k in ("rows", "last")} == row_marker(table)
@@ -0,0 +1,93 @@
+"""In-memory index over tag rows, keyed by race (Year, Competition, Phase) and BIB.
+
+Each lookup returns the row index the old reversed scans over `tagged_data` would
+have found, but without touching rows from other races.
+"""
+from bisect import insort
+
+# Fields that decide where a row sits in the index
+INDEXED_FIELDS = ("Year", "Competition", "Phase", "BIB", "Gate", "Action", "Athlete Name")
+
+
+def race_key(row):
+    return (str(row.get("Year", "")), row.get("Competition", ""), row.get("Phase", ""))
+
+
+class RaceIndex:
+    """race key -> bib -> row indices, plus per-gate and per-athlete lookups."""
+
+    def __init__(self):
+        self._rows = {}      # (race, bib) -> row indices, ascending
+        self._gates = {}     # (race, bib, gate) -> row indices
+        self._rolls = {}     # (race, bib) -> indices of rows whose Action includes Roll
+        self._athletes = {}  # (race, bib) -> indices of rows carrying an Athlete Name
+
+    def rebuild(self, rows):
+        self.__init__()
+        if not hasattr(rows, "column_values"):
+            for i, row in enumerate(rows):
+                self.add(i, row)
+            return
+        # Columnar tables: walk the decoded columns instead of one row view per cell
+        columns = [rows.column_values(field) for field in ("Year", "Competition", "Phase", "BIB", "Gate", "Action", "Athlete Name")]
+        for i, (year, comp, phase, bib, gate, action, athlete) in enumerate(zip(*columns)):
+            for table, key in self._keys((year, comp, phase), bib, gate, action, athlete):
+                table.setdefault(key, []).append(i)
+
+    # --- MAINTENANCE ---
+    def add(self, index, row):
+        for table, key in self._keys_for(row):
+            insort(table.setdefault(key, []), index)
+
+    def remove(self, index, row):
+        for table, key in self._keys_for(row):
+            indices = table.get(key)
+            if indices and index in indices:
+                indices.remove(index)
+                if not indices:
+                    del table[key]
+
+    def update(self, index, row, fields):
+        """Re-indexes a row about to be amended with `fields` (only if an indexed field changes)."""
+        if not any(f in INDEXED_FIELDS for f in fields):
+            return
+        self.remove(index, row)
+        self.add(index, {**row, **fields})
+
+    # --- LOOKUPS ---
+    def last_row(self, race, bib):
+        """Most recent row of any kind for a bib in a race, or None."""
+        return self._last(self._rows, (race, bib))
+
+    def athlete_row(self, race, bib):
+        """Most recent row for a bib in a race that has an Athlete Name, or None."""
+        return self._last(self._athletes, (race, bib))
+
+    def fault_row(self, race, bib, fault_item):
+        """Row a fault at `fault_item` ("1".."8", "Roll" or "Course") should be recorded on, or None."""
+        target_gate = f"Gate {fault_item}" if fault_item.isdigit() else fault_item
+        candidates = [self._last(self._gates, (race, bib, target_gate))]
+        if fault_item == "Roll":
+            candidates.append(self._last(self._rolls, (race, bib)))
+        elif fault_item == "Course":
+            candidates.append(self._last(self._gates, (race, bib, "Finish")))
+        candidates = [c for c in candidates if c is not None]
+        return max(candidates) if candidates else None
+
+    # --- INTERNALS ---
+    def _keys_for(self, row):
+        return self._keys(race_key(row), row.get("BIB", ""), row.get("Gate", ""),
+                          row.get("Action"), row.get("Athlete Name"))
+
+    def _keys(self, race, bib, gate, action, athlete):
+        keys = [(self._rows, (race, bib)), (self._gates, (race, bib, gate))]
+        if "Roll" in (action or ""):
+            keys.append((self._rolls, (race, bib)))
+        if athlete:
+            keys.append((self._athletes, (race, bib)))
+        return keys
+
+    @staticmethod
+    def _last(table, key):
+        indices = table.get(key)
+        return indices[-1] if indices else None
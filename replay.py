@@ -0,0 +1,154 @@
+"""Replays recorded tagging events into the tag data file, without the GUI.
+
+Each line of an event file is one JSON object, applied in order through the same
+`TaggingSession` rules the tagger uses:
+
+    {"race": {"year": "2026", "comp": "World Cup 1", "gender": "W", "phase": "Heat 3",
+              "paddlers": 4, "names": {"P1": "SMITH Jane"}}}   start a race (clears all state)
+    {"names": {"P2": "DOE Ann"}}                                set athlete names
+    {"key": "1"}  or  {"key": ["n", "t", "2", "1"]}            keys as in the tagger:
+                                    1-4, F1-F8, n, d/f/l/o/r/t/u, z, y, BackSpace
+    {"ramp": 3}                                                 click a ramp position
+    {"fault": ["P2"], "at": ["3", "Roll"]}                      fault entry popup
+    {"clear": true}                                             CLEAR ALL button
+
+Blank lines and lines starting with # are skipped. Warnings the tagger would show
+as dialogs are reported with their line number and the replay carries on (or
+stops, with --strict). The new rows are added to the data file in one atomic
+rewrite at the end, together with any journalled tags; close the tagger first.
+Data from an older version is used as it is, unless --upgrade is given; --dry-run
+writes nothing at all.
+
+    python replay.py events.jsonl [more.jsonl ...] [--data PATH] [--dry-run | --upgrade] [--strict]
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+
+from tag_archive import DEFAULT_DATA_PATH, open_archive
+from tag_store import TagStore
+from tagging_session import TaggingSession, TaggingWarning
+
+
+class ReplayError(Exception):
+    """An event line that cannot be understood, or a warning under --strict."""
+
+
+def start_race(session, race):
+    """Sets up a new race the way the tagger's context widgets would."""
+    session.year = str(race.get("year", session.year))
+    session.comp = race.get("comp", session.comp)
+    session.gender = race.get("gender", session.gender)
+    session.set_num_paddlers(int(race.get("paddlers", session.num_paddlers)))
+    session.change_phase(race.get("phase", session.phase))
+    session.athlete_names.update(race.get("names", {}))
+
+
+def apply_event(session, event):
+    """Applies one decoded event to the session. TaggingWarning propagates as in the GUI."""
+    if "race" in event:
+        start_race(session, event["race"])
+    elif "names" in event:
+        session.athlete_names.update(event["names"])
+    elif "key" in event:
+        keys = event["key"] if isinstance(event["key"], list) else [event["key"]]
+        for key in keys:
+            # Single characters arrive as event.char, named keys (F1, BackSpace) as event.keysym
+            if not session.handle_key(key if len(key) == 1 else "", key):
+                raise ReplayError(f"unknown key {key!r}")
+    elif "ramp" in event:
+        position = int(event["ramp"])
+        if position not in session.disabled_positions:
+            session.assign_ramp_position(position)
+    elif "fault" in event:
+        session.check_race_finished()
+        session.finalize_fault_tag(list(event["fault"]), set(event.get("at", [])))
+    elif "clear" in event:
+        session.clear_all_assignments()
+    else:
+        raise ReplayError(f"unknown event {event!r}")
+
+
+def replay_lines(session, lines, source="<events>", strict=False, warn=None):
+    """Replays event lines into the session. Returns (events applied, races started, warnings)."""
+    events = races = warnings = 0
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError as e:
+            raise ReplayError(f"{source}:{line_number}: not a JSON event ({e})")
+        try:
+            apply_event(session, event)
+        except TaggingWarning as w:
+            warnings += 1
+            if strict:
+                raise ReplayError(f"{source}:{line_number}: {w.title}: {w.message}")
+            if warn:
+                warn(f"{source}:{line_number}: {w.title}: {w.message}")
+        except ReplayError as e:
+            raise ReplayError(f"{source}:{line_number}: {e}")
+        except (KeyError, TypeError, ValueError) as e:
+            raise ReplayError(f"{source}:{line_number}: bad event {line!r} ({e})")
+        events += 1
+        races += "race" in event
+    return events, races, warnings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded tagging events into the tag data file.")
+    parser.add_argument("events", nargs="+", help="event files (JSON lines), or - for stdin")
+    parser.add_argument("--data", default=DEFAULT_DATA_PATH, help="tag CSV to add to (default: %(default)s)")
+    parser.add_argument("--dry-run", action="store_true", help="replay and report, but do not write anything")
+    parser.add_argument("--strict", action="store_true", help="stop at the first warning without writing")
+    parser.add_argument("--upgrade", action="store_true", help="upgrade data from an older version first")
+    args = parser.parse_args(argv)
+    if args.dry_run and args.upgrade:
+        parser.error("--upgrade rewrites the data file, so it cannot be combined with --dry-run")
+
+    archive = open_archive(args.data)
+    try:
+        store = TagStore(archive.load_all(upgrade=args.upgrade, readonly=args.dry_run))
+        for message in archive.migration_messages():
+            print(message)
+        for warning in archive.journal_warnings() + archive.schema_warnings():
+            print(warning, file=sys.stderr)
+        session = TaggingSession(store)
+        rows_before = len(store)
+        events = races = warnings = 0
+        started = time.perf_counter()
+        for path in args.events:
+            if path == "-":
+                counts = replay_lines(session, sys.stdin, "<stdin>", args.strict, print_warning)
+            else:
+                with open(path, "r", encoding="utf-8") as f:
+                    counts = replay_lines(session, f, path, args.strict, print_warning)
+            events, races, warnings = events + counts[0], races + counts[1], warnings + counts[2]
+        elapsed = time.perf_counter() - started
+
+        print(f"Replayed {events} events, {races} races in {elapsed:.2f}s "
+              f"({races / elapsed if elapsed else 0:.0f} races/s), {warnings} warnings; "
+              f"{len(store) - rows_before:+d} rows")
+        if args.dry_run:
+            print("Dry run: nothing written.")
+        else:
+            archive.save_all(store.rows)
+            print(f"Saved {len(store)} rows to {args.data}")
+    except (ReplayError, OSError, ValueError, csv.Error) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    finally:
+        archive.close()
+    return 0
+
+
+def print_warning(message):
+    print(f"WARNING: {message}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
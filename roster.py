@@ -0,0 +1,51 @@
+"""Small sidecar file next to the CSV holding the headers and the athlete roster.
+
+The tagger reads it at startup so the name dropdowns are ready straight away,
+while the full tag history is still loading. The sidecar carries the fingerprint
+of the CSV it was built from and is ignored once the CSV no longer matches.
+"""
+import json
+import os
+
+from tag_journal import csv_fingerprint
+
+
+def roster_path_for(csv_path):
+    return os.path.splitext(csv_path)[0] + ".roster.json"
+
+
+def athlete_roster(table):
+    """Returns {"M": [...], "W": [...]} from the distinct Gender/Athlete Name pairs of a TagTable."""
+    roster = {"M": set(), "W": set()}
+    if "Athlete Name" in table.columns and "Gender" in table.columns:
+        for gender, name in table.distinct("Gender", "Athlete Name"):
+            name = name.strip()
+            if name and gender in roster:
+                roster[gender].add(name)
+    return {gender: sorted(names) for gender, names in roster.items()}
+
+
+def read_roster(csv_path, fingerprint=csv_fingerprint):
+    """Returns the sidecar contents if it matches the CSV on disk, otherwise None."""
+    try:
+        with open(roster_path_for(csv_path), "r", encoding="utf-8") as f:
+            roster = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if roster.get("csv") != fingerprint(csv_path):
+        return None
+    return roster
+
+
+def write_roster(csv_path, table, csv_fp=None):
+    """Writes the sidecar for a CSV whose contents match `table`."""
+    path = roster_path_for(csv_path)
+    roster = {
+        "csv": csv_fp if csv_fp is not None else csv_fingerprint(csv_path),
+        "headers": list(table.headers),
+        "rows": len(table),
+        "athletes": athlete_roster(table),
+    }
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(roster, f)
+    os.replace(path + ".tmp", path)
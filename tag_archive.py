@@ -0,0 +1,310 @@
+"""The tag data file on disk: the CSV plus its journal, snapshot and roster sidecar.
+
+`TagArchive` loads the newest complete history (snapshot if current, otherwise
+the CSV, plus any journalled changes not yet exported) and brings the CSV up to
+date, appending where it can and rewriting atomically where it must. The Tk app
+and the command-line tools share it, so they always agree on the file format.
+
+The history may also be kept in partitions (tag_partitions.py) or in SQLite
+(tag_sqlite.py), behind the same interface; `open_archive` picks the one in use.
+"""
+import csv
+import io
+import os
+
+from roster import read_roster, write_roster
+from tag_journal import TagJournal, appended_fingerprint, apply_records, csv_fingerprint
+from tag_schema import SCHEMA_VERSION, migrate_csv, migrations_after, read_schema_version, write_schema_version
+from tag_snapshot import read_snapshot, snapshot_path_for, write_snapshot
+from tag_store import STANDARD_HEADERS
+from tag_table import TagTable
+
+# Where the tagger keeps its data, and so what the command-line tools work on by default
+DEFAULT_DATA_PATH = os.path.join(os.path.expanduser("~"), "Desktop", "data", "kx_race_analysis_git.csv")
+
+
+def csv_headers(rows):
+    """Standard headers first, then any extra columns in alphabetical order."""
+    all_keys = set(STANDARD_HEADERS)
+    all_keys.update(rows.headers)
+    return STANDARD_HEADERS + sorted([h for h in all_keys if h not in STANDARD_HEADERS])
+
+
+def write_csv(filepath, rows):
+    """Writes rows to a CSV file, including extra headers. Raises OSError on failure."""
+    with open(filepath, "w", newline="", encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=csv_headers(rows), restval='')
+        writer.writeheader()
+        writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def render_csv(table, headers=None):
+    """The CSV bytes of a table, written as write_csv would write them."""
+    buffer = io.StringIO(newline="")
+    writer = csv.DictWriter(buffer, fieldnames=headers or csv_headers(table), restval='')
+    writer.writeheader()
+    writer.writerows(table)
+    return buffer.getvalue().encode("utf-8")
+
+
+def journal_path_for(csv_path):
+    return os.path.splitext(csv_path)[0] + ".journal"
+
+
+def open_archive(csv_path):
+    """The archive for a tag CSV: SQLite or partitioned if that database or a partition
+    manifest sits beside it."""
+    # The backends subclass TagArchive, so they can only be imported once this module is
+    from tag_partitions import PartitionedArchive, manifest_path_for
+    from tag_sqlite import SqliteArchive, sqlite_path_for
+    if os.path.isfile(sqlite_path_for(csv_path)):
+        return SqliteArchive(csv_path)
+    if os.path.isfile(manifest_path_for(csv_path)):
+        return PartitionedArchive(csv_path)
+    return TagArchive(csv_path)
+
+
+class TagArchive:
+    """Loads and saves one tag CSV together with its journal, snapshot and roster."""
+
+    def __init__(self, csv_path):
+        self.csv_path = csv_path
+        self.journal = TagJournal(journal_path_for(csv_path))
+        self.snapshot_path = snapshot_path_for(csv_path)
+        self.snapshot_upto = 0        # Journal position the snapshot on disk includes
+        self.pending_records = []     # Journalled changes the CSV does not contain yet
+        self.migrated = []            # (migration, rows changed) by the last `upgrade`
+
+    # --- LOADING ---
+    def open_journal(self, upgrade=False):
+        """Opens the journal for appending and keeps the changes not yet in the CSV for replay.
+        With upgrade=True, data written by an older version is upgraded too (see `upgrade`);
+        the tagger runs `upgrade` itself, on its history thread."""
+        self.pending_records = self.journal.open(self.csv_path, self.fingerprint)
+        if upgrade:
+            self.upgrade()
+        return self.pending_records
+
+    def fingerprint(self, path):
+        """What the journal and roster use to tell whether the data file at `path` changed."""
+        return csv_fingerprint(path)
+
+    def read_roster(self):
+        """The roster sidecar, if it matches the data file on disk."""
+        return read_roster(self.csv_path, self.fingerprint)
+
+    def read_history(self):
+        """Opens the snapshot if it is current, otherwise parses the CSV.
+        Returns (table, message, error, journal position the table includes)."""
+        table, header = read_snapshot(self.snapshot_path)
+        if table is not None and self.snapshot_is_current(header):
+            self.snapshot_upto = header["upto"]
+            return table, f"Loaded {len(table)} existing tags from snapshot {self.snapshot_path}", None, header["upto"]
+
+        upto = self.journal.exported_upto
+        if not os.path.isfile(self.csv_path):
+            return None, f"No existing data file found. A new one will be created at:\n{self.csv_path}", None, upto
+        try:
+            table = self.read_table()
+        except Exception as e:
+            return None, None, e, upto
+        if table is None:
+            return None, "Autosave file is empty. Starting fresh.", None, upto
+        return table, f"Loaded {len(table)} existing tags from {self.csv_path}", None, upto
+
+    def read_table(self):
+        """Parses the data file on disk, or returns None if it is empty."""
+        with open(self.csv_path, "r", newline="", encoding='utf-8') as f:
+            if os.path.getsize(self.csv_path) == 0:
+                return None
+            return TagTable.from_csv(f)
+
+    def snapshot_is_current(self, header):
+        """A snapshot can be used if it was written against this journal and nothing it
+        relies on has been trimmed from the journal since."""
+        return (header["journal_id"] == self.journal.id
+                and self.journal.exported_upto <= header["upto"] <= self.journal.last_seq)
+
+    def migration_messages(self):
+        return [f"Upgraded the data to version {m.version}: {m.description} ({count} rows changed)."
+                for m, count in self.migrated]
+
+    def schema_warnings(self):
+        """A note if the data is older than this version and was loaded without upgrading it."""
+        version = self.schema_version()
+        if self.migrated or not os.path.isfile(self.csv_path) or not migrations_after(version):
+            return []
+        return [f"NOTE: The data is at version {version}, not {SCHEMA_VERSION}, and is used as it is. "
+                f"Upgrade it with --upgrade, or by opening it in the tagger."]
+
+    def journal_warnings(self):
+        """Messages about what opening the journal had to repair or set aside."""
+        warnings = []
+        if self.journal.repaired_csv:
+            warnings.append("WARNING: An interrupted CSV export was rolled back; the tags are still in the journal.")
+        if self.journal.orphaned_path:
+            warnings.append(f"WARNING: CSV changed outside the tagger. Old journal kept at:\n{self.journal.orphaned_path}")
+        return warnings
+
+    def load_all(self, upgrade=False, readonly=False):
+        """Opens the journal and returns the complete history, including journalled changes
+        not yet exported, for batch tools. Raises the error if the CSV cannot be read.
+        upgrade=True upgrades old data first; readonly=True (a dry run) writes nothing at
+        all, not even the journal, and cannot be saved."""
+        if readonly:
+            if upgrade:
+                raise ValueError("a read-only load cannot upgrade the data")
+            self.pending_records = self.journal.peek(self.csv_path, self.fingerprint)
+        else:
+            self.open_journal(upgrade)
+        table, message, error, upto = self.read_history()
+        if error:
+            raise error
+        rows = table if table is not None else TagTable(STANDARD_HEADERS)
+        apply_records(rows, self.take_pending(upto))
+        return rows
+
+    def take_pending(self, upto):
+        """Returns (and forgets) the journalled changes made after journal position `upto`."""
+        pending = [r for r in self.pending_records if r["seq"] > upto]
+        self.pending_records = []
+        return pending
+
+    # --- SAVING ---
+    def needs_export(self):
+        # Not last_seq > exported_upto: the export's own bookkeeping record would count
+        return bool(self.journal.unexported)
+
+    def export(self, rows, upto=None):
+        """Brings the CSV up to date with the journalled rows. Only appends the rows added
+        since the last export, unless exported rows were changed, in which case the file
+        is rewritten atomically. `rows` are the rows as of journal position `upto` (by
+        default the latest), so a copy can be exported while tagging carries on.
+        Returns ("appended" | "rewrote", row count)."""
+        if upto is None:
+            upto = self.journal.last_seq
+        first_new = self._appendable_from(rows, upto)
+        if first_new is None:
+            new_fp = self._rebuild_csv(rows, upto)
+            result = ("rewrote", len(rows))
+        else:
+            new_fp = self._append_csv_rows(rows, first_new, upto)
+            result = ("appended", len(rows) - first_new)
+        write_roster(self.csv_path, rows, new_fp)
+        return result
+
+    def save_all(self, rows, version=None):
+        """Rewrites the CSV, roster and snapshot from `rows`, for changes made without the
+        journal (batch tools). `rows` must include every journalled change. `version` is the
+        schema version the rows are at: by default the data file's own (the current one for
+        a new file), as saving does not upgrade anything."""
+        if version is None:
+            version = self.schema_version() if os.path.isfile(self.csv_path) else SCHEMA_VERSION
+        upto = self.journal.last_seq
+        new_fp = self._rebuild_csv(rows, upto)
+        write_roster(self.csv_path, rows, new_fp)
+        # The old snapshot may claim to be current for this journal position; replace it
+        self.write_snapshot(rows, self.journal.last_seq)
+        self.stamp_schema(version)
+
+    def write_snapshot(self, table, upto):
+        write_snapshot(self.snapshot_path, table, self.journal.id, upto)
+        self.snapshot_upto = upto
+
+    def close(self):
+        self.journal.close()
+
+    # --- SCHEMA ---
+    def schema_version(self):
+        return read_schema_version(self.csv_path)
+
+    def stamp_schema(self, version=SCHEMA_VERSION):
+        """Marks the data file as written in a schema version (by default the current one)."""
+        write_schema_version(self.csv_path, version)
+
+    def upgrade(self):
+        """Runs the migrations (tag_schema.py) the data file has not had yet, in one streaming
+        pass, and stamps it with the current schema version. Needs the journal open.
+        Returns [(migration, rows changed)], also kept in `migrated`."""
+        migrations = migrations_after(self.schema_version())
+        if not migrations:
+            self.migrated = []
+            return self.migrated
+        counts = {}
+        if os.path.isfile(self.csv_path):
+            counts = self._migrate(migrations)
+            if any(counts.values()) and os.path.isfile(self.snapshot_path):
+                # The snapshot holds the rows as they were before
+                os.remove(self.snapshot_path)
+        self.stamp_schema()
+        self.migrated = [(m, counts.get(m.version, 0)) for m in migrations]
+        return self.migrated
+
+    # --- INTERNALS ---
+    def _appendable_from(self, rows, upto):
+        """Returns the first row not yet in the CSV if the export can simply append rows,
+        or None if exported rows were undone/amended or the columns changed."""
+        records = [r for r in list(self.journal.unexported) if r["seq"] <= upto]
+        net_added = sum(1 if r["op"] == "add" else -1 if r["op"] == "undo" else 0 for r in records)
+        first_new = len(rows) - net_added
+        if any(r["op"] != "add" and r["index"] < first_new for r in records):
+            return None
+        try:
+            with open(self.csv_path, "r", newline="", encoding='utf-8') as f:
+                if next(csv.reader(f), None) != csv_headers(rows):
+                    return None
+        except OSError:
+            return None
+        return first_new
+
+    def _append_csv_rows(self, rows, first_new, upto):
+        """Appends rows[first_new:] to the CSV, recording the expected result in the journal first."""
+        buffer = io.StringIO()
+        with open(self.csv_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                buffer.write("\r\n")
+        writer = csv.DictWriter(buffer, fieldnames=csv_headers(rows), restval='')
+        writer.writerows(rows[i] for i in range(first_new, len(rows)))
+        data = buffer.getvalue().encode("utf-8")
+
+        old_fp = csv_fingerprint(self.csv_path)
+        new_fp = appended_fingerprint(self.csv_path, data)
+        self.journal.mark_exported(upto, new_fp, append_from=old_fp)
+        with open(self.csv_path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal.rotate(upto, new_fp)
+        return new_fp
+
+    def _migrate(self, migrations):
+        """Streams the CSV through the migrations into a new file and swaps it in the way an
+        export would, if any row changed. Returns {version: rows changed}."""
+        tmp_path = self.csv_path + ".tmp"
+        with open(self.csv_path, "r", newline="", encoding="utf-8") as source, \
+                open(tmp_path, "w", newline="", encoding="utf-8") as target:
+            counts, headers = migrate_csv(source, target, migrations)
+            target.flush()
+            os.fsync(target.fileno())
+        if not any(counts.values()) and not any(m.adds for m in migrations):
+            os.remove(tmp_path)
+            return counts
+        upto = self.journal.exported_upto
+        new_fp = csv_fingerprint(tmp_path)
+        self.journal.mark_exported(upto, new_fp)
+        os.replace(tmp_path, self.csv_path)
+        self.journal.rotate(upto, new_fp)
+        return counts
+
+    def _rebuild_csv(self, rows, upto):
+        """Writes a complete new CSV beside the old one, then swaps it in atomically."""
+        tmp_path = self.csv_path + ".tmp"
+        write_csv(tmp_path, rows)
+        new_fp = csv_fingerprint(tmp_path)
+        self.journal.mark_exported(upto, new_fp)
+        os.replace(tmp_path, self.csv_path)
+        self.journal.rotate(upto, new_fp)
+        return new_fp
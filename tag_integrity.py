@@ -0,0 +1,285 @@
+"""Whole-archive integrity checks, race by race, before the data is published.
+
+Checks every race (Year, Competition, Location, Gender, Phase) of a tag history
+against the rules the tagger and the report rely on:
+
+    ramp        every bib has exactly one Ramp row (a DNS bib may have none)
+    order       each gate's Orders are 1..n, without gaps or repeats, and a bib crosses the finish once
+    finish      Finish rows are ranked in the order the boats crossed the line
+    fault rank  a faulted bib's fault row ranks it behind every clean starter
+    dns         a DNS is one Start row ranked "DNS", and the bib has no tags after it
+
+The checks work on the TagTable columns rather than on rows: each distinct
+value of a column is classified once, then the whole history is grouped by race
+and bib in one pass over the column codes, so a full archive of 100k+ rows is
+checked in well under a second. Violations name the CSV lines they concern.
+
+Ranks follow what the tagger stores: the Final Position of a Finish row is the
+crossing order, and faulting a bib ranks it last on its fault row (the gate row
+the fault is recorded on, or its own FLT row), leaving its Finish row alone.
+Races tagged by older versions instead rank every row by the result (clean
+finishers 1..n in crossing order, faulted bibs behind them, often with no rank on
+the fault row), and the finish check accepts a race that holds either. Those
+races (told apart by their gate rows, which carry no Ramp Position) may also
+keep the crossing order on a Finish row a fault was noted on.
+
+    python tag_integrity.py [data/kx_race_analysis_git.csv ...] [--check order finish] [--limit 50]
+"""
+import argparse
+import os
+import sys
+import time
+from collections import namedtuple
+
+from tag_archive import open_archive
+from tag_table import IntColumn
+from tagging_session import get_ordinal_suffix
+
+RACE_FIELDS = ("Year", "Competition", "Location", "Gender", "Phase")
+CHECKS = ("ramp", "order", "finish", "fault rank", "dns")
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "kx_race_analysis_git.csv")
+
+# Gate kinds, worked out once per distinct Gate value
+RAMP, START, NOTES, TAG = "ramp", "start", "notes", "tag"
+
+Violation = namedtuple("Violation", "check race bib rows message")
+
+
+def csv_line(index):
+    """Line of the CSV a row index is on (line 1 is the header)."""
+    return index + 2
+
+
+def format_violation(violation):
+    race = " ".join(part for part in violation.race if part)
+    lines = ", ".join(str(csv_line(i)) for i in violation.rows[:10]) + (", ..." if len(violation.rows) > 10 else "")
+    bib = f" {violation.bib}" if violation.bib else ""
+    return f"{violation.check}: {race}{bib}: {violation.message} (line{'s' if len(violation.rows) > 1 else ''} {lines})"
+
+
+# --- COLUMNS ---
+def _gate_kind(gate):
+    if gate == "Ramp":
+        return RAMP
+    if gate == "Start":
+        return START
+    if gate.strip().lower() == "notes":
+        return NOTES
+    return TAG
+
+
+def _classified(table, header, classify):
+    """classify(value) of every row, called once per distinct value of the column."""
+    column = table.columns.get(header)
+    if column is None:
+        return [classify("")] * len(table)
+    lookup = {code: classify(column.decode(code)) for code in set(column.codes)}
+    return list(map(lookup.__getitem__, column.codes))
+
+
+def _numbers(table, header):
+    """Positive whole numbers of an Order/Final Position column, 0 for anything else."""
+    column = table.columns.get(header)
+    if column is None:
+        return [0] * len(table)
+    if isinstance(column, IntColumn):
+        return [code if code > 0 else 0 for code in column.codes]
+    return _classified(table, header, lambda v: int(v) if v.isdigit() else 0)
+
+
+def _race_ids(table):
+    """(race id of every row, race key of every id)."""
+    columns = [table.columns[f].codes if f in table.columns else [0] * len(table) for f in RACE_FIELDS]
+    ids = {}
+    rows = [ids.setdefault(codes, len(ids)) for codes in zip(*columns)]
+    races = [None] * len(ids)
+    for codes, race in ids.items():
+        races[race] = tuple(table.columns[f].decode(code) if f in table.columns else "" for f, code in zip(RACE_FIELDS, codes))
+    return rows, races
+
+
+# --- CHECKING ---
+class RaceRows:
+    """The rows of one race the checks need, grouped by bib (row indices into the table)."""
+    __slots__ = ("key", "bibs", "ramps", "dns", "odd_dns", "tagged", "finishes", "faulted", "fault_ranks", "sequences",
+                 "stamped")
+
+    def __init__(self, key):
+        self.key = key
+        self.bibs = {}          # bib -> None, in order of appearance
+        self.ramps = {}         # bib -> Ramp rows
+        self.dns = {}           # bib -> DNS rows
+        self.odd_dns = []       # DNS rows without Gate Start, Action DNS and Final Position DNS
+        self.tagged = {}        # bib -> rows tagged in a sequence (Order above 0)
+        self.finishes = {}      # bib -> [(row, order, final position)] of tagged Finish rows
+        self.faulted = {}       # bib -> first row with a fault
+        self.fault_ranks = {}   # bib -> (row, final position) of the first ranked row with a fault
+        self.sequences = {}     # gate -> [(row, order)] of tagged rows
+        self.stamped = False    # Gate rows carry the Ramp Position, as the tagger writes them now
+
+    def clean(self, bib):
+        return bib not in self.faulted and bib not in self.dns
+
+    def crossings(self):
+        """[(place, order, bib, row, final position)] of the bibs with one Finish row, in crossing order."""
+        finishes = sorted((rows[0][1], bib, rows[0][0], rows[0][2]) for bib, rows in self.finishes.items() if len(rows) == 1)
+        return [(place,) + finish for place, finish in enumerate(finishes, start=1)]
+
+
+def group_races(table):
+    """RaceRows of every race in a TagTable, in file order, from one pass over the rows."""
+    race_ids, race_keys = _race_ids(table)
+    bibs = _classified(table, "BIB", str.strip)
+    kinds = _classified(table, "Gate", _gate_kind)
+    gates = _classified(table, "Gate", str.strip)
+    is_finish = _classified(table, "Gate", lambda v: v.strip() == "Finish")
+    is_dns = _classified(table, "Action", lambda v: v.strip().upper() == "DNS")
+    is_fault_only = _classified(table, "Action", lambda v: v.strip().upper() in ("FLT", "RAL"))
+    has_fault = _classified(table, "Faults", lambda v: bool(v.strip()))  # The tagger writes nothing else there
+    ranked_dns = _classified(table, "Final Position", lambda v: v.strip().upper() == "DNS")
+    has_ramp = _classified(table, "Ramp Position", lambda v: bool(v.strip()))
+    orders = _numbers(table, "Order")
+    finals = _numbers(table, "Final Position")
+
+    races = [RaceRows(key) for key in race_keys]
+    rows = zip(map(races.__getitem__, race_ids), bibs, kinds, gates, is_finish, orders, finals)
+    for i, (race, bib, kind, gate, finish, order, final) in enumerate(rows):
+        if not bib or kind == NOTES:
+            continue
+        race.bibs[bib] = None
+        if is_fault_only[i] or has_fault[i]:
+            race.faulted.setdefault(bib, i)
+            if final:
+                race.fault_ranks.setdefault(bib, (i, final))
+        if is_dns[i] or ranked_dns[i] or kind == START:
+            race.dns.setdefault(bib, []).append(i)
+            if not (is_dns[i] and ranked_dns[i] and kind == START):
+                race.odd_dns.append(i)
+            continue
+        if kind == RAMP:
+            race.ramps.setdefault(bib, []).append(i)
+            continue
+        if has_ramp[i]:
+            race.stamped = True
+        if order and not is_fault_only[i]:
+            race.tagged.setdefault(bib, []).append(i)
+            race.sequences.setdefault(gate, []).append((i, order))
+            if finish:
+                race.finishes.setdefault(bib, []).append((i, order, final))
+    return races
+
+
+def check_table(table, checks=CHECKS):
+    """Every violation of the given checks in a TagTable, race by race in file order."""
+    violations = []
+    for race in group_races(table):
+        for check in checks:
+            violations += CHECK_FUNCTIONS[check](race)
+    return violations
+
+
+def _check_ramp(race):
+    for bib in race.bibs:
+        rows = race.ramps.get(bib, [])
+        if len(rows) > 1:
+            yield Violation("ramp", race.key, bib, rows, f"{len(rows)} Ramp rows")
+        elif not rows and bib not in race.dns:
+            yield Violation("ramp", race.key, bib, race.tagged.get(bib, [])[:1], "no Ramp row")
+
+
+def _check_order(race):
+    for bib, rows in race.finishes.items():
+        if len(rows) > 1:
+            yield Violation("order", race.key, bib, [i for i, _, _ in rows], f"{len(rows)} Finish rows")
+    for gate, tags in race.sequences.items():
+        orders = sorted(order for _, order in tags)
+        if orders != list(range(1, len(orders) + 1)):
+            listed = ", ".join(map(str, orders))
+            yield Violation("order", race.key, "", [i for i, _ in tags], f"{gate} Orders are {listed}, not 1..{len(orders)}")
+
+
+def _check_finish(race):
+    # Unranked Finish rows are older tagging that kept the rank on other rows; a Finish row
+    # with a fault on it is the bib's fault row, which the fault rank check judges
+    ranked = [crossing for crossing in race.crossings() if crossing[4]]
+    fault_rows = {i for i, _ in race.fault_ranks.values()}
+    wrong = [crossing for crossing in ranked if crossing[4] != crossing[0] and crossing[3] not in fault_rows]
+    if not wrong or _ranked_by_result(race, ranked):
+        return
+    for place, order, bib, i, final in wrong:
+        yield Violation("finish", race.key, bib, [i], f"finished {order}{get_ordinal_suffix(order)} but ranked {final}")
+
+
+def _ranked_by_result(race, ranked):
+    """True if the Finish rows hold the result, as older tagging stored it: the clean
+    finishers ranked 1..n in crossing order and the faulted ones behind them."""
+    clean = [final for _, _, bib, _, final in ranked if race.clean(bib)]
+    return (clean == list(range(1, len(clean) + 1))
+            and all(final > len(clean) for _, _, bib, _, final in ranked if not race.clean(bib)))
+
+
+def _check_fault_rank(race):
+    faulted = [bib for bib in race.faulted if bib not in race.dns]
+    clean = sum(1 for bib in race.bibs if race.clean(bib))
+    crossings = race.crossings()
+    places = {bib: place for place, _, bib, _, _ in crossings}
+    # Older tagging may have kept the crossing order on a Finish row the fault was noted on;
+    # in a race the tagger writes now, that row is the fault row and ranks the bib last
+    legacy = not race.stamped or _ranked_by_result(race, [crossing for crossing in crossings if crossing[4]])
+    for bib in faulted:
+        if bib not in race.fault_ranks:
+            continue  # Older tagging: the rank is on the Finish row, which the finish check judges
+        i, final = race.fault_ranks[bib]
+        on_finish = any(i == row for row, _, _ in race.finishes.get(bib, ()))
+        if not clean < final <= len(race.bibs) and not (legacy and on_finish and final == places.get(bib)):
+            yield Violation("fault rank", race.key, bib, sorted({race.faulted[bib], i}),
+                            f"faulted but ranked {final}, not behind the {clean} clean starters")
+
+
+def _check_dns(race):
+    for bib, rows in race.dns.items():
+        if len(rows) > 1:
+            yield Violation("dns", race.key, bib, rows, f"{len(rows)} DNS rows")
+        for i in rows:
+            if i in race.odd_dns:
+                yield Violation("dns", race.key, bib, [i], "a DNS row needs Gate Start, Action DNS and Final Position DNS")
+        if bib in race.tagged:
+            yield Violation("dns", race.key, bib, rows[:1] + race.tagged[bib], f"DNS but tagged on {len(race.tagged[bib])} rows")
+
+
+CHECK_FUNCTIONS = {
+    "ramp": _check_ramp, "order": _check_order, "finish": _check_finish,
+    "fault rank": _check_fault_rank, "dns": _check_dns,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check tag histories race by race before they are published.")
+    parser.add_argument("csv_paths", nargs="*", default=[DEFAULT_CSV], help="tag CSVs (default: %(default)s)")
+    parser.add_argument("--check", nargs="+", choices=CHECKS, default=list(CHECKS), help="checks to run (default: all)")
+    parser.add_argument("--limit", type=int, default=50, help="violations to list per file, 0 for all (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    found = 0
+    for csv_path in args.csv_paths:
+        try:
+            table = open_archive(csv_path).read_table()
+        except (OSError, ValueError) as e:
+            print(f"ERROR: Could not read {csv_path}: {e}", file=sys.stderr)
+            return 1
+        started = time.perf_counter()
+        violations = check_table(table, args.check)
+        elapsed = time.perf_counter() - started
+        shown = violations[:args.limit] if args.limit else violations
+        for violation in shown:
+            print(format_violation(violation))
+        if len(shown) < len(violations):
+            print(f"... and {len(violations) - len(shown)} more")
+        counts = ", ".join(f"{sum(v.check == c for v in violations)} {c}" for c in args.check)
+        print(f"{csv_path}: {len(table)} rows checked in {elapsed:.2f}s, {len(violations)} violations ({counts})")
+        found += len(violations)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""Append-only journal of tag mutations.
+
+Every tag, undo and in-place amend is written as one fsync'd JSON line, so the
+cost of saving a tag does not depend on how big the CSV history is. The CSV is
+exported from memory separately and the journal is trimmed once the exported
+file is safely in place.
+
+With `write_behind` set, records are only queued in memory by the caller and
+written by `flush`, typically from a writer thread; several records queued
+between flushes share one write and one fsync.
+"""
+import hashlib
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+# Records that change the data, as opposed to bookkeeping records
+MUTATION_OPS = ("add", "undo", "amend")
+FINGERPRINT_TAIL_BYTES = 4096
+
+
+def csv_fingerprint(path, size=None):
+    """Returns a cheap [size, tail hash] fingerprint of a file (or of its first `size`
+    bytes), or None if it does not exist."""
+    try:
+        with open(path, "rb") as f:
+            if size is None:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+            f.seek(max(0, size - FINGERPRINT_TAIL_BYTES))
+            tail = f.read(min(size, FINGERPRINT_TAIL_BYTES))
+    except FileNotFoundError:
+        return None
+    return [size, hashlib.sha1(tail).hexdigest()]
+
+
+def appended_fingerprint(path, data):
+    """Fingerprint the file at `path` will have once `data` (bytes) is appended to it."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - FINGERPRINT_TAIL_BYTES))
+            tail = f.read()
+    except FileNotFoundError:
+        size, tail = 0, b""
+    return [size + len(data), hashlib.sha1((tail + data)[-FINGERPRINT_TAIL_BYTES:]).hexdigest()]
+
+
+def apply_records(rows, records):
+    """Replays journal mutation records onto an in-memory list of rows."""
+    for record in records:
+        op = record["op"]
+        if op == "add":
+            rows.append(record["row"])
+        elif op == "undo":
+            # Only pop if the row being undone is still the last one
+            if rows and len(rows) - 1 == record["index"]:
+                rows.pop()
+        elif op == "amend":
+            if 0 <= record["index"] < len(rows):
+                rows[record["index"]].update(record["fields"])
+
+
+class TagJournal:
+    """Durable, append-only log of tag mutations sitting next to the CSV."""
+
+    def __init__(self, path):
+        self.path = path
+        self.id = None
+        self.next_seq = 1
+        self.exported_upto = 0
+        self.orphaned_path = None
+        self.repaired_csv = False
+        self.unexported = []  # Mutation records not yet in the CSV
+        self.write_behind = False  # Leave writing records to flush()
+        self._file = None
+        self._unwritten = b""      # Records appended but not yet written
+        self._unsynced = False     # Written but the fsync failed
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    @property
+    def last_seq(self):
+        return self.next_seq - 1
+
+    def open(self, csv_path, fingerprint=csv_fingerprint):
+        """Opens the journal for appending and returns the records not yet contained in the CSV.
+        `fingerprint(path)` identifies the data file's contents (csv_fingerprint for a CSV)."""
+        header, records = self._read()
+        csv_fp = self._repair_torn_append(csv_path, records, fingerprint)
+        pending = []
+        if header is None:
+            self.id = uuid.uuid4().hex
+            self._rewrite(self._base_header(0, csv_fp), [])
+        else:
+            self.id = header.get("id") or uuid.uuid4().hex
+            self.next_seq = max([header.get("next_seq", header["upto"] + 1)] + [r["seq"] + 1 for r in records])
+            base_upto = self._match_base(header, records, csv_fp)
+            if base_upto is None:
+                # The CSV was changed by something else; keep the journal aside rather than replay it
+                stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+                self.orphaned_path = f"{self.path}.orphaned-{stamp}"
+                os.replace(self.path, self.orphaned_path)
+                base_upto = self.last_seq
+                self.id = uuid.uuid4().hex
+                self._rewrite(self._base_header(base_upto, csv_fp), [])
+            else:
+                pending = [r for r in records if r["op"] in MUTATION_OPS and r["seq"] > base_upto]
+            self.exported_upto = base_upto
+        self.unexported = list(pending)
+        self._file = open(self.path, "ab", buffering=0)
+        return pending
+
+    def peek(self, csv_path, fingerprint=csv_fingerprint):
+        """Returns the records `open` would, without creating, repairing or trimming anything
+        (for dry runs). If the CSV does not match the journal, nothing is replayed."""
+        header, records = self._read()
+        if header is None:
+            return []
+        self.id = header.get("id")
+        self.next_seq = max([header.get("next_seq", header["upto"] + 1)] + [r["seq"] + 1 for r in records])
+        base_upto = self._match_base(header, records, fingerprint(csv_path))
+        if base_upto is None:
+            self.exported_upto = self.last_seq
+            return []
+        self.exported_upto = base_upto
+        self.unexported = [r for r in records if r["op"] in MUTATION_OPS and r["seq"] > base_upto]
+        return list(self.unexported)
+
+    def close(self):
+        if self._file:
+            self.flush()
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def flush(self):
+        """Writes and fsyncs the records appended since the last flush. Appending carries on
+        while the disk is busy. After a failed write the rest is retried by the next flush,
+        from the exact byte it stopped at. Raises OSError on failure."""
+        with self._flush_lock:
+            with self._lock:
+                data = self._unwritten
+            if not data and not self._unsynced:
+                return
+            written = 0
+            try:
+                while written < len(data):
+                    written += self._file.write(data[written:])
+                self._unsynced = True
+                os.fsync(self._file.fileno())
+                self._unsynced = False
+            finally:
+                with self._lock:
+                    self._unwritten = self._unwritten[written:]
+
+    @property
+    def unwritten(self):
+        """Bytes of records not yet written to disk."""
+        return len(self._unwritten)
+
+    # --- MUTATION RECORDS ---
+    def append_row(self, row):
+        return self._append({"op": "add", "row": row})
+
+    def undo(self, index):
+        return self._append({"op": "undo", "index": index})
+
+    def amend(self, index, fields):
+        return self._append({"op": "amend", "index": index, "fields": fields})
+
+    # --- EXPORT BOOKKEEPING ---
+    def mark_exported(self, upto, csv_fp, append_from=None):
+        """Records that a CSV with this fingerprint contains everything up to `upto`.
+        Must be written before the CSV on disk is replaced or appended to; for an
+        append, `append_from` is the fingerprint of the CSV before appending."""
+        record = {"op": "exported", "upto": upto, "csv": csv_fp}
+        if append_from is not None:
+            record["append_from"] = append_from
+        self._append(record)
+        self.flush()
+
+    def rotate(self, upto, csv_fp):
+        """Drops every record already contained in the CSV, keeping later ones. Records
+        appended but not yet written stay queued for the new file."""
+        self.flush()
+        with self._flush_lock, self._lock:
+            self._file.close()
+            _, records = self._read()
+            keep = [r for r in records if r["op"] in MUTATION_OPS and r["seq"] > upto]
+            self._rewrite(self._base_header(upto, csv_fp), keep)
+            self.exported_upto = upto
+            self.unexported = [r for r in self.unexported if r["seq"] > upto]
+            self._file = open(self.path, "ab", buffering=0)
+
+    # --- INTERNALS ---
+    def _append(self, record):
+        with self._lock:
+            record["seq"] = self.next_seq
+            self.next_seq += 1
+            self._unwritten += (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+            if record["op"] in MUTATION_OPS:
+                self.unexported.append(record)
+        if not self.write_behind:
+            self.flush()
+        return record["seq"]
+
+    def _read(self):
+        """Returns (header, records). A torn last line from a crash is ignored."""
+        if not os.path.isfile(self.path):
+            return None, []
+        header, records = None, []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if header is None:
+                    header = record
+                else:
+                    records.append(record)
+        return header, records
+
+    def _repair_torn_append(self, csv_path, records, fingerprint):
+        """Cuts a CSV back to its last complete state if a crash interrupted an append.
+        Returns the fingerprint of the CSV on disk."""
+        csv_fp = fingerprint(csv_path)
+        if csv_fp is None:
+            return None
+        for record in reversed(records):
+            if record["op"] != "exported":
+                continue
+            if record["csv"] == csv_fp:
+                break
+            old_fp = record.get("append_from")
+            if old_fp and old_fp[0] < csv_fp[0] < record["csv"][0] and csv_fingerprint(csv_path, old_fp[0]) == old_fp:
+                with open(csv_path, "r+b") as f:
+                    f.truncate(old_fp[0])
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.repaired_csv = True
+                return old_fp
+        return csv_fp
+
+    def _match_base(self, header, records, csv_fp):
+        """Finds the latest journal position the CSV on disk corresponds to."""
+        base_upto = header["upto"] if header["csv"] == csv_fp else None
+        for record in records:
+            if record["op"] == "exported" and record["csv"] == csv_fp:
+                base_upto = record["upto"]
+        return base_upto
+
+    def _base_header(self, upto, csv_fp):
+        # next_seq keeps sequence numbers increasing across trims, so positions stay comparable
+        return {"op": "base", "id": self.id, "upto": upto, "next_seq": self.next_seq, "csv": csv_fp}
+
+    def _rewrite(self, header, records):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in [header] + records:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,325 @@
+"""Partitioned storage: one CSV per Year/Competition/Gender plus a small manifest.
+
+In partitioned mode the tag history lives under data/partitions/ instead of in one
+kx_race_analysis_git.csv:
+
+    partitions/manifest.json                     headers, partitions, row order
+    partitions/2026/world-cup-1_M-3f9c0a1b2d.csv one event and gender
+
+Partition files are named after a hash of their contents and never changed in
+place. A save writes new files only for the partitions whose rows changed, then
+swaps in a new manifest atomically; files the manifest no longer lists are
+removed afterwards. The manifest also records the order rows were tagged in (as
+runs of partitions), so the partitions read back as exactly the original table.
+
+`PartitionedArchive` is a `TagArchive` whose data file is the manifest: the
+journal, snapshot and roster work as with the CSV, and the tagger and the batch
+tools use it through `open_archive` whenever a manifest is present.
+
+    python tag_partitions.py split [CSV]   switch to partitioned mode
+    python tag_partitions.py join [CSV]    write everything back into the CSV
+    python tag_partitions.py list [CSV]    show the partitions
+"""
+import argparse
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import sys
+from datetime import datetime
+
+from roster import write_roster
+from tag_archive import DEFAULT_DATA_PATH, TagArchive, csv_headers, open_archive, render_csv
+from tag_journal import csv_fingerprint
+from tag_schema import migrate_csv, migrated_headers
+from tag_table import TagTable
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+PARTITION_FIELDS = ("Year", "Competition", "Gender")
+# <slug>-<first 10 hex digits of the content hash>.csv
+PARTITION_FILE_PATTERN = re.compile(r"-[0-9a-f]{10}\.csv$")
+
+
+def partitions_dir_for(csv_path):
+    return os.path.join(os.path.dirname(csv_path), "partitions")
+
+
+def manifest_path_for(csv_path):
+    return os.path.join(partitions_dir_for(csv_path), MANIFEST_NAME)
+
+
+def partition_key(row):
+    return tuple(str(row.get(field, "")) for field in PARTITION_FIELDS)
+
+
+def partition_slug(value):
+    return re.sub(r"[^a-z0-9]+", "-", value.lower()).strip("-") or "none"
+
+
+def partition_file(key, digest):
+    """Path of a partition file, relative to the partitions directory."""
+    year, competition, gender = key
+    return f"{partition_slug(year)}/{partition_slug(competition)}_{partition_slug(gender)}-{digest[:10]}.csv"
+
+
+def group_partitions(table):
+    """Returns ({key: row indices} in order of first appearance, runs), where runs are
+    [partition number, row count] pairs giving the order of the rows across partitions."""
+    keys = list(zip(*(table.column_values(field) for field in PARTITION_FIELDS)))
+    groups = {}
+    for i, key in enumerate(keys):
+        groups.setdefault(key, []).append(i)
+    numbers = {key: n for n, key in enumerate(groups)}
+    runs = [[numbers[key], sum(1 for _ in run)] for key, run in itertools.groupby(keys)]
+    return groups, runs
+
+
+def read_manifest(directory):
+    """The manifest of a partitions directory, or None if there is none."""
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"{directory}: unsupported partition manifest version {manifest.get('version')!r}")
+    return manifest
+
+
+def write_partition_files(directory, table, changed=None):
+    """Writes the partition files a new manifest for `table` needs and returns that manifest
+    (not yet written). Partitions are only rendered if they are in `changed` or their row
+    count differs from the current manifest (with changed=None, all of them), and only
+    written if their contents differ. Returns (manifest, partitions written, rows in them)."""
+    old = read_manifest(directory)
+    headers = csv_headers(table)
+    old_entries = {}
+    if old is not None and old["headers"] == headers:
+        old_entries = {tuple(entry["key"]): entry for entry in old["partitions"]}
+
+    groups, runs = group_partitions(table)
+    entries, written, written_rows = [], 0, 0
+    for key, indices in groups.items():
+        entry = old_entries.get(key)
+        if entry is not None and changed is not None and key not in changed and entry["rows"] == len(indices):
+            entries.append(entry)
+            continue
+        data = render_csv(table.take(indices), headers)
+        digest = hashlib.sha1(data).hexdigest()
+        if entry is None or entry["sha1"] != digest:
+            entry = {"key": list(key), "path": partition_file(key, digest), "rows": len(indices), "sha1": digest}
+            write_partition_file(os.path.join(directory, entry["path"]), data)
+            written += 1
+            written_rows += len(indices)
+        entries.append(entry)
+    manifest = {"version": MANIFEST_VERSION, "rows": len(table), "headers": headers, "fields": list(PARTITION_FIELDS),
+                "partitions": entries, "runs": runs}
+    return manifest, written, written_rows
+
+
+def write_partition_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def remove_unlisted_files(directory, manifest):
+    """Deletes partition files the manifest no longer refers to."""
+    listed = {os.path.normpath(entry["path"]) for entry in manifest["partitions"]}
+    for folder, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.relpath(os.path.join(folder, name), directory)
+            if PARTITION_FILE_PATTERN.search(name) and os.path.normpath(path) not in listed:
+                os.remove(os.path.join(folder, name))
+
+
+def read_partitions(directory, keep=None):
+    """Reads the partitions back as one TagTable in the original row order. `keep(key)`
+    can select partitions, e.g. one season; the rest are not read at all."""
+    manifest = read_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No partition manifest in {directory}")
+    table = TagTable(manifest["headers"])
+    starts = {}
+    for number, entry in enumerate(manifest["partitions"]):
+        if keep is not None and not keep(tuple(entry["key"])):
+            continue
+        with open(os.path.join(directory, entry["path"]), "r", newline="", encoding="utf-8") as f:
+            part = TagTable.from_csv(f)
+        if len(part) != entry["rows"]:
+            raise ValueError(f"{entry['path']}: {len(part)} rows, the manifest says {entry['rows']}")
+        starts[number] = len(table)
+        table.extend(part)
+
+    order = []
+    for number, count in manifest["runs"]:
+        if number in starts:
+            order.extend(range(starts[number], starts[number] + count))
+            starts[number] += count
+    return table.take(order)
+
+
+class PartitionedArchive(TagArchive):
+    """A TagArchive kept as partition files; the manifest stands in for the CSV."""
+
+    def __init__(self, csv_path):
+        self.directory = partitions_dir_for(csv_path)
+        super().__init__(os.path.join(self.directory, MANIFEST_NAME))
+
+    def read_table(self):
+        return read_partitions(self.directory)
+
+    def export(self, rows, upto=None):
+        """Writes the partitions the journalled changes touched and a new manifest.
+        Returns (description, rows written)."""
+        if upto is None:
+            upto = self.journal.last_seq
+        manifest, written, written_rows, new_fp = self._save_partitions(rows, upto, self._changed_partitions(rows, upto))
+        write_roster(self.csv_path, rows, new_fp)
+        return f"rewrote {written} of {len(manifest['partitions'])} partitions with", written_rows
+
+    def _rebuild_csv(self, rows, upto):
+        # save_all: no journal to go by, so every partition is compared
+        return self._save_partitions(rows, upto, None)[3]
+
+    def _migrate(self, migrations):
+        """Streams each partition through the migrations into a new partition file (when it
+        changes) and swaps in a new manifest. Returns {version: rows changed}."""
+        manifest = read_manifest(self.directory)
+        headers = migrated_headers(manifest["headers"], migrations)
+        counts, entries = {}, []
+        for entry in manifest["partitions"]:
+            buffer = io.StringIO(newline="")
+            with open(os.path.join(self.directory, entry["path"]), "r", newline="", encoding="utf-8") as f:
+                part_counts = migrate_csv(f, buffer, migrations)[0]
+            for version, count in part_counts.items():
+                counts[version] = counts.get(version, 0) + count
+            data = buffer.getvalue().encode("utf-8")
+            digest = hashlib.sha1(data).hexdigest()
+            if digest != entry["sha1"]:
+                entry = dict(entry, path=partition_file(tuple(entry["key"]), digest), sha1=digest)
+                write_partition_file(os.path.join(self.directory, entry["path"]), data)
+            entries.append(entry)
+        if entries != manifest["partitions"] or headers != manifest["headers"]:
+            self._write_manifest(dict(manifest, headers=headers, partitions=entries), self.journal.exported_upto)
+        return counts
+
+    def _save_partitions(self, rows, upto, changed):
+        manifest, written, written_rows = write_partition_files(self.directory, rows, changed)
+        new_fp = self._write_manifest(manifest, upto)
+        return manifest, written, written_rows, new_fp
+
+    def _write_manifest(self, manifest, upto):
+        """Swaps in a new manifest, recording it in the journal the way an export does."""
+        tmp_path = self.csv_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        new_fp = csv_fingerprint(tmp_path)
+        self.journal.mark_exported(upto, new_fp)
+        os.replace(tmp_path, self.csv_path)
+        self.journal.rotate(upto, new_fp)
+        remove_unlisted_files(self.directory, manifest)
+        return new_fp
+
+    def _changed_partitions(self, rows, upto):
+        """Partitions of the rows added or amended up to `upto`. Rows undone, or moved to
+        another partition, change partition row counts, which are checked anyway."""
+        changed = set()
+        for record in list(self.journal.unexported):
+            if record["seq"] > upto:
+                continue
+            if record["op"] == "add":
+                changed.add(partition_key(record["row"]))
+            elif record["op"] == "amend" and record["index"] < len(rows):
+                changed.add(partition_key(rows[record["index"]]))
+        return changed
+
+
+def split(csv_path):
+    """Moves a CSV's history (journalled tags included) into partitions."""
+    archive = open_archive(csv_path)
+    if isinstance(archive, PartitionedArchive):
+        raise ValueError(f"{partitions_dir_for(csv_path)} is already in use; join it first")
+    if type(archive) is not TagArchive:
+        raise ValueError(f"{csv_path} is kept in {archive.csv_path}; write it back into the CSV first")
+    try:
+        rows = archive.load_all()
+        for warning in archive.journal_warnings():
+            print(warning, file=sys.stderr)
+        # Brings the CSV up to date too, so its journal holds nothing the partitions lack
+        archive.save_all(rows)
+        version = archive.schema_version()  # Carried over as it is: converting does not upgrade
+    finally:
+        archive.close()
+    os.makedirs(partitions_dir_for(csv_path), exist_ok=True)
+    partitioned = PartitionedArchive(csv_path)
+    try:
+        partitioned.load_all()
+        partitioned.save_all(rows, version)
+    finally:
+        partitioned.close()
+    return rows
+
+
+def join(csv_path):
+    """Writes the partitioned history back into the CSV and retires the partitions directory."""
+    partitioned = PartitionedArchive(csv_path)
+    try:
+        rows = partitioned.load_all()
+        for warning in partitioned.journal_warnings():
+            print(warning, file=sys.stderr)
+        version = partitioned.schema_version()
+    finally:
+        partitioned.close()
+    archive = TagArchive(csv_path)
+    try:
+        archive.open_journal()
+        archive.save_all(rows, version)
+    finally:
+        archive.close()
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    retired = f"{partitions_dir_for(csv_path)}.joined-{stamp}"
+    os.replace(partitions_dir_for(csv_path), retired)
+    return rows, retired
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split the tag CSV into per-event partitions, or join them back.")
+    parser.add_argument("command", choices=["split", "join", "list"])
+    parser.add_argument("csv", nargs="?", default=DEFAULT_DATA_PATH, help="tag CSV (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    directory = partitions_dir_for(args.csv)
+    try:
+        if args.command == "split":
+            rows = split(args.csv)
+            manifest = read_manifest(directory)
+            print(f"Split {len(rows)} rows into {len(manifest['partitions'])} partitions in {directory}")
+        elif args.command == "join":
+            rows, retired = join(args.csv)
+            print(f"Joined {len(rows)} rows into {args.csv}; old partitions kept in {retired}")
+        else:
+            manifest = read_manifest(directory)
+            if manifest is None:
+                print(f"{args.csv} is not partitioned.")
+                return 0
+            for entry in manifest["partitions"]:
+                print(f"{' '.join(entry['key']):<40} {entry['rows']:>7} rows  {entry['path']}")
+            print(f"{len(manifest['partitions'])} partitions, {manifest['rows']} rows, {len(manifest['runs'])} runs")
+    except (OSError, ValueError, csv.Error) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""Schema version of the tag data, and the migrations that bring older data up to it.
+
+The meaning of the columns changes now and then (Final Position used to be
+filled in on every gate row, for instance). Each such change is a migration,
+registered here with the version it brings the data to:
+
+    @migration(2, "what changed")
+    def what_changed(race_rows):
+        ...  # Changes the row dicts of one race in place; returns how many it changed
+
+Migrations see the data one race at a time (a run of rows with the same Year,
+Competition, Location, Gender and Phase), so the whole file is never in memory.
+
+The data file carries the version it is at: a small sidecar next to the CSV
+(<stem>.schema.json; in the manifest's folder when partitioned), or a meta entry
+in the SQLite database. When the tagger starts (or a batch tool runs with
+--upgrade), the migrations the data has not had yet run in one streaming pass over
+the rows (`TagArchive.upgrade`) and the version is stamped, so each runs once per
+data file. Files without a stamp are at version 0 and get every migration. Other
+tools use old data as it is and keep its version when they save it.
+
+A crash between rewriting the data and stamping it runs the migrations again on
+the next start, so a migration must leave rows it has already migrated alone.
+"""
+import csv
+import itertools
+import json
+import os
+import re
+from datetime import datetime
+
+MIGRATIONS = []  # In version order: MIGRATIONS[v - 1] brings the data to version v
+RACE_FIELDS = ("Year", "Competition", "Location", "Gender", "Phase")
+_FAULT_PATTERN = re.compile("FLT|FAULT|RAL|DSQ|DNF", re.I)
+
+
+class Migration:
+    """One registered change to the data: `function(race_rows)` updates the row dicts of one
+    race in place and returns how many it changed; `adds` are columns it introduces."""
+    __slots__ = ("version", "description", "function", "adds")
+
+    def __init__(self, version, description, function, adds=()):
+        self.version = version
+        self.description = description
+        self.function = function
+        self.adds = tuple(adds)
+
+
+def migration(version, description, adds=()):
+    """Registers a race migration as the change to the data that makes it `version`."""
+    def register(function):
+        if version != len(MIGRATIONS) + 1:
+            raise ValueError(f"migration {function.__name__}: version {version}, expected {len(MIGRATIONS) + 1}")
+        MIGRATIONS.append(Migration(version, description, function, adds))
+        return function
+    return register
+
+
+def migrations_after(version):
+    """The migrations data at `version` has not had yet, in order."""
+    return MIGRATIONS[max(0, version):]
+
+
+def migrated_headers(headers, migrations):
+    """Headers of the data once migrated: the existing ones, then any columns the migrations add."""
+    headers = list(headers)
+    for m in migrations:
+        headers += [h for h in m.adds if h not in headers]
+    return headers
+
+
+def race_of(row):
+    return tuple(row.get(field) or "" for field in RACE_FIELDS)
+
+
+def migrate_rows(rows, migrations, counts):
+    """Yields each row dict with the migrations applied, a race at a time, counting the rows
+    each one changed in `counts` ({version: rows})."""
+    for m in migrations:
+        counts.setdefault(m.version, 0)
+    for _, race_rows in itertools.groupby(rows, key=race_of):
+        race_rows = list(race_rows)
+        for m in migrations:
+            counts[m.version] += m.function(race_rows)
+        yield from race_rows
+
+
+def migrate_csv(source, target, migrations):
+    """Copies CSV text from one open file to another, migrating it a race at a time.
+    Returns ({version: rows changed}, headers written)."""
+    reader = csv.DictReader(source)
+    headers = migrated_headers(reader.fieldnames or [], migrations)
+    writer = csv.DictWriter(target, fieldnames=headers, restval="", extrasaction="ignore")
+    writer.writeheader()
+    counts = {}
+    writer.writerows(migrate_rows(reader, migrations, counts))
+    return counts, headers
+
+
+# --- VERSION STAMP ---
+def schema_path_for(csv_path):
+    return os.path.splitext(csv_path)[0] + ".schema.json"
+
+
+def read_schema_version(csv_path):
+    """The schema version stamped on a data file, 0 if it has none (or it is unreadable)."""
+    try:
+        with open(schema_path_for(csv_path), "r", encoding="utf-8") as f:
+            version = json.load(f).get("version")
+    except (OSError, ValueError, AttributeError):
+        return 0
+    return version if isinstance(version, int) else 0
+
+
+def write_schema_version(csv_path, version):
+    path = schema_path_for(csv_path)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": version, "stamped": datetime.now().isoformat(timespec="seconds")}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+# --- MIGRATIONS ---
+def is_result_row(row):
+    """Rows that carry a Final Position: Finish, DNS and fault rows."""
+    return (row.get("Gate") == "Finish" or row.get("Action") in ("DNS", "FLT")
+            or bool(_FAULT_PATTERN.search(row.get("Faults") or "")))
+
+
+@migration(1, "Final Position only on Finish, DNS and fault rows")
+def final_position_on_result_rows(race_rows):
+    # What CLEAN UP CSV did, except that a bib whose result rows carry no Final Position
+    # (races tagged without a Finish) keeps the rank its other rows hold
+    ranked = {row.get("BIB") for row in race_rows if is_result_row(row) and row.get("Final Position")}
+    changed = 0
+    for row in race_rows:
+        if row.get("Final Position") and row.get("BIB") in ranked and not is_result_row(row):
+            row["Final Position"] = ""
+            changed += 1
+    return changed
+
+
+SCHEMA_VERSION = len(MIGRATIONS)
@@ -0,0 +1,87 @@
+"""Fast-loading binary snapshot of a TagTable.
+
+Layout: a magic line, an 8-byte header length, a JSON header (journal position,
+headers, per-column vocabularies and byte ranges) and then the raw column code
+arrays. Loading maps the file and copies each code array straight out of it,
+so there is no CSV parsing or per-value decoding on startup.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from tag_table import CategoryColumn, IntColumn, TagTable
+
+SNAPSHOT_MAGIC = b"KXSNAP1\n"
+
+
+def snapshot_path_for(csv_path):
+    return os.path.splitext(csv_path)[0] + ".snapshot"
+
+
+def write_snapshot(path, table, journal_id, upto):
+    """Writes `table` as it stands after journal record `upto`, replacing any old snapshot atomically."""
+    columns, blobs, offset = [], [], 0
+    for header in table.headers:
+        column = table.columns[header]
+        blob = column.codes.tobytes()
+        meta = {"name": header, "offset": offset, "nbytes": len(blob)}
+        if isinstance(column, IntColumn):
+            meta.update(kind="int", specials=column.specials)
+        else:
+            meta.update(kind="category", values=column.values)
+        columns.append(meta)
+        blobs.append(blob)
+        offset += len(blob)
+    header = json.dumps({
+        "journal_id": journal_id, "upto": upto, "rows": len(table),
+        "byteorder": sys.byteorder, "columns": columns,
+    }).encode("utf-8")
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    """Returns (table, header) from a snapshot file, or (None, None) if it is missing or unreadable."""
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                return None, None
+            start = len(SNAPSHOT_MAGIC) + 8
+            (length,) = struct.unpack("<Q", mm[len(SNAPSHOT_MAGIC):start])
+            header = json.loads(mm[start:start + length])
+            data_start = start + length
+
+            columns = {}
+            for meta in header["columns"]:
+                if meta["kind"] == "int":
+                    column = IntColumn()
+                    column.specials = meta["specials"]
+                    column.lookup = {v: -1 - k for k, v in enumerate(column.specials)}
+                    column.codes = array("i")
+                else:
+                    column = CategoryColumn()
+                    column.values = meta["values"]
+                    column.lookup = {v: k for k, v in enumerate(column.values)}
+                    column.codes = array("I")
+                begin = data_start + meta["offset"]
+                column.codes.frombytes(mm[begin:begin + meta["nbytes"]])
+                if header["byteorder"] != sys.byteorder:
+                    column.codes.byteswap()
+                if len(column.codes) != header["rows"]:
+                    return None, None
+                columns[meta["name"]] = column
+    except (OSError, ValueError, KeyError, struct.error):
+        return None, None
+    return TagTable.from_columns([m["name"] for m in header["columns"]], columns, header["rows"]), header
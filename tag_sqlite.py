@@ -0,0 +1,356 @@
+"""Optional SQLite storage for the tag history, behind the same interface as the CSV.
+
+In SQLite mode the history lives in kx_race_analysis_git.tags.sqlite next to
+where the CSV was, one table row per tag, with indexes for the queries the
+reports and batch tools make:
+
+    tags_race        Year, Competition, Gender, Phase
+    tags_race_bib    Year, Competition, Phase, BIB
+    tags_athlete     Athlete Name
+    tags_gate_action Gate, Action
+
+`SqliteArchive` is a `TagArchive` whose data file is the database, so the tagger,
+replay.py and import_events.py use it through `open_archive` unchanged: tags are
+journalled as before and an export applies the journalled adds, undos and amends
+as single-row statements in one transaction, never rewriting the table. The
+columns are the CSV's (one TEXT column per header, holding what the CSV cell
+would), so converting back gives the same file.
+
+    python tag_sqlite.py import [CSV]       switch to SQLite, keeping the CSV as it is
+    python tag_sqlite.py export [CSV]       write everything back into the CSV
+    python tag_sqlite.py query [CSV] SQL    run a read-only query, printing CSV
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import uuid
+from datetime import datetime
+
+from roster import roster_path_for, write_roster
+from tag_archive import DEFAULT_DATA_PATH, TagArchive, csv_headers, journal_path_for, open_archive
+from tag_schema import SCHEMA_VERSION, migrate_rows, migrated_headers
+from tag_snapshot import snapshot_path_for
+from tag_table import LOAD_CHUNK_ROWS, TagTable
+
+SQLITE_SUFFIX = ".tags.sqlite"
+DB_SCHEMA_VERSION = 1  # Layout of the tables; the data's own version (tag_schema) is data_version in meta
+INDEXES = {
+    "tags_race": ("Year", "Competition", "Gender", "Phase"),
+    "tags_race_bib": ("Year", "Competition", "Phase", "BIB"),
+    "tags_athlete": ("Athlete Name",),
+    "tags_gate_action": ("Gate", "Action"),
+}
+
+
+def sqlite_path_for(csv_path):
+    return os.path.splitext(csv_path)[0] + SQLITE_SUFFIX
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def cell(value):
+    """A value as the CSV would hold it."""
+    return "" if value is None else str(value)
+
+
+def connect(db_path, readonly=False):
+    if readonly:
+        return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, isolation_level=None)
+    db = sqlite3.connect(db_path, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    return db
+
+
+def read_meta(db, key):
+    try:
+        row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    except sqlite3.OperationalError:  # No meta table: not written by us
+        return None
+    return json.loads(row[0]) if row else None
+
+
+def table_columns(db):
+    return [row[1] for row in db.execute("PRAGMA table_info(tags)")][1:]  # Without position
+
+
+class SqliteArchive(TagArchive):
+    """A TagArchive kept in an indexed SQLite database; the database stands in for the CSV."""
+
+    def __init__(self, csv_path):
+        super().__init__(sqlite_path_for(csv_path))
+
+    def fingerprint(self, path):
+        # The database changes in place, so each export stamps it with a new token instead
+        if not os.path.isfile(path):
+            return None
+        db = connect(path, readonly=True)
+        try:
+            return read_meta(db, "fingerprint")
+        finally:
+            db.close()
+
+    def schema_version(self):
+        # Stamped in the meta table rather than in a sidecar
+        if not os.path.isfile(self.csv_path):
+            return 0
+        db = connect(self.csv_path, readonly=True)
+        try:
+            return read_meta(db, "data_version") or 0
+        finally:
+            db.close()
+
+    def stamp_schema(self, version=SCHEMA_VERSION):
+        if not os.path.isfile(self.csv_path):
+            return  # save_all stamps the database it creates
+        db = connect(self.csv_path)
+        try:
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('data_version', ?)", (json.dumps(version),))
+        finally:
+            db.close()
+
+    def read_table(self):
+        db = connect(self.csv_path, readonly=True)
+        try:
+            headers = read_meta(db, "headers")
+            if not headers:
+                return None
+            table = TagTable(headers)
+            columns = [table.columns[h] for h in headers]
+            cursor = db.execute(f"SELECT {', '.join(map(quote, headers))} FROM tags ORDER BY position")
+            for chunk in iter(lambda: cursor.fetchmany(LOAD_CHUNK_ROWS), []):
+                for column, values in zip(columns, zip(*chunk)):
+                    column.codes.extend(column.encode("" if v is None else v) for v in values)
+                table._length += len(chunk)
+            return table
+        finally:
+            db.close()
+
+    def export(self, rows, upto=None):
+        """Applies the journalled changes up to `upto` to the database in one transaction.
+        Returns (description, changes applied)."""
+        if upto is None:
+            upto = self.journal.last_seq
+        records = [r for r in list(self.journal.unexported) if r["seq"] <= upto]
+        new_fp = ["sqlite", uuid.uuid4().hex]
+        self.journal.mark_exported(upto, new_fp)
+        db = connect(self.csv_path)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            headers = csv_headers(rows)
+            self._add_columns(db, headers)
+            count = db.execute("SELECT COUNT(*) FROM tags").fetchone()[0]
+            for record in records:
+                count = self._apply(db, record, count)
+            self._write_meta(db, headers, new_fp)
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        self.journal.rotate(upto, new_fp)
+        write_roster(self.csv_path, rows, new_fp)
+        return "updated the database with", len(records)
+
+    def _rebuild_csv(self, rows, upto):
+        """Replaces the whole table (save_all) in one transaction."""
+        new_fp = ["sqlite", uuid.uuid4().hex]
+        self.journal.mark_exported(upto, new_fp)
+        headers = csv_headers(rows)
+        db = connect(self.csv_path)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DROP TABLE IF EXISTS tags")
+            self._add_columns(db, headers)
+            columns = [map(cell, rows.column_values(h)) for h in headers]
+            insert = f"INSERT INTO tags VALUES (?, {', '.join('?' * len(headers))})"
+            db.executemany(insert, zip(range(len(rows)), *columns))
+            self._write_meta(db, headers, new_fp)
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        self.journal.rotate(upto, new_fp)
+        return new_fp
+
+    def _migrate(self, migrations):
+        """Streams the table through the migrations a chunk of rows at a time and updates the
+        rows they change, in one transaction. Returns {version: rows changed}."""
+        new_fp = ["sqlite", uuid.uuid4().hex]
+        upto = self.journal.exported_upto
+        db = connect(self.csv_path)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            headers = read_meta(db, "headers") or []
+            cursor = db.execute(f"SELECT position, {', '.join(map(quote, headers))} FROM tags ORDER BY position")
+            originals = {}  # position -> cells, for the rows read but not yet migrated
+
+            def read_rows():
+                for chunk in iter(lambda: cursor.fetchmany(LOAD_CHUNK_ROWS), []):
+                    for position, *cells in chunk:
+                        originals[position] = cells
+                        yield dict(zip(headers, cells), position=position)
+
+            counts, changed = {}, []
+            new_headers = migrated_headers(headers, migrations)
+            for row in migrate_rows(read_rows(), migrations, counts):
+                cells = [cell(row.get(h)) for h in new_headers]
+                if cells != originals.pop(row["position"]):
+                    changed.append(cells + [row["position"]])
+            if changed or new_headers != headers:
+                self.journal.mark_exported(upto, new_fp)
+                self._add_columns(db, new_headers)
+                db.executemany(f"UPDATE tags SET {', '.join(quote(h) + ' = ?' for h in new_headers)} WHERE position = ?", changed)
+                self._write_meta(db, new_headers, new_fp)
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        if changed or new_headers != headers:
+            self.journal.rotate(upto, new_fp)
+        return counts
+
+    # --- INTERNALS ---
+    def _apply(self, db, record, count):
+        """Applies one journal record the way apply_records would; returns the new row count."""
+        op = record["op"]
+        if op == "add":
+            row = record["row"]
+            self._add_columns(db, row)
+            names = ["position"] + list(row)
+            db.execute(f"INSERT INTO tags ({', '.join(map(quote, names))}) VALUES ({', '.join('?' * len(names))})",
+                       [count] + [cell(v) for v in row.values()])
+            return count + 1
+        if op == "undo" and record["index"] == count - 1:
+            db.execute("DELETE FROM tags WHERE position = ?", (record["index"],))
+            return count - 1
+        if op == "amend" and 0 <= record["index"] < count and record["fields"]:
+            fields = record["fields"]
+            self._add_columns(db, fields)
+            db.execute(f"UPDATE tags SET {', '.join(quote(h) + ' = ?' for h in fields)} WHERE position = ?",
+                       [cell(v) for v in fields.values()] + [record["index"]])
+        return count
+
+    def _add_columns(self, db, headers):
+        existing = set(table_columns(db))
+        if not existing:
+            db.execute("CREATE TABLE IF NOT EXISTS tags (position INTEGER PRIMARY KEY)")
+        for header in headers:
+            if header is not None and header not in existing:
+                db.execute(f"ALTER TABLE tags ADD COLUMN {quote(header)} TEXT NOT NULL DEFAULT ''")
+                existing.add(header)
+        self._create_indexes(db, existing)
+
+    def _create_indexes(self, db, headers):
+        for name, columns in INDEXES.items():
+            if all(c in headers for c in columns):
+                db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON tags ({', '.join(map(quote, columns))})")
+
+    def _write_meta(self, db, headers, fp):
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                       [("version", json.dumps(DB_SCHEMA_VERSION)), ("headers", json.dumps(headers)), ("fingerprint", json.dumps(fp))])
+
+
+def convert_to_sqlite(csv_path):
+    """Copies a CSV's history (journalled tags included) into a new database."""
+    archive = open_archive(csv_path)
+    if isinstance(archive, SqliteArchive):
+        raise ValueError(f"{sqlite_path_for(csv_path)} already exists; export it first")
+    if type(archive) is not TagArchive:
+        raise ValueError(f"{csv_path} is kept in {archive.csv_path}; write it back into the CSV first")
+    try:
+        rows = archive.load_all()
+        for warning in archive.journal_warnings():
+            print(warning, file=sys.stderr)
+        # Brings the CSV up to date too, so its journal holds nothing the database lacks
+        archive.save_all(rows)
+        version = archive.schema_version()  # Carried over as it is: converting does not upgrade
+    finally:
+        archive.close()
+    database = SqliteArchive(csv_path)
+    try:
+        database.load_all()
+        database.save_all(rows, version)
+    finally:
+        database.close()
+    return rows
+
+
+def convert_to_csv(csv_path):
+    """Writes the database's history back into the CSV and retires the database."""
+    database = SqliteArchive(csv_path)
+    try:
+        rows = database.load_all()
+        for warning in database.journal_warnings():
+            print(warning, file=sys.stderr)
+        version = database.schema_version()
+    finally:
+        database.close()
+    archive = TagArchive(csv_path)
+    try:
+        archive.open_journal()
+        archive.save_all(rows, version)
+    finally:
+        archive.close()
+    db_path = sqlite_path_for(csv_path)
+    # Folds the write-ahead log back in, so the retired database is one self-contained file
+    db = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        db.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        db.close()
+    retired =f"{db_path}.exported-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    os.replace(db_path, retired)
+    # Everything they held is in the CSV now
+    for path in (journal_path_for(db_path), snapshot_path_for(db_path), roster_path_for(db_path)):
+        if os.path.isfile(path):
+            os.remove(path)
+    return rows, retired
+
+
+def run_query(csv_path, sql, out=sys.stdout):
+    """Runs a read-only query against the database and writes the result as CSV. Tags still
+    only in the journal (the tagger exports them when it closes) are not included."""
+    db = connect(sqlite_path_for(csv_path), readonly=True)
+    try:
+        cursor = db.execute(sql)
+        writer = csv.writer(out)
+        writer.writerow([column[0] for column in cursor.description or []])
+        count = 0
+        for row in cursor:
+            writer.writerow(row)
+            count += 1
+        return count
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep the tag history in an indexed SQLite database instead of the CSV.")
+    parser.add_argument("command", choices=["import", "export", "query"])
+    parser.add_argument("csv", nargs="?", default=DEFAULT_DATA_PATH, help="tag CSV (default: %(default)s)")
+    parser.add_argument("sql", nargs="?", help='query to run, e.g. "SELECT Gate, COUNT(*) FROM tags GROUP BY Gate"')
+    args = parser.parse_args(argv)
+    if args.command == "query" and not args.sql:
+        parser.error("query needs an SQL statement")
+
+    try:
+        if args.command == "import":
+            rows = convert_to_sqlite(args.csv)
+            print(f"Copied {len(rows)} rows into {sqlite_path_for(args.csv)}; the tagger now saves there")
+        elif args.command == "export":
+            rows, retired = convert_to_csv(args.csv)
+            print(f"Wrote {len(rows)} rows back into {args.csv}; database kept as {retired}")
+        else:
+            count = run_query(args.csv, args.sql)
+            print(f"{count} rows", file=sys.stderr)
+    except (OSError, ValueError, sqlite3.Error, csv.Error) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
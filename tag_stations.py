@@ -0,0 +1,388 @@
+"""Several taggers on one race: a shared station database and a deterministic merge.
+
+With `python tagger.py --station gates1-4` each tagger instance (a "station",
+e.g. one operator per section of the course) keeps its own journal and CSV under
+data/stations/<name>/, so nothing the stations do can collide on disk. Every
+row a station saves, undoes or amends is also written to data/stations.db, a
+SQLite database in WAL mode that all stations share: a small transaction per
+batch of tags, run on the tagger's writer thread, so a station never waits for
+the others and nothing is rewritten as a whole.
+
+The database holds the current rows of every station, keyed by (station, row
+number in that station's own table), with the time each was pressed. Whenever a
+station saves a row, the rows other stations saved for the same bib at the same
+gate of the same race are checked, and a disagreement is reported as a conflict
+at once.
+
+`merge_stations` combines the stations into one table, the same way every time:
+
+- rows are ordered by the time their key was pressed (then station, then row);
+- a bib's passage through a gate tagged by more than one station is kept once,
+  from the earliest press; copies that disagree are reported as conflicts;
+- a fault recorded on a new FLT row because the faulting station had no row for
+  that gate is folded into the row another station tagged there;
+- Order is renumbered per gate, and Final Position per Finish, in press order;
+- gate rows without a Ramp Position take the bib's position from the Ramp row.
+
+    python tag_stations.py status [--db DB]
+    python tag_stations.py merge [CSV] [--db DB] [--out OUT] [--into-archive [--upgrade]]
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+from race_index import RaceIndex, race_key
+from tag_archive import DEFAULT_DATA_PATH, open_archive, render_csv
+from tag_schema import RACE_FIELDS, race_of
+from tag_store import STANDARD_HEADERS
+from tag_table import TagTable
+
+STATIONS_DB_NAME = "stations.db"
+STATIONS_DIR_NAME = "stations"
+MERGED_NAME = "stations_merged.csv"
+STATION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+# Fields reconciled by the merge, so two stations may disagree on them without a conflict
+RECONCILED_FIELDS = ("Order", "Final Position", "Ramp Position", "Faults")
+# How long a station waits for another one's transaction to finish before giving up
+BUSY_TIMEOUT_SECONDS = 5.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tags (
+    station TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    race TEXT NOT NULL,
+    gate TEXT NOT NULL,
+    bib TEXT NOT NULL,
+    action TEXT NOT NULL,
+    pressed REAL NOT NULL,
+    fields TEXT NOT NULL,
+    PRIMARY KEY (station, row)
+);
+CREATE INDEX IF NOT EXISTS tags_passage ON tags (race, gate, bib);
+"""
+
+
+def stations_db_for(csv_path):
+    return os.path.join(os.path.dirname(csv_path), STATIONS_DB_NAME)
+
+
+def station_csv_path(csv_path, station):
+    """Where a station keeps its own tags (and journal, snapshot and roster)."""
+    return os.path.join(os.path.dirname(csv_path), STATIONS_DIR_NAME, station, os.path.basename(csv_path))
+
+
+def check_station_name(station):
+    if not STATION_NAME_PATTERN.match(station or ""):
+        raise ValueError(f"Invalid station name {station!r}: use letters, digits, '-' and '_'")
+    return station
+
+
+def race_id(row):
+    """The race of a row (tag_schema.race_of) as the database's race column holds it."""
+    return "|".join(race_of(row))
+
+
+def connect(db_path):
+    """Opens the shared station database, creating it if needed."""
+    db = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+def disagreement(fields, other):
+    """Names of the fields two copies of a passage hold different values in. A field only
+    one of them filled in, or one the merge reconciles, is not a disagreement."""
+    names = (set(fields) & set(other)) - set(RECONCILED_FIELDS)
+    return sorted(name for name in names if fields[name] and other[name] and str(fields[name]) != str(other[name]))
+
+
+def add_faults(row, fields):
+    """Adds the faults recorded on `fields` to `row`, with the Final Position they gave."""
+    if fields.get("Faults"):
+        row["Faults"] = ", ".join(filter(None, (row.get("Faults", ""), fields["Faults"])))
+        row["Final Position"] = fields.get("Final Position", "")
+
+
+class StationLog:
+    """One station's side of the shared database: row changes queued by the UI thread
+    and written in one transaction by flush() on the writer thread."""
+
+    def __init__(self, db_path, station):
+        self.station = check_station_name(station)
+        self.path = db_path
+        self.db = connect(db_path)
+        self._pending = []              # (op, row number, fields, pressed) not yet written
+        self._resync = None             # (rows, now) to replace this station's rows with first
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def record(self, op, index, row, pressed):
+        """Queues one store change; cheap enough for every tag."""
+        fields = None if op == "undo" else {h: "" if v is None else str(v) for h, v in row.items()}
+        with self._lock:
+            self._pending.append((op, index, fields, pressed))
+
+    def resync(self, rows, now):
+        """Queues replacing this station's rows in the database with `rows`, e.g. after a
+        restart replayed tags from the journal that never reached it. Press times already in
+        the database are kept; rows new to it are stamped `now`."""
+        rows = [{h: "" if v is None else str(v) for h, v in row.items()} for row in rows]
+        with self._lock:
+            self._resync = (rows, now)
+            self._pending.clear()
+
+    def flush(self):
+        """Writes the queued changes in one transaction. Returns the conflicts the new rows
+        have with other stations' rows. On failure the changes stay queued for the next flush."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                resync, self._resync = self._resync, None
+            if not batch and not resync:
+                return []
+            try:
+                self.db.execute("BEGIN IMMEDIATE")
+                if resync:
+                    self._replace_rows(*resync)
+                for op, index, fields, pressed in batch:
+                    self._apply(op, index, fields, pressed)
+                self.db.execute("COMMIT")
+            except sqlite3.Error:
+                if self.db.in_transaction:
+                    self.db.execute("ROLLBACK")
+                with self._lock:
+                    # Unless a newer resync has replaced them meanwhile
+                    if self._resync is None:
+                        self._resync = resync
+                        self._pending[:0] = batch
+                raise
+            saved = {}
+            for op, index, fields, _ in batch:
+                if op == "undo":
+                    saved.pop(index, None)
+                else:
+                    saved[index] = fields
+            return [conflict for fields in saved.values() for conflict in self.conflicts_with(fields)]
+
+    def conflicts_with(self, fields):
+        """(other station, fields that differ) for each other station's copy of this passage."""
+        if fields.get("Action") == "FLT":
+            return []
+        cursor = self.db.execute(
+            "SELECT station, fields FROM tags WHERE race = ? AND gate = ? AND bib = ? AND action <> 'FLT' AND station <> ?",
+            (race_id(fields), fields.get("Gate", ""), fields.get("BIB", ""), self.station))
+        conflicts = []
+        for station, other in cursor:
+            differing = disagreement(fields, json.loads(other))
+            if differing:
+                conflicts.append((fields, station, differing))
+        return conflicts
+
+    def close(self):
+        self.db.close()
+
+    def _replace_rows(self, rows, now):
+        pressed = dict(self.db.execute("SELECT row, pressed FROM tags WHERE station = ?", (self.station,)))
+        self.db.execute("DELETE FROM tags WHERE station = ?", (self.station,))
+        for index, fields in enumerate(rows):
+            self._apply("add", index, fields, pressed.get(index, now))
+
+    def _apply(self, op, index, fields, pressed):
+        if op == "undo":
+            self.db.execute("DELETE FROM tags WHERE station = ? AND row = ?", (self.station, index))
+        elif op == "add":
+            self.db.execute("INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (self.station, index, race_id(fields), fields.get("Gate", ""), fields.get("BIB", ""),
+                             fields.get("Action", ""), pressed, json.dumps(fields)))
+        elif op == "amend":
+            self.db.execute("UPDATE tags SET race = ?, gate = ?, bib = ?, action = ?, fields = ? WHERE station = ? AND row = ?",
+                            (race_id(fields), fields.get("Gate", ""), fields.get("BIB", ""), fields.get("Action", ""),
+                             json.dumps(fields), self.station, index))
+
+
+def format_conflict(fields, station, differing):
+    return (f"{fields.get('Phase', '')} {fields.get('Gate', '')} {fields.get('BIB', '')} was also tagged by "
+            f"station {station}, with a different {', '.join(differing)}")
+
+
+# --- MERGE ---
+def read_stations(db_path):
+    """Every station's rows as (station, row, pressed, fields), in merge order."""
+    db = connect(db_path)
+    try:
+        cursor = db.execute("SELECT station, row, pressed, fields FROM tags ORDER BY pressed, station, row")
+        return [(station, row, pressed, json.loads(fields)) for station, row, pressed, fields in cursor]
+    finally:
+        db.close()
+
+
+def station_counts(db_path):
+    db = connect(db_path)
+    try:
+        return db.execute("SELECT station, COUNT(*), COUNT(DISTINCT race), MAX(pressed) FROM tags GROUP BY station ORDER BY station").fetchall()
+    finally:
+        db.close()
+
+
+def merge_order(entry):
+    station, row, pressed, _ = entry
+    return (pressed, station, row)
+
+
+def merge_stations(db_path):
+    """Returns (merged TagTable, conflicts); conflicts are (kept entry, dropped entry, fields that differ)."""
+    races = {}
+    for entry in read_stations(db_path):
+        races.setdefault(race_of(entry[3]), []).append(entry)
+    merged, conflicts = [], []
+    for entries in races.values():
+        merged.extend(_merge_race(entries, conflicts))
+    merged.sort(key=merge_order)
+    table = TagTable(STANDARD_HEADERS)
+    for entry in merged:
+        table.append(entry[3])
+    return table, conflicts
+
+
+def _merge_race(entries, conflicts):
+    kept, faults, first = [], [], {}
+    for entry in entries:
+        station, _, _, fields = entry
+        if fields.get("Action") == "FLT":
+            faults.append(entry)
+            continue
+        passage = (fields.get("Gate", ""), fields.get("BIB", ""))
+        earliest = first.setdefault(passage, entry)
+        if earliest is entry or earliest[0] == station:
+            # A station's own repeats (a ramp position set again) are kept as it saved them
+            kept.append(entry)
+            continue
+        differing = disagreement(earliest[3], fields)
+        if differing:
+            conflicts.append((earliest, entry, differing))
+        # The copy kept gets what only the dropped one recorded
+        for name, value in fields.items():
+            if value and not earliest[3].get(name) and name not in RECONCILED_FIELDS:
+                earliest[3][name] = value
+        add_faults(earliest[3], fields)
+
+    # Faults a station could not put on a row of its own go on the row another station tagged
+    index = RaceIndex()
+    index.rebuild([entry[3] for entry in kept])
+    for entry in faults:
+        fields = entry[3]
+        # A new FLT row holds one fault: "FLT 3", "FLT R" (roll) or "FLT Course"
+        fault = fields.get("Faults", "").strip()
+        item = {"FLT R": "Roll", "FLT Course": "Course"}.get(fault, fault[len("FLT "):])
+        target = index.fault_row(race_key(fields), fields.get("BIB", ""), item) if fault.startswith("FLT ") else None
+        if target is None:
+            kept.append(entry)
+            continue
+        add_faults(kept[target][3], fields)
+    kept.sort(key=merge_order)
+
+    # Order per gate and finish places follow the press times across all stations
+    ramp = {e[3].get("BIB", ""): e[3].get("Ramp Position", "") for e in kept if e[3].get("Gate") == "Ramp"}
+    counts = {}
+    for _, _, _, fields in kept:
+        gate, bib = fields.get("Gate", ""), fields.get("BIB", "")
+        if gate != "Ramp" and fields.get("Ramp Position", "") in ("", "N/A") and ramp.get(bib):
+            fields["Ramp Position"] = ramp[bib]
+        if str(fields.get("Order", "")) in ("", "0") or fields.get("Action") in ("DNS", "FLT"):
+            continue
+        counts[gate] = counts.get(gate, 0) + 1
+        fields["Order"] = str(counts[gate])
+        if gate == "Finish":
+            fields["Final Position"] = str(counts[gate])
+    return kept
+
+
+def replace_races(master, table):
+    """Master rows of races not in `table`, in their order, followed by `table`; so
+    merging the same stations twice replaces the rows of the first merge."""
+    merged_races = set(zip(*(table.column_values(field) for field in RACE_FIELDS)))
+    master_races = zip(*(master.column_values(field) for field in RACE_FIELDS))
+    keep = [i for i, race in enumerate(master_races) if race not in merged_races]
+    result = master.take(keep)
+    result.extend(table)
+    return result, len(master) - len(keep)
+
+
+def write_merged(path, table):
+    with open(path + ".tmp", "wb") as f:
+        f.write(render_csv(table))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def describe(entry):
+    return f"station {entry[0]} row {entry[1] + 1}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge the tags of several tagging stations.")
+    parser.add_argument("command", choices=["status", "merge"])
+    parser.add_argument("csv", nargs="?", default=DEFAULT_DATA_PATH, help="master tag CSV (default: %(default)s)")
+    parser.add_argument("--db", help="station database (default: stations.db next to the CSV)")
+    parser.add_argument("--out", help=f"merged CSV to write (default: {MERGED_NAME} next to the database)")
+    parser.add_argument("--into-archive", action="store_true",
+                        help="replace the merged races in the master tag file instead (close the taggers first)")
+    parser.add_argument("--upgrade", action="store_true", help="with --into-archive, upgrade master data from an older version first")
+    args = parser.parse_args(argv)
+    if args.upgrade and not args.into_archive:
+        parser.error("--upgrade only applies to --into-archive")
+
+    db_path = args.db or stations_db_for(args.csv)
+    try:
+        if not os.path.isfile(db_path):
+            raise FileNotFoundError(f"No station database at {db_path}")
+        if args.command == "status":
+            for station, rows, races, last in station_counts(db_path):
+                last_tag = datetime.fromtimestamp(last).strftime("%Y-%m-%d %H:%M:%S")
+                print(f"{station:<20} {rows:>7} rows in {races} races, last tag {last_tag}")
+            return 0
+
+        table, conflicts = merge_stations(db_path)
+        for kept, dropped, differing in conflicts:
+            fields = dropped[3]
+            race = " ".join(part for part in race_of(fields) if part)
+            print(f"CONFLICT: {race} {fields.get('Gate', '')} {fields.get('BIB', '')}: kept {describe(kept)}, "
+                  f"dropped {describe(dropped)} (differs in {', '.join(differing)})", file=sys.stderr)
+        if args.into_archive:
+            archive = open_archive(args.csv)
+            try:
+                master = archive.load_all(upgrade=args.upgrade)
+                for message in archive.migration_messages():
+                    print(message)
+                for warning in archive.journal_warnings() + archive.schema_warnings():
+                    print(warning, file=sys.stderr)
+                merged, replaced = replace_races(master, table)
+                archive.save_all(merged)
+            finally:
+                archive.close()
+            print(f"Merged {len(table)} station rows into {args.csv} (replacing {replaced}); {len(conflicts)} conflicts")
+        else:
+            out = args.out or os.path.join(os.path.dirname(db_path), MERGED_NAME)
+            write_merged(out, table)
+            print(f"Merged {len(table)} station rows into {out}; {len(conflicts)} conflicts")
+    except (OSError, ValueError, sqlite3.Error, csv.Error) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
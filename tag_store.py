@@ -0,0 +1,214 @@
+"""Tag rows, their race index and the journal, behind one small interface.
+
+Everything that changes tag data goes through `append`, `undo` and `amend`, so
+the index and the journal always agree with the rows. The lookups answer the
+questions the tagging rules ask about the current race.
+
+Changes made between `begin_command` and `end_command` form one command on the
+undo stack. A command keeps only its own steps (the rows it added and the old
+and new values of the fields it amended), so undoing or redoing one costs the
+same however many rows there are, and it is journalled like any other change.
+"""
+import functools
+import time
+from collections import deque
+
+from race_index import RaceIndex, race_key
+from tag_timings import INDEX_LOOKUP
+from tag_table import TagTable
+
+STANDARD_HEADERS = [
+    "Year", "Competition", "Gender", "Phase", "Gate", "BIB", "Ramp Position",
+    "Action", "Order", "Final Position", "Upstream Tactic", "Athlete Name", "Faults"
+]
+UNDO_LIMIT = 500  # Commands kept for undo; older ones are forgotten
+
+
+class Command:
+    """One undoable command: its row changes in order, and the caller's state before and after.
+    Steps are ("add", index, row) or ("amend", index, old fields, new fields)."""
+    __slots__ = ("steps", "before", "after")
+
+    def __init__(self, steps, before, after):
+        self.steps = steps
+        self.before = before
+        self.after = after
+
+
+def timed_lookup(method):
+    """Adds the time a lookup takes to the store's timings, if it has any (the history
+    load a first lookup may wait for is not counted)."""
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        if self.timings is None:
+            return method(self, *args)
+        self._access()
+        start = time.perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            self.timings.add(INDEX_LOOKUP, time.perf_counter() - start)
+    return wrapper
+
+
+class TagStore:
+    """Tag rows plus the race index, with every change journalled (if a journal is given)."""
+
+    def __init__(self, rows=None, journal=None):
+        self.rows = rows if rows is not None else TagTable(STANDARD_HEADERS)
+        self.index = RaceIndex()
+        self.index.rebuild(self.rows)
+        self.journal = journal
+        self.on_change = None      # Called after every change, e.g. to schedule a save
+        self.on_row_change = None  # Called with (op, index, row) for each add, undo or amend, e.g. to update caches
+        self.before_access = None  # Called before rows are used, e.g. to finish a lazy load
+        self.timings = None        # TagTimings to time the lookups with, if any
+        self.undo_stack = deque(maxlen=UNDO_LIMIT)
+        self.redo_stack = []
+        self._steps = None         # Steps of the command being recorded
+
+    def load(self, rows):
+        """Replaces all rows (no journalling) and rebuilds the index."""
+        self.rows = rows
+        self.index.rebuild(rows)
+        self.forget_commands()
+
+    @property
+    def extra_headers(self):
+        return [h for h in self.rows.headers if h not in STANDARD_HEADERS]
+
+    def __len__(self):
+        self._access()
+        return len(self.rows)
+
+    # --- CHANGES ---
+    def append(self, entry):
+        """Adds a new row, indexes it and journals it."""
+        self._access()
+        self.rows.append(entry)
+        self.index.add(len(self.rows) - 1, entry)
+        if self.journal:
+            self.journal.append_row(entry)
+        self._record(("add", len(self.rows) - 1, dict(entry)))
+        self._changed("add", len(self.rows) - 1, entry)
+
+    def undo(self):
+        """Removes the most recent row, journals the undo and returns the removed row."""
+        self._access()
+        row = self.rows.pop()
+        self.index.remove(len(self.rows), row)
+        if self.journal:
+            self.journal.undo(len(self.rows))
+        self._record(("undo", len(self.rows), row))
+        self._changed("undo", len(self.rows), row)
+        return row
+
+    def amend(self, index, fields):
+        """Updates fields of an existing row in place and journals the change."""
+        self._access()
+        old = {header: self.rows[index].get(header, "") for header in fields}
+        self._record(("amend", index, old, dict(fields)))
+        self.index.update(index, self.rows[index], fields)
+        self.rows[index].update(fields)
+        if self.journal:
+            self.journal.amend(index, fields)
+        self._changed("amend", index, self.rows[index])
+
+    # --- COMMANDS ---
+    def begin_command(self):
+        """Starts recording the changes that make up one undoable command."""
+        self._steps = []
+
+    @property
+    def recording(self):
+        return self._steps is not None
+
+    def end_command(self, before=None, after=None):
+        """Ends the command, putting it on the undo stack if it changed any rows. `before`
+        and `after` are whatever the caller needs to put back on undo and redo."""
+        steps, self._steps = self._steps, None
+        if steps:
+            self.undo_stack.append(Command(steps, before, after))
+            self.redo_stack.clear()
+
+    def undo_command(self):
+        """Reverts the latest command and returns it (for its `before`), or None if there is none."""
+        if not self.undo_stack:
+            return None
+        command = self.undo_stack.pop()
+        self._replay(command, reverse=True)
+        self.redo_stack.append(command)
+        return command
+
+    def redo_command(self):
+        """Applies the latest undone command again and returns it (for its `after`), or None."""
+        if not self.redo_stack:
+            return None
+        command = self.redo_stack.pop()
+        self._replay(command, reverse=False)
+        self.undo_stack.append(command)
+        return command
+
+    def forget_commands(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    # --- LOOKUPS ---
+    @timed_lookup
+    def athlete_name(self, race, bib):
+        """Athlete name recorded for a bib in a race (normally from its Ramp tag), or ""."""
+        self._access()
+        row_index = self.index.athlete_row(race, bib)
+        if row_index is None:
+            return ""
+        return self.rows[row_index].get("Athlete Name")
+
+    @timed_lookup
+    def copy_extra_data(self, new_entry):
+        """Copies non-empty extra columns (video links etc.) from the bib's latest row in the race."""
+        self._access()
+        row_index = self.index.last_row(race_key(new_entry), new_entry.get("BIB"))
+        if row_index is None:
+            return
+        for header in self.extra_headers:
+            value = self.rows.get_value(row_index, header)
+            if value:
+                new_entry[header] = value
+
+    @timed_lookup
+    def fault_row(self, race, bib, fault_item):
+        self._access()
+        return self.index.fault_row(race, bib, fault_item)
+
+    # --- INTERNALS ---
+    def _access(self):
+        if self.before_access:
+            self.before_access()
+
+    def _record(self, step):
+        if self._steps is not None:
+            self._steps.append(step)
+        else:
+            # The rows changed outside a command, so the stored steps may no longer line up
+            self.forget_commands()
+
+    def _replay(self, command, reverse):
+        """Undoes (reverse=True) or redoes a command's steps through the normal change methods."""
+        self._steps = []  # Not recorded as a new command
+        try:
+            for step in (reversed(command.steps) if reverse else command.steps):
+                op, index = step[0], step[1]
+                if op == "amend":
+                    self.amend(index, step[2] if reverse else step[3])
+                elif (op == "add") == reverse:
+                    self.undo()
+                else:
+                    self.append(dict(step[2]))
+        finally:
+            self._steps = None
+
+    def _changed(self, op, index, row):
+        if self.on_row_change:
+            self.on_row_change(op, index, row)
+        if self.on_change:
+            self.on_change()
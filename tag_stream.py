@@ -0,0 +1,265 @@
+"""Streaming access to tag data, for offline processing of archives of any size.
+
+Loading a tag CSV for a one-off job builds the whole history in memory. A
+`RowStream` instead reads rows lazily, one dict at a time, and passes them
+through stages that are themselves lazy, so filtering, re-keying, splitting or
+merging a multi-million-row archive takes the same memory as a small one:
+
+    read_csv("data/kx_race_analysis_git.csv").where(Gender="W", Year="2026").write("women_2026.csv")
+    merge(read_archive(master), read_csv("wc3.csv")).rename({"NOTES & COMMENTS": "Notes"}).write(out)
+
+Every row of a stream has every column in `stream.headers` ("" where its file
+had nothing), and the writers order the columns as the tagger does: standard
+headers first, then extra columns alphabetically. A stream can be iterated
+once. Only `per_race` and `races` hold more than a row: one race (a run of rows
+with the same Year, Competition, Location, Gender and Phase) at a time.
+
+`read_archive` reads a tag file the way the tagger keeps it (CSV, partitions or
+SQLite), without the journal: tags the tagger has not exported yet are not
+included, so close it first.
+
+    python tag_stream.py filter IN OUT [--where Gender=W Year=2025,2026] [--rename "NOTES & COMMENTS=Notes"]
+    python tag_stream.py split IN OUT_DIR [--by Year Competition Gender]
+    python tag_stream.py merge OUT IN [IN ...]
+"""
+import argparse
+import csv
+import itertools
+import os
+import sys
+
+from tag_archive import csv_headers, open_archive
+from tag_partitions import PartitionedArchive, partition_slug, read_manifest
+from tag_schema import race_of
+from tag_sqlite import SqliteArchive, connect, quote, read_meta
+from tag_table import LOAD_CHUNK_ROWS
+
+
+class RowStream:
+    """A single-use iterable of row dicts that all have the columns in `headers`."""
+
+    def __init__(self, headers, rows):
+        self.headers = list(headers)
+        self._rows = rows
+
+    def __iter__(self):
+        headers = self.headers
+        for row in self._rows:
+            yield {h: "" if row.get(h) is None else row[h] for h in headers}
+
+    # --- STAGES ---
+    def filter(self, predicate):
+        """Rows for which predicate(row) is true."""
+        return RowStream(self.headers, filter(predicate, self))
+
+    def where(self, criteria=None, **values):
+        """Rows whose columns hold the given values. A value may be a single value or a
+        collection of allowed ones; headers with spaces go in `criteria`, e.g.
+        where({"Athlete Name": "FOX Jessica"}, Year=["2025", "2026"])."""
+        wanted = {}
+        for header, value in {**(criteria or {}), **values}.items():
+            allowed = [value] if isinstance(value, (str, int)) else value
+            wanted[header] = {str(v) for v in allowed}
+        return self.filter(lambda row: all(row.get(h, "") in allowed for h, allowed in wanted.items()))
+
+    def map(self, function, headers=None):
+        """Rows as function(row) returns them (None drops the row). Give `headers` if the
+        function adds or removes columns."""
+        rows = (function(row) for row in self)
+        return RowStream(self.headers if headers is None else headers, (row for row in rows if row is not None))
+
+    def rename(self, mapping):
+        """Renames columns ({old: new}); renaming onto an existing column replaces it."""
+        headers = list(dict.fromkeys(mapping.get(h, h) for h in self.headers))
+        return self.map(lambda row: {mapping.get(h, h): v for h, v in row.items()}, headers)
+
+    def per_race(self, function):
+        """Rows as function(race_rows) returns them, called with the rows of one race at a time."""
+        def rows():
+            for _, race_rows in self.races():
+                yield from function(race_rows) or ()
+        return RowStream(self.headers, rows())
+
+    def races(self):
+        """Yields (race key, rows of the race) for each run of rows from one race."""
+        for key, race_rows in itertools.groupby(self, key=race_of):
+            yield key, list(race_rows)
+
+    # --- WRITING ---
+    def write(self, path):
+        """Writes the rows to a CSV atomically, as the tagger writes it. Returns the row count."""
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                count = write_rows(f, csv_headers(self), self)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        return count
+
+    def split(self, directory, fields, name_for=None):
+        """Writes the rows to one CSV per distinct value of `fields`, all at once (one file open
+        per value). Returns {key: (path, rows)}."""
+        name_for = name_for or (lambda key: "_".join(partition_slug(value) for value in key) + ".csv")
+        headers = csv_headers(self)
+        outputs, written = {}, {}
+        os.makedirs(directory, exist_ok=True)
+        try:
+            for row in self:
+                key = tuple(row.get(field, "") for field in fields)
+                output = outputs.get(key)
+                if output is None:
+                    path = os.path.join(directory, name_for(key))
+                    f = open(path + ".tmp", "w", newline="", encoding="utf-8")
+                    writer = csv.DictWriter(f, fieldnames=headers, restval="")
+                    writer.writeheader()
+                    output = outputs[key] = (f, writer)
+                    written[key] = [path, 0]
+                output[1].writerow(row)
+                written[key][1] += 1
+            for key, (f, _) in outputs.items():
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            for f, _ in outputs.values():
+                f.close()
+        for path, _ in written.values():
+            os.replace(path + ".tmp", path)
+        return {key: tuple(entry) for key, entry in written.items()}
+
+
+def write_rows(f, headers, rows):
+    """Writes a header line and the rows to an open text file. Returns the row count."""
+    writer = csv.DictWriter(f, fieldnames=headers, restval="", extrasaction="ignore")
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+# --- READING ---
+def read_csv(path):
+    """A stream of the rows of a tag CSV, read as they are used."""
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        headers = next(csv.reader(f), [])
+
+    def rows():
+        with open(path, "r", newline="", encoding="utf-8-sig") as f:
+            # Cells beyond the header (restkey None) are dropped, as TagTable.from_csv drops them
+            yield from csv.DictReader(f)
+    return RowStream(headers, rows())
+
+
+def read_archive(csv_path):
+    """A stream of the exported history of a tag file, wherever the tagger keeps it."""
+    archive = open_archive(csv_path)
+    if isinstance(archive, SqliteArchive):
+        return _read_sqlite(archive.csv_path)
+    if isinstance(archive, PartitionedArchive):
+        return _read_partitions(archive.directory)
+    return read_csv(csv_path)
+
+
+def _read_sqlite(db_path):
+    db = connect(db_path, readonly=True)
+    try:
+        headers = read_meta(db, "headers") or []
+    finally:
+        db.close()
+
+    def rows():
+        db = connect(db_path, readonly=True)
+        try:
+            cursor = db.execute(f"SELECT {', '.join(map(quote, headers))} FROM tags ORDER BY position")
+            for chunk in iter(lambda: cursor.fetchmany(LOAD_CHUNK_ROWS), []):
+                for values in chunk:
+                    yield dict(zip(headers, values))
+        finally:
+            db.close()
+    return RowStream(headers, rows())
+
+
+def _read_partitions(directory):
+    """Rows of the partitions in the order they were tagged, reading every partition file
+    in step (the manifest's runs say how many rows to take from which file next)."""
+    manifest = read_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No partition manifest in {directory}")
+
+    def rows():
+        files = [open(os.path.join(directory, entry["path"]), "r", newline="", encoding="utf-8")
+                 for entry in manifest["partitions"]]
+        try:
+            readers = [csv.DictReader(f) for f in files]
+            for number, count in manifest["runs"]:
+                yield from itertools.islice(readers[number], count)
+        finally:
+            for f in files:
+                f.close()
+    return RowStream(manifest["headers"], rows())
+
+
+def merge(*streams):
+    """One stream of the rows of each stream in turn, with the columns of all of them."""
+    headers = list(dict.fromkeys(h for stream in streams for h in stream.headers))
+    return RowStream(headers, itertools.chain.from_iterable(streams))
+
+
+def parse_criteria(items):
+    """{"Gender": ["W"], "Year": ["2025", "2026"]} from ["Gender=W", "Year=2025,2026"]."""
+    criteria = {}
+    for item in items:
+        header, sep, values = item.partition("=")
+        if not sep or not header:
+            raise ValueError(f"bad condition {item!r}, expected COLUMN=VALUE[,VALUE...]")
+        criteria[header] = values.split(",")
+    return criteria
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Filter, split or merge tag CSVs a row at a time.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    filter_parser = commands.add_parser("filter", help="write the rows that match to a new CSV")
+    filter_parser.add_argument("source", help="tag CSV (partitioned or SQLite data is read where it is kept)")
+    filter_parser.add_argument("out", help="CSV to write")
+    filter_parser.add_argument("--where", nargs="+", default=[], metavar="COLUMN=VALUES", help="e.g. Gender=W Year=2025,2026")
+    filter_parser.add_argument("--rename", nargs="+", default=[], metavar="OLD=NEW", help="columns to rename")
+    split_parser = commands.add_parser("split", help="write one CSV per distinct value of some columns")
+    split_parser.add_argument("source", help="tag CSV (partitioned or SQLite data is read where it is kept)")
+    split_parser.add_argument("out_dir", help="directory to write the CSVs to")
+    split_parser.add_argument("--by", nargs="+", default=["Year", "Competition", "Gender"], help="columns (default: %(default)s)")
+    split_parser.add_argument("--where", nargs="+", default=[], metavar="COLUMN=VALUES", help="only rows that match")
+    merge_parser = commands.add_parser("merge", help="write several CSVs one after another into one")
+    merge_parser.add_argument("out", help="CSV to write")
+    merge_parser.add_argument("sources", nargs="+", help="tag CSVs to merge, in order")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "merge":
+            count = merge(*map(read_archive, args.sources)).write(args.out)
+            print(f"Merged {len(args.sources)} files, {count} rows, into {args.out}")
+            return 0
+        stream = read_archive(args.source).where(parse_criteria(args.where))
+        if args.command == "filter":
+            renames = {old: ",".join(new) for old, new in parse_criteria(args.rename).items()}
+            count = stream.rename(renames).write(args.out)
+            print(f"Wrote {count} rows to {args.out}")
+        else:
+            written = stream.split(args.out_dir, args.by)
+            for key, (path, count) in sorted(written.items()):
+                print(f"{' '.join(key):<40} {count:>7} rows  {path}")
+            print(f"Split {sum(count for _, count in written.values())} rows into {len(written)} files in {args.out_dir}")
+    except (OSError, ValueError, csv.Error) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+"""Compact columnar storage for tag history.
+
+Instead of one dict per CSV row, every column is stored once: text columns are
+dictionary-encoded (an array of small integer codes plus the list of distinct
+values) and the Order/Ramp Position/Final Position columns are plain integer
+arrays. `TagRow` is a light view onto one row that behaves like the old dicts,
+so code written against `tagged_data[i].get("Gate")` keeps working.
+"""
+import csv
+from array import array
+from collections.abc import MutableMapping
+from itertools import islice
+
+INT_COLUMNS = ("Order", "Ramp Position", "Final Position")
+LOAD_CHUNK_ROWS = 4096
+
+
+class CategoryColumn:
+    """Dictionary-encoded text column."""
+    __slots__ = ("codes", "values", "lookup")
+
+    def __init__(self, length=0):
+        self.codes = array("I", bytes(4 * length))
+        self.values = [""]
+        self.lookup = {"": 0}
+
+    def encode(self, value):
+        code = self.lookup.get(value)
+        if code is not None:
+            return code
+        if value is None:
+            value = ""
+        elif not isinstance(value, str):
+            value = str(value)
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def decode(self, code):
+        return self.values[code]
+
+    def get(self, i):
+        return self.values[self.codes[i]]
+
+    def copy(self):
+        column = CategoryColumn()
+        column.codes = array("I", self.codes)
+        column.values = list(self.values)
+        column.lookup = dict(self.lookup)
+        return column
+
+
+class IntColumn:
+    """Integer column. Non-negative whole numbers are stored as-is; anything else
+    ("", "N/A", "DNS") is stored as a negative code into a small list of specials."""
+    __slots__ = ("codes", "specials", "lookup")
+
+    def __init__(self, length=0):
+        self.codes = array("i", [-1]) * length
+        self.specials = [""]
+        self.lookup = {"": -1}
+
+    def encode(self, value):
+        if isinstance(value, int) and 0 <= value < 2 ** 31:
+            return value
+        if value is None:
+            value = ""
+        elif not isinstance(value, str):
+            value = str(value)
+        if value.isdigit() and len(value) < 10 and (value == "0" or value[0] != "0"):
+            return int(value)
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = -1 - len(self.specials)
+            self.specials.append(value)
+        return code
+
+    def decode(self, code):
+        return str(code) if code >= 0 else self.specials[-1 - code]
+
+    def get(self, i):
+        return self.decode(self.codes[i])
+
+    def copy(self):
+        column = IntColumn()
+        column.codes = array("i", self.codes)
+        column.specials = list(self.specials)
+        column.lookup = dict(self.lookup)
+        return column
+
+
+class TagTable:
+    """List-like collection of tag rows stored column by column."""
+
+    def __init__(self, headers=()):
+        self.headers = []
+        self.columns = {}
+        self._length = 0
+        for header in headers:
+            self._add_column(header)
+
+    @classmethod
+    def from_csv(cls, f):
+        """Builds a table straight from an open CSV file, without making a dict per row."""
+        reader = csv.reader(f)
+        headers = next(reader, [])
+        table = cls(headers)
+        columns = [table.columns[h] for h in headers]
+        width = len(columns)
+        # Work in chunks so a column can be encoded in one pass without holding the whole file
+        for chunk in iter(lambda: list(islice(reader, LOAD_CHUNK_ROWS)), []):
+            chunk = [v if len(v) == width else (v + [""] * width)[:width] for v in chunk if v]
+            for column, values in zip(columns, zip(*chunk)):
+                column.codes.extend(map(column.encode, values))
+            table._length += len(chunk)
+        return table
+
+    @classmethod
+    def from_columns(cls, headers, columns, length):
+        """Wraps already-built columns (e.g. from a snapshot) without copying them."""
+        table = cls()
+        table.headers = list(headers)
+        table.columns = {h: columns[h] for h in headers}
+        table._length = length
+        return table
+
+    # --- LIST INTERFACE ---
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError("tag row index out of range")
+        return TagRow(self, i)
+
+    def __iter__(self):
+        for i in range(self._length):
+            yield TagRow(self, i)
+
+    def __reversed__(self):
+        for i in range(self._length - 1, -1, -1):
+            yield TagRow(self, i)
+
+    def append(self, row):
+        for header in row:
+            if header is not None and header not in self.columns:
+                self._add_column(header)
+        get = row.get
+        for header, column in self.columns.items():
+            column.codes.append(column.encode(get(header, "")))
+        self._length += 1
+
+    def pop(self):
+        """Removes the last row and returns it as a plain dict."""
+        if not self._length:
+            raise IndexError("pop from empty tag table")
+        row = self.row_dict(self._length - 1)
+        for column in self.columns.values():
+            column.codes.pop()
+        self._length -= 1
+        return row
+
+    def copy(self):
+        table = TagTable()
+        table.headers = list(self.headers)
+        table.columns = {h: c.copy() for h, c in self.columns.items()}
+        table._length = self._length
+        return table
+
+    def take(self, indices):
+        """New table holding just the given rows, in the given order."""
+        table = self.copy()
+        for header, column in table.columns.items():
+            column.codes = array(column.codes.typecode, map(self.columns[header].codes.__getitem__, indices))
+        table._length = len(indices)
+        return table
+
+    def extend(self, other):
+        """Appends every row of another TagTable, a column at a time."""
+        for header in other.headers:
+            if header not in self.columns:
+                self._add_column(header)
+        for header, column in self.columns.items():
+            source = other.columns.get(header)
+            if source is None:
+                column.codes.extend(array(column.codes.typecode, [column.encode("")]) * len(other))
+            else:
+                # Re-encode each distinct code of the other table once, then map the whole column
+                mapping = {code: column.encode(source.decode(code)) for code in set(source.codes)}
+                column.codes.extend(array(column.codes.typecode, map(mapping.__getitem__, source.codes)))
+        self._length += len(other)
+
+    # --- CELL ACCESS ---
+    def get_value(self, i, header):
+        return self.columns[header].get(i)
+
+    def set_value(self, i, header, value):
+        if header not in self.columns:
+            self._add_column(header)
+        column = self.columns[header]
+        column.codes[i] = column.encode(value)
+
+    def column_values(self, header):
+        """Decoded list of every value in a column ("" throughout if the column is missing)."""
+        column = self.columns.get(header)
+        if column is None:
+            return [""] * self._length
+        lookup = {code: column.decode(code) for code in set(column.codes)}
+        return [lookup[code] for code in column.codes]
+
+    def row_dict(self, i):
+        return {h: c.get(i) for h, c in self.columns.items()}
+
+    def distinct(self, *headers):
+        """Set of distinct value tuples across the given columns, decoded once per code."""
+        columns = [self.columns[h] for h in headers]
+        code_tuples = set(zip(*(c.codes for c in columns)))
+        return {tuple(c.decode(code) for c, code in zip(columns, codes)) for codes in code_tuples}
+
+    def _add_column(self, header):
+        column_type = IntColumn if header in INT_COLUMNS else CategoryColumn
+        self.columns[header] = column_type(self._length)
+        self.headers.append(header)
+
+
+class TagRow(MutableMapping):
+    """View of a single row of a TagTable, usable wherever a row dict was."""
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, header):
+        column = self._table.columns.get(header)
+        if column is None:
+            raise KeyError(header)
+        return column.get(self._index)
+
+    def get(self, header, default=None):
+        # Faster than MutableMapping.get, which goes through __getitem__ and KeyError
+        column = self._table.columns.get(header)
+        return default if column is None else column.get(self._index)
+
+    def __setitem__(self, header, value):
+        self._table.set_value(self._index, header, value)
+
+    def __delitem__(self, header):
+        self._table.set_value(self._index, header, "")
+
+    def __iter__(self):
+        return iter(self._table.headers)
+
+    def __len__(self):
+        return len(self._table.headers)
+
+    def __repr__(self):
+        return f"TagRow({self._table.row_dict(self._index)!r})"
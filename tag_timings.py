@@ -0,0 +1,141 @@
+"""Per-tag timing instrumentation for the tagger.
+
+Each tag is timed at the points that decide whether the tagger keeps up on race
+day:
+
+    key to saved    keypress (its Tk event time) until the row is in the store and journal
+    key to disk     keypress until the journal write holding its row has been fsynced
+    journal save    one journal write and fsync on the writer thread
+    index lookup    one race index lookup made by the tagging rules
+    ui refresh      redrawing the widgets after an action
+
+Every timing keeps a rolling window of its latest samples, bucketed on a log
+scale, so the debug panel shows how the tagger is doing now rather than since
+it started. `dump` writes the lot, raw samples included, to a JSON file for
+comparing runs as the data file grows.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+KEY_TO_SAVED = "key to saved"
+KEY_TO_DISK = "key to disk"
+JOURNAL_SAVE = "journal save"
+INDEX_LOOKUP = "index lookup"
+UI_REFRESH = "ui refresh"
+METRICS = (KEY_TO_SAVED, KEY_TO_DISK, JOURNAL_SAVE, INDEX_LOOKUP, UI_REFRESH)
+
+WINDOW_SAMPLES = 1000
+# Upper edges of the histogram buckets, in milliseconds; the last bucket is everything slower
+BUCKET_EDGES_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def timings_path_for(csv_path):
+    return os.path.splitext(csv_path)[0] + ".timings.json"
+
+
+def bucket_labels():
+    labels = [f"<={edge:g}ms" for edge in BUCKET_EDGES_MS]
+    return labels + [f">{BUCKET_EDGES_MS[-1]:g}ms"]
+
+
+class RollingHistogram:
+    """The latest `window` samples of one timing, in milliseconds, with log-scale bucket counts."""
+
+    def __init__(self, window=WINDOW_SAMPLES):
+        self.samples = deque(maxlen=window)
+        self.counts = [0] * (len(BUCKET_EDGES_MS) + 1)
+        self.total = 0  # Samples ever added, including those out of the window
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, ms):
+        if len(self.samples) == self.samples.maxlen:
+            self.counts[bisect_left(BUCKET_EDGES_MS, self.samples[0])] -= 1
+        self.samples.append(ms)
+        self.counts[bisect_left(BUCKET_EDGES_MS, ms)] += 1
+        self.total += 1
+
+    def percentiles(self, *fractions):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return [None] * len(fractions)
+        return [ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] for fraction in fractions]
+
+    def summary(self):
+        p50, p95, p99 = self.percentiles(0.5, 0.95, 0.99)
+        return {
+            "count": self.total, "window": len(self.samples),
+            "p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "max_ms": max(self.samples, default=None),
+            "buckets": dict(zip(bucket_labels(), self.counts)),
+        }
+
+
+class TagTimings:
+    """Rolling histograms of the tagger's timings; safe to add to from the writer thread."""
+
+    def __init__(self, window=WINDOW_SAMPLES):
+        self.window = window
+        self.histograms = {metric: RollingHistogram(window) for metric in METRICS}
+        self.started = datetime.now()
+        self._lock = threading.Lock()
+
+    @property
+    def count(self):
+        """Samples added since the start or the last reset."""
+        return sum(histogram.total for histogram in self.histograms.values())
+
+    def add(self, metric, seconds):
+        with self._lock:
+            self.histograms[metric].add(seconds * 1000)
+
+    @contextmanager
+    def timed(self, metric):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(metric, time.perf_counter() - start)
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {metric: RollingHistogram(self.window) for metric in METRICS}
+            self.started = datetime.now()
+
+    def summaries(self):
+        with self._lock:
+            return {metric: histogram.summary() for metric, histogram in self.histograms.items()}
+
+    def report(self):
+        """A fixed-width text table of the timings, for the debug panel and the console."""
+        lines = [f"{'':14} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}   (ms, last {self.window})"]
+        summaries = self.summaries()
+        for metric, summary in summaries.items():
+            cells = ["-" if summary[key] is None else f"{summary[key]:.2f}" for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms")]
+            lines.append(f"{metric:14} {summary['count']:>7} " + " ".join(f"{cell:>9}" for cell in cells))
+        lines.append("")
+        for metric, summary in summaries.items():
+            if summary["window"]:
+                filled = [f"{label} {count}" for label, count in summary["buckets"].items() if count]
+                lines.append(f"{metric}: {', '.join(filled)}")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """Writes every timing, with its raw samples, as JSON. Raises OSError on failure."""
+        with self._lock:
+            data = {
+                "started": self.started.isoformat(timespec="seconds"),
+                "written": datetime.now().isoformat(timespec="seconds"),
+                "bucket_edges_ms": list(BUCKET_EDGES_MS),
+                "metrics": {metric: dict(h.summary(), samples_ms=[round(ms, 4) for ms in h.samples])
+                            for metric, h in self.histograms.items()},
+            }
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(path + ".tmp", path)
@@ -0,0 +1,72 @@
+"""One background thread that does all of the tagger's disk writes.
+
+The Tk event loop only queues work here, so a slow disk or a synced Desktop
+folder never delays the next keypress. Saves of the same kind coalesce: while a
+"journal" or "snapshot" job is still waiting, submitting another one replaces it,
+so a burst of tags costs one write and one fsync instead of one each. Jobs of
+different kinds run in the order they were first queued.
+
+The outcome of every job is put on `outcomes` as (kind, result, error) for the
+UI to collect from its own thread (tkinter must not be called from this one).
+"""
+import queue
+import threading
+
+# Distinct kinds of job that can be waiting at once; more only if callers invent many kinds
+DEFAULT_QUEUE_SIZE = 16
+
+
+class BackgroundWriter:
+    """Runs queued save jobs on a dedicated thread, latest job of each kind wins."""
+
+    def __init__(self, maxsize=DEFAULT_QUEUE_SIZE):
+        self.outcomes = queue.SimpleQueue()
+        self._queue = queue.Queue(maxsize)   # Kinds waiting to run, in order
+        self._jobs = {}                      # Kind -> latest job submitted for it
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="tag-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, kind, job, *args):
+        """Queues job(*args) to run on the writer thread. If a job of this kind is still
+        waiting, it is replaced instead. Blocks only if the queue is full."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("writer is closed")
+            waiting = kind in self._jobs
+            self._jobs[kind] = (job, args)
+        if not waiting:
+            self._queue.put(kind)
+
+    def pending(self):
+        """Number of jobs queued or running."""
+        return self._queue.unfinished_tasks
+
+    def flush(self):
+        """Blocks until every job submitted so far has run."""
+        self._queue.join()
+
+    def close(self):
+        """Runs the jobs still queued, then stops the thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            kind = self._queue.get()
+            if kind is None:
+                self._queue.task_done()
+                return
+            with self._lock:
+                job, args = self._jobs.pop(kind)
+            try:
+                self.outcomes.put((kind, job(*args), None))
+            except Exception as e:
+                self.outcomes.put((kind, None, e))
+            finally:
+                self._queue.task_done()
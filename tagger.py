@@ -1,16 +1,44 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import csv
+import argparse
 from datetime import datetime
 import sys
 import os
+import queue
+import sqlite3
+import threading
+import time
+
+from key_queue import KeyQueue
+from live_server import DEFAULT_PORT as LIVE_PORT, LiveServer
+from race_checkpoint import checkpoint_path_for, matches, read_checkpoint, row_marker, write_checkpoint
+from race_analytics import RaceAnalytics, analytics_path_for, result_note, save_analytics
+from roster import athlete_roster, write_roster
+from tag_archive import open_archive
+from tag_integrity import check_table, format_violation
+from tag_journal import apply_records
+from tag_stations import StationLog, check_station_name, format_conflict, station_csv_path, stations_db_for
+from tag_store import STANDARD_HEADERS, TagStore
+from tag_table import TagTable
+from tag_timings import JOURNAL_SAVE, KEY_TO_DISK, KEY_TO_SAVED, UI_REFRESH, TagTimings, timings_path_for
+from tag_writer import BackgroundWriter
+from tagging_session import BIB_DATA, TaggingSession, TaggingWarning, get_ordinal_suffix
+
+# How long to wait after a tag before writing a fresh snapshot of the journalled data
+SNAPSHOT_DELAY_MS = 5000
+# How often the UI collects the outcome of background writes
+WRITER_POLL_MS = 100
+# How often the timings panel redraws while it is open
+TIMINGS_REFRESH_MS = 1000
+# Integrity violations listed in the log by CHECK DATA
+CHECK_VIOLATIONS_SHOWN = 30
 
 
 # Main application class for the GUI
 class KXTaggerApp:
-    def __init__(self, root):
+    def __init__(self, root, station=None):
         self.root = root
-        self.root.title("Kayak Cross Tagger")
+        self.root.title(f"Kayak Cross Tagger - Station {station}" if station else "Kayak Cross Tagger")
         self.bg_color = "#212121"
         self.root.resizable(True, True)
         self.root.configure(bg=self.bg_color)
@@ -177,28 +205,12 @@ class KXTaggerApp:
         )
 
         # --- DATA & STATE MANAGEMENT ---
-        self.tagged_data = []
         self.extra_headers = [] # To store custom columns
-        self.standard_headers = [
-            "Year", "Competition", "Gender", "Phase", "Gate", "BIB", "Ramp Position",
-            "Action", "Order", "Final Position", "Upstream Tactic", "Athlete Name", "Faults"
-        ]
+        self.standard_headers = list(STANDARD_HEADERS)
         self.num_paddlers_var = tk.IntVar(value=4)
-        self.paddler_ramp_positions = {}
-        self.disabled_positions = set()
-        self.faulted_bibs = set()
-        self.dns_bibs = set() # Track DNS bibs to exclude from finish count
-        self.selected_paddler_setup = None
-        self.selected_gate = None
-        self.selected_actions = set()
-        self.paddler_order_sequence = []
-        self.finish_line_sequence = []
-        self.phase_final_positions = {}
-        self.upstream_tactic_actions = []
         self.paddler_buttons = {}
         self.ramp_position_buttons = {}
         self.gate_buttons = {}
-        self.gate_order = [] 
         self.action_buttons = {}
         
         # State for athlete name handling
@@ -208,12 +220,7 @@ class KXTaggerApp:
         self.female_athlete_names = set()
 
         # Bib data mapping internal P-number to UI name, color, and CSV character
-        self.bib_data = {
-            "P1": {"name": "RED", "color": "#E5296B", "csv_char": "R"},
-            "P2": {"name": "GREEN", "color": "#0BC2A3", "csv_char": "G"},
-            "P3": {"name": "BLUE", "color": "#095cd9", "csv_char": "B"},
-            "P4": {"name": "YELLOW", "color": "#FEEA63", "csv_char": "Y"},
-        }
+        self.bib_data = BIB_DATA
 
         # Autosave path setup
         try:
@@ -226,103 +233,421 @@ class KXTaggerApp:
             print(f"Warning: Could not access directory path: {e}")
             self.autosave_path = "kx_race_analysis_git.csv"
 
+        # A station (one of several taggers on the same race) keeps its own files and shares
+        # its rows with the others through the station database (tag_stations.py)
+        self.stations = None
+        if station:
+            stations_db = stations_db_for(self.autosave_path)
+            self.autosave_path = station_csv_path(self.autosave_path, station)
+            try:
+                os.makedirs(os.path.dirname(self.autosave_path), exist_ok=True)
+                self.stations = StationLog(stations_db, station)
+                print(f"Station {station}: sharing tags through {stations_db}")
+            except (OSError, sqlite3.Error) as e:
+                messagebox.showerror("Station Error", f"Could not open the station database {stations_db}\nError: {e}\nTags are saved for this station only.")
+
+        # Every tag is appended to the journal; a binary snapshot is written in the background
+        # and the CSV is only brought up to date on export. All of the writing happens on the
+        # writer thread, so a slow disk never holds up the next tag
+        self.archive = open_archive(self.autosave_path)
+        self.journal = self.archive.journal
+        self.journal.write_behind = True
+        self.writer = BackgroundWriter()
+        self.snapshot_path = self.archive.snapshot_path
+        self._snapshot_job = None
+        self._write_failures = {}  # Kind of write -> last error reported, until it works again
+        self.load_error = None
+
+        self._history_thread = None
+        self._history_result = None
+        self._upgrade_error = None
+        self.history_loaded = False
+
+        # Rows, index and journal live in the store; race state and tagging rules in the session
+        self.store = TagStore(journal=self.journal)
+        self.store.before_access = self._ensure_history
+        self.store.on_change = self.autosave
+        self.store.on_row_change = self._row_changed
+        self.session = TaggingSession(self.store, log=self.log_to_display)
+        self.timings = TagTimings()  # Per-tag latencies, shown by the TIMINGS panel and dumped on close
+        self.store.timings = self.timings
+        self.analytics = None  # Race results and report aggregates, kept current tag by tag
+        self.keys = KeyQueue()  # Keypresses, stamped on arrival and handled in order
+        self._results_due = False
+        self.live = None  # LiveServer streaming tags to report pages, if started with --live
+        self._restored_race = None  # Checkpoint the race on screen came from, until the history confirms it
+        self._checkpointed = None   # (race, row marker) last queued for the checkpoint file
+
         self.setup_ui()
+        self._restore_race()
         self._load_existing_data()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(WRITER_POLL_MS, self._poll_writer)
 
     def _load_existing_data(self):
-        """Loads data from the autosave CSV, preserving any extra columns and populating athlete lists."""
-        if not os.path.isfile(self.autosave_path):
-            self.log_to_display(f"No existing data file found. A new one will be created at:\n{self.autosave_path}")
-            return
-        try:
-            with open(self.autosave_path, "r", newline="", encoding='utf-8') as f:
-                if os.path.getsize(self.autosave_path) == 0:
-                    self.log_to_display("Autosave file is empty. Starting fresh.")
-                    return
-
-                reader = csv.DictReader(f)
-                self.tagged_data = list(reader)
-
-                # Find extra headers
-                if self.tagged_data:
-                    all_headers = self.tagged_data[0].keys()
-                    self.extra_headers = [h for h in all_headers if h not in self.standard_headers]
-                    if self.extra_headers:
-                         self.log_to_display(f"Found extra columns, will preserve: {', '.join(self.extra_headers)}")
-                
-                # Populate athlete name lists
-                for row in self.tagged_data:
-                    name = row.get("Athlete Name", "").strip()
-                    gender = row.get("Gender")
-                    if name:
-                        if gender == "M":
-                            self.male_athlete_names.add(name)
-                        elif gender == "W":
-                            self.female_athlete_names.add(name)
-
-                self.log_to_display(f"Loaded {len(self.tagged_data)} existing tags from {self.autosave_path}")
-                self._update_athlete_name_dropdowns()
+        """Fills the athlete lists from the roster sidecar straight away, then upgrades data from
+        older versions and loads the full history in the background. Without a current sidecar
+        the lists fill once the history is in."""
+        journal_open = self._open_journal()
+        roster = self.archive.read_roster()
+        if roster is None:
+            self.log_to_display("Loading existing tags in the background...")
+        else:
+            self.extra_headers = [h for h in roster["headers"] if h not in self.standard_headers]
+            self.male_athlete_names.update(roster["athletes"].get("M", []))
+            self.female_athlete_names.update(roster["athletes"].get("W", []))
+            self._update_athlete_name_dropdowns()
+            self.log_to_display(f"Loaded athlete roster; loading {roster['rows']} existing tags in the background...")
 
-        except Exception as e:
-            messagebox.showerror("Load Error", f"Could not read autosave file: {self.autosave_path}\nError: {e}")
-            self.tagged_data = []
-            self.extra_headers = []
+        self._history_thread = threading.Thread(target=self._read_history_in_background, args=(journal_open,), daemon=True)
+        self._history_thread.start()
+        self.root.after(50, self._poll_history_load)
 
-    def _write_csv(self, filepath):
-        """Writes the current data to a CSV file, including extra headers."""
-        all_keys = set(self.standard_headers)
-        for row in self.tagged_data:
-            all_keys.update(row.keys())
+    def _read_history_in_background(self, upgrade):
+        """Runs on the history thread: the schema upgrade (which may rewrite the whole data
+        file), then the history read. Nothing touches the journal until the load is finished."""
+        if upgrade:
+            try:
+                self.archive.upgrade()
+            except Exception as e:  # Any backend's error; the data is still read as it is
+                self._upgrade_error = e
+        self._history_result = self.archive.read_history()
 
-        final_headers = self.standard_headers + sorted([h for h in all_keys if h not in self.standard_headers])
+    def _poll_history_load(self):
+        if self.history_loaded:
+            return
+        if self._history_thread.is_alive():
+            self.root.after(50, self._poll_history_load)
+        else:
+            self._finish_history_load()
+
+    def _ensure_history(self):
+        """Blocks until the tag history is loaded; anything touching rows calls this first."""
+        if not self.history_loaded:
+            if self._history_thread:
+                self._history_thread.join()
+            self._finish_history_load()
+
+    def _finish_history_load(self):
+        """Installs the loaded history, preserving any extra columns and populating athlete lists."""
+        self.history_loaded = True
+        table, message, error, upto = self._history_result
+        self._history_result = None
+        for line in self.archive.migration_messages():
+            self.log_to_display(line)
+        if self._upgrade_error:
+            self.log_to_display(f"WARNING: Could not upgrade {self.autosave_path} to the current data version; "
+                                f"it is loaded as it is and the upgrade runs again next start: {self._upgrade_error}")
+        rows = TagTable(self.standard_headers)
+        if error:
+            messagebox.showerror("Load Error", f"Could not read autosave file: {self.autosave_path}\nError: {error}")
+            self.load_error = error
+            self.extra_headers = []
+        elif table is not None:
+            rows = table
+
+            # Find extra headers
+            if rows:
+                self.extra_headers = [h for h in rows.headers if h not in self.standard_headers]
+                if self.extra_headers:
+                     self.log_to_display(f"Found extra columns, will preserve: {', '.join(self.extra_headers)}")
+
+            # Populate athlete name lists (once per distinct gender/name pair, not per row)
+            roster = athlete_roster(rows)
+            self.male_athlete_names.update(roster["M"])
+            self.female_athlete_names.update(roster["W"])
+            self._update_athlete_name_dropdowns()
+        if message:
+            self.log_to_display(message)
+
+        self._replay_journal(rows, upto)
+        self.store.load(rows)
+        self._confirm_restored_race()
+        self.analytics = RaceAnalytics.from_table(rows)
+        if self.stations:
+            self.stations.resync(rows, time.time())
+            self.writer.submit("stations", self.stations.flush)
+        if self.live:
+            self.live.reset(rows.copy())
+        if table is not None and not self.load_error and self.archive.read_roster() is None:
+            try:
+                write_roster(self.archive.csv_path, self.tagged_data, self.archive.fingerprint(self.archive.csv_path))
+            except OSError as e:
+                print(f"Warning: Could not write roster sidecar: {e}")
 
+    def _open_journal(self):
+        """Opens the tag journal and keeps any changes that never made it into the CSV for
+        replay. The data upgrade is left to the history thread. Returns True if it opened."""
         try:
-            with open(filepath, "w", newline="", encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=final_headers, restval='')
-                writer.writeheader()
-                writer.writerows(self.tagged_data)
-            return True, None
-        except IOError as e:
-            return False, e
-
-    def autosave_csv(self):
-        """Rewrites the entire CSV file with the current in-memory data."""
-        success, error = self._write_csv(self.autosave_path)
-        if not success:
-            messagebox.showerror("Autosave Error", f"Could not write to file: {self.autosave_path}\nError: {error}")
-
-    def cleanup_csv_data(self):
-        """One-off utility to clean up Final Position column in existing data."""
-        if not self.tagged_data:
-            messagebox.showinfo("Cleanup", "No data loaded to clean up.")
+            self.archive.open_journal()
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("Journal Error", f"Could not open tag journal: {self.journal.path}\nError: {e}")
+            return False
+        for warning in self.archive.journal_warnings():
+            self.log_to_display(warning)
+        return True
+
+    def _replay_journal(self, rows, upto):
+        """Applies journalled changes made after journal position `upto` to the loaded history."""
+        pending = self.archive.take_pending(upto)
+        if pending and self.load_error:
+            self.log_to_display(f"WARNING: {len(pending)} journalled changes not replayed because the CSV failed to load.")
+        elif pending:
+            apply_records(rows, pending)
+            self.log_to_display(f"Recovered {len(pending)} journalled changes not yet saved.")
+            self.autosave_snapshot()
+
+    def _restore_race(self):
+        """Puts the race that was being tagged before a restart back on screen, from its checkpoint."""
+        checkpoint = read_checkpoint(self.autosave_path)
+        if checkpoint is None:
             return
-
-        confirm = messagebox.askyesno(
-            "Confirm Cleanup", 
-            "This will remove 'Final Position' values from all gate rows except 'Finish', 'DNS', and 'Fault' rows to match the new format. Proceed?"
-        )
-        if not confirm:
+        try:
+            self.session.restore_checkpoint(checkpoint["race"])
+        except (KeyError, TypeError) as e:
+            self.log_to_display(f"WARNING: Could not restore the race from {checkpoint_path_for(self.autosave_path)}: {e}")
+            self.session.clear_all_assignments()
             return
-
-        count = 0
-        for row in self.tagged_data:
-            gate = row.get("Gate", "")
-            action = row.get("Action", "")
-            faults = row.get("Faults", "")
-            
-            # Keep rank only for terminal/result rows
-            is_terminal = (gate == "Finish" or action == "DNS" or action == "FLT" or (faults and "FLT" in faults))
-            
-            if not is_terminal and row.get("Final Position"):
-                row["Final Position"] = ""
-                count += 1
-        
-        if count > 0:
-            self.autosave_csv()
-            self.log_to_display(f"--- CLEANUP COMPLETE: Updated {count} rows. ---")
-            messagebox.showinfo("Cleanup Complete", f"Successfully cleaned up {count} rows. Changes saved to CSV.")
+        session = self.session
+        self.year_var.set(session.year); self.comp_var.set(session.comp)
+        self.gender_var.set(session.gender); self.phase_var.set(session.phase)
+        self.num_paddlers_var.set(session.num_paddlers)
+        self._update_athlete_name_dropdowns()
+        self._sync_ui()
+        self._restored_race = checkpoint
+        self.log_to_display(f"--- RACE RESTORED: {session.year} {session.comp} {session.gender} {session.phase}, as it was before the restart ---")
+
+    def _confirm_restored_race(self):
+        """Drops the restored race state if tags were added or undone after its checkpoint."""
+        checkpoint, self._restored_race = self._restored_race, None
+        if checkpoint is None or matches(checkpoint, self.tagged_data):
+            return
+        self.session.clear_all_assignments()
+        self._sync_ui()
+        self.log_to_display("WARNING: The restored race no longer matches the saved tags; ramp positions and sequences were cleared.")
+
+    # --- PERSISTENCE ---
+    @property
+    def tagged_data(self):
+        """All tag rows (a TagTable); changes go through self.store so they are indexed and journalled."""
+        return self.store.rows
+
+    def autosave(self):
+        """Queues the new journal records for the writer thread and schedules a snapshot."""
+        self.writer.submit("journal", self._flush_journal, self.session.key_time)
+        self.autosave_snapshot()
+
+    def _flush_journal(self, key_time):
+        """Runs on the writer thread. `key_time` is when the key behind the latest tag was pressed, if known."""
+        if self.journal.unwritten:
+            with self.timings.timed(JOURNAL_SAVE):
+                self.journal.flush()
         else:
-            messagebox.showinfo("Cleanup", "No rows needed cleaning (dataset already matches current format).")
+            self.journal.flush()
+        if key_time:
+            self.timings.add(KEY_TO_DISK, time.time() - key_time)
+
+    def autosave_snapshot(self):
+        """Schedules a background snapshot write; the journal already holds every tag."""
+        if self._snapshot_job is None:
+            self._snapshot_job = self.root.after(SNAPSHOT_DELAY_MS, self._start_snapshot)
+
+    def _start_snapshot(self):
+        self._snapshot_job = None
+        if self.journal.last_seq <= self.archive.snapshot_upto:
+            return
+        self.writer.submit("snapshot", self.archive.write_snapshot, self.tagged_data.copy(), self.journal.last_seq)
+
+    def _checkpoint_race(self):
+        """Queues a checkpoint of the race state if it changed, so a restart can pick the race up again."""
+        if not self.history_loaded:
+            return
+        checkpoint = (self.session.checkpoint(), row_marker(self.tagged_data))
+        if checkpoint == self._checkpointed:
+            return
+        self._checkpointed = checkpoint
+        self.writer.submit("race", self._write_checkpoint, *checkpoint)
+
+    def _write_checkpoint(self, race, marker):
+        """Runs on the writer thread."""
+        # The journal first, so a checkpoint on disk never refers to tags that are not
+        self.journal.flush()
+        write_checkpoint(self.autosave_path, race, marker)
+
+    def export_csv(self):
+        """Queues a CSV export of the rows as they are now. The writer thread appends the new
+        rows, or rewrites the file if exported rows changed, and the outcome is logged."""
+        self._ensure_history()
+        if not self.archive.needs_export():
+            return
+        rows = self.tagged_data.copy()
+        self.writer.submit("export", self.archive.export, rows, self.journal.last_seq)
+        # From the same rows as the CSV, because the report checks the row count
+        self.writer.submit("analytics", self._write_analytics, rows)
+
+    def _write_analytics(self, rows):
+        """Runs on the writer thread: the report analytics of the rows just exported."""
+        save_analytics(RaceAnalytics.from_table(rows), analytics_path_for(self.autosave_path))
+
+    def _poll_writer(self):
+        self._report_writes()
+        self.root.after(WRITER_POLL_MS, self._poll_writer)
+
+    def _report_writes(self):
+        """Reports what the writer thread has finished: exports, failed writes and recoveries."""
+        while True:
+            try:
+                kind, result, error = self.writer.outcomes.get_nowait()
+            except queue.Empty:
+                return
+            if kind == "export":
+                self._report_export(result, error)
+            elif error:
+                # A failing disk fails every write; say so once, not once per tag
+                if str(error) != self._write_failures.get(kind):
+                    self._write_failures[kind] = str(error)
+                    self.log_to_display(self._write_failure_message(kind, error))
+            else:
+                if kind == "stations":
+                    self._report_conflicts(result)
+                if self._write_failures.pop(kind, None) is not None:
+                    self.log_to_display(f"--- {kind.upper()} WRITES WORKING AGAIN ---")
+
+    def _write_failure_message(self, kind, error):
+        if kind == "journal":
+            return (f"ERROR: Could not write tag journal {self.journal.path}: {error}. "
+                    f"{self.journal.unwritten} bytes of tags are held in memory and retried with every tag.")
+        if kind == "snapshot":
+            return f"WARNING: Could not write snapshot {self.snapshot_path}: {error}. Tags are safe in the journal."
+        if kind == "race":
+            return (f"WARNING: Could not write race checkpoint {checkpoint_path_for(self.autosave_path)}: {error}. "
+                    f"Tags are safe in the journal; only the race on screen would need entering again after a restart.")
+        if kind == "analytics":
+            return f"WARNING: Could not write report analytics {analytics_path_for(self.autosave_path)}: {error}"
+        if kind == "stations":
+            return (f"WARNING: Could not write to the station database {self.stations.path}: {error}. "
+                    f"{self.stations.pending} changes are held here and retried with every tag.")
+        return f"WARNING: Background {kind} write failed: {error}"
+
+    def _report_conflicts(self, conflicts):
+        for conflict in conflicts:
+            self.log_to_display(f"CONFLICT: {format_conflict(*conflict)}")
+        if conflicts:
+            self.root.bell()
+
+    def _report_export(self, result, error):
+        if error:
+            messagebox.showerror("Export Error", f"Could not write to file: {self.autosave_path}\nError: {error}\nTags are safe in the journal.")
+            return
+        mode, count = result
+        self.log_to_display(f"--- CSV EXPORTED: {mode} {count} rows ---")
+        # The journal was trimmed up to the export, so the snapshot must catch up too
+        self.autosave_snapshot()
+
+    def on_close(self):
+        self._ensure_history()
+        self.export_csv()
+        if self._snapshot_job:
+            self.root.after_cancel(self._snapshot_job)
+        self._start_snapshot()
+        self.writer.close()
+        self._report_writes()
+        if self.timings.count:
+            self.dump_timings()
+        if self.live:
+            self.live.stop()
+        if self.stations:
+            self.stations.close()
+        try:
+            self.archive.close()
+        except OSError as e:
+            messagebox.showerror("Save Error", f"Could not write tag journal: {self.journal.path}\nError: {e}")
+        self.root.destroy()
+
+    # --- TIMINGS ---
+    def open_timings_panel(self):
+        """Debug panel with the rolling per-tag timings, redrawn every second while it is open."""
+        popup = tk.Toplevel(self.root)
+        popup.title("Tag Timings"); popup.config(bg=self.bg_color)
+        text = tk.Text(popup, width=80, height=18, font=("Space Mono", 10), bg="#101010", fg="white")
+        text.pack(fill="both", expand=True, padx=10, pady=10)
+        buttons = ttk.Frame(popup, style="TFrame"); buttons.pack(fill="x", padx=10, pady=(0, 10))
+        ttk.Button(buttons, text="SAVE TO FILE", command=self.dump_timings, style="Small.TButton").pack(side="left", expand=True, fill="x", padx=2)
+        ttk.Button(buttons, text="RESET", command=self.timings.reset, style="Small.TButton").pack(side="left", expand=True, fill="x", padx=2)
+
+        def refresh():
+            if not popup.winfo_exists():
+                return
+            text.config(state=tk.NORMAL)
+            text.delete("1.0", tk.END)
+            text.insert(tk.END, self.timings.report())
+            text.config(state=tk.DISABLED)
+            popup.after(TIMINGS_REFRESH_MS, refresh)
+        refresh()
+
+    def dump_timings(self):
+        """Writes the timings, raw samples included, next to the data file."""
+        path = timings_path_for(self.autosave_path)
+        try:
+            self.timings.dump(path)
+        except OSError as e:
+            self.log_to_display(f"WARNING: Could not write tag timings {path}: {e}")
+            return
+        self.log_to_display(f"--- TIMINGS SAVED: {path} ---")
+
+    def check_data(self):
+        """Runs the integrity checks (tag_integrity.py) over the whole history and logs what they find."""
+        self._ensure_history()
+        violations = check_table(self.store.rows)
+        for violation in violations[:CHECK_VIOLATIONS_SHOWN]:
+            self.log_to_display(f"CHECK: {format_violation(violation)}")
+        if len(violations) > CHECK_VIOLATIONS_SHOWN:
+            self.log_to_display(f"CHECK: ... and {len(violations) - CHECK_VIOLATIONS_SHOWN} more (python tag_integrity.py lists them all)")
+        self.log_to_display(f"--- CHECK COMPLETE: {len(violations)} violations in {len(self.store.rows)} rows ---")
+
+    # --- LIVE RESULTS ---
+    def start_live_server(self, host, port):
+        """Streams every saved tag to report pages on the local network (live_server.py)."""
+        live = LiveServer(host, port)
+        try:
+            live.start()
+        except OSError as e:
+            messagebox.showerror("Live Server Error", f"Could not start the live server on port {port}\nError: {e}")
+            return
+        self.live = live
+        if self.history_loaded:
+            live.reset(self.store.rows.copy())
+        self.log_to_display(f"--- LIVE: coaches can follow tags at {live.url} ---")
+
+    def _row_changed(self, op, index, row):
+        if self.session.key_time:
+            self.timings.add(KEY_TO_SAVED, time.time() - self.session.key_time)
+        self._update_analytics(op, index, row)
+        if self.stations:
+            self.stations.record(op, index, row, self.session.key_time or time.time())
+            self.writer.submit("stations", self.stations.flush)
+        if self.live:
+            self.live.row_changed(op, index, row)
+
+    def _update_analytics(self, op, index, row):
+        if not self.analytics:
+            return
+        self.analytics.row_changed(op, index, row)
+        # Results are shown once the last boat crosses the finish, and again when faults change them
+        if op != "undo" and (row.get("Faults") or (row.get("Gate") == "Finish" and self.session.race_finished())):
+            self._results_due = True
+
+    def _show_race_results(self):
+        """Logs the ranked results of the race just tagged, faults and all."""
+        race = self.analytics.last_changed_race if self.analytics else None
+        if race is None:
+            return
+        ordered_gates = self.analytics.structure(*race[:2])["orderedGates"]
+        places = []
+        for result in self.analytics.race_results(race):
+            note = result_note(result, ordered_gates)
+            places.append(f"{result['calculatedRank']}. {result['name']}" + (f" ({note})" if note else ""))
+        self.log_to_display(f"--- RESULT {race[4]}: {', '.join(places)} ---")
 
     # --- UI BUILDING ---
     def setup_ui(self):
@@ -475,7 +800,7 @@ class KXTaggerApp:
                 height=3,
                 bd=2,
             )
-            lbl.bind("<Button-1>", lambda e, n=p_key: self.on_paddler_press(n))
+            lbl.bind("<Button-1>", lambda e, n=p_key: self._on_paddler_click(n))
             lbl.grid(row=i // 2, column=i % 2, padx=5, pady=5)
             self.paddler_buttons[p_key] = lbl
 
@@ -505,13 +830,14 @@ class KXTaggerApp:
         
         ttk.Button(clear_frame, text="CLEAR ALL", command=self.clear_all_assignments, style="Small.TButton").pack(pady=2, fill="x")
         ttk.Button(clear_frame, text="CLEAR CURRENT", command=self.clear_tag_selection, style="Small.TButton").pack(pady=2, fill="x")
-        ttk.Button(clear_frame, text="UNDO LAST", command=self.undo_last_paddler, style="Small.TButton").pack(pady=2, fill="x")
+        ttk.Button(clear_frame, text="UNDO", command=self.undo, style="Small.TButton").pack(pady=2, fill="x")
+        ttk.Button(clear_frame, text="REDO", command=self.redo, style="Small.TButton").pack(pady=2, fill="x")
         ttk.Button(clear_frame, text="DNS", command=self.save_dns_tag, style="Small.TButton").pack(pady=10, fill="x")
         ttk.Button(clear_frame, text="FAULT", command=self.save_fault_tag, style="Small.Red.TButton").pack(pady=2, fill="x")
         
-        # Retroactive cleanup button
-        cleanup_btn = ttk.Button(clear_frame, text="CLEAN UP CSV", command=self.cleanup_csv_data, style="Small.TButton")
-        cleanup_btn.pack(pady=(20, 2), fill="x")
+        ttk.Button(clear_frame, text="CHECK DATA", command=self.check_data, style="Small.TButton").pack(pady=(20, 2), fill="x")
+        ttk.Button(clear_frame, text="EXPORT CSV", command=self.export_csv, style="Small.TButton").pack(pady=2, fill="x")
+        ttk.Button(clear_frame, text="TIMINGS", command=self.open_timings_panel, style="Small.TButton").pack(pady=2, fill="x")
 
 
         position_frame = ttk.Frame(paddlers_frame, style="TFrame")
@@ -538,7 +864,7 @@ class KXTaggerApp:
                 relief=tk.RAISED,
                 bd=2,
             )
-            lbl.bind("<Button-1>", lambda e, p=pos: self.assign_ramp_position(p))
+            lbl.bind("<Button-1>", lambda e, p=pos: self._on_ramp_click(p))
             lbl.grid(row=i // 2, column=i % 2, padx=5, pady=5)
             self.ramp_position_buttons[pos] = lbl
 
@@ -563,8 +889,7 @@ class KXTaggerApp:
             btn.grid(row=0, column=i - 1, padx=5, pady=5, sticky="ew")
             self.gate_buttons[gate_name] = btn
             segments_grid.columnconfigure(i - 1, weight=1)
-        
-        self.gate_order = [f"Gate {i}" for i in range(1, 9)]
+
 
         actions_frame = ttk.Frame(segments_frame, style="TFrame")
         actions_frame.pack(fill="x", pady=(10, 0))
@@ -620,38 +945,20 @@ class KXTaggerApp:
     def handle_keypress(self, event):
         if isinstance(event.widget, (ttk.Combobox, tk.Listbox)):
             return
-        
-        char = event.char
-        keysym = event.keysym
-        if char in ["1", "2", "3", "4"]:
-            self.on_paddler_press(f"P{char}")
-        elif keysym.startswith("F") and keysym[1:].isdigit():
-            gate_num = int(keysym[1:])
-            if 1 <= gate_num <= 8:
-                self.select_gate(f"Gate {gate_num}")
-        elif keysym == "BackSpace":
-            self.save_dns_tag()
-        elif char.lower() == "z":
-            self.undo_last_paddler()
-            
-        elif char.lower() == "n":
-            self.select_next_gate()
-            
-        elif char.lower() == "d":
-            self.select_action("Down")
-        elif char.lower() == "f":
-            self.select_action("Finish")
-        elif char.lower() == "l":
-            self.select_action("Left")
-        elif char.lower() == "o":
-            self.select_action("Roll")
-        elif char.lower() == "r":
-            self.select_action("Right")
-        elif char.lower() == "t":
-            self.select_action("Through")
-        elif char.lower() == "u":
-            self.select_action("Up")
-            
+        self.keys.push(event.char, event.keysym, event.time)
+        self.keys.drain(self._handle_key)
+
+    def _handle_key(self, key):
+        """Applies one queued key. Its warnings are logged instead of shown in a dialog,
+        which would swallow the keys typed for the next boats."""
+        self.session.key_time = key.time
+        try:
+            self._run(self.session.handle_key, key.char, key.keysym, modal=False)
+        finally:
+            self.session.key_time = None
+        if key.char in ["1", "2", "3", "4"]:
+            self._focus_setup_name(f"P{key.char}")
+
     def _update_athlete_name_dropdowns(self):
         """Updates the values in the athlete name comboboxes based on gender."""
         current_gender = self.gender_var.get()
@@ -660,373 +967,137 @@ class KXTaggerApp:
             combo['values'] = name_list
 
 
-    def on_paddler_count_change(self, event=None):
-        num_paddlers = self.num_paddlers_var.get()
+    # --- SESSION BRIDGE ---
+    def _run(self, action, *args, modal=True):
+        """Runs a tagging-session action with the race details currently on screen,
+        shows any warning it raises (in a dialog, or with modal=False a beep and the log)
+        and then redraws the widgets from the session state."""
+        session = self.session
+        session.year, session.comp = self.year_var.get(), self.comp_var.get()
+        session.gender, session.phase = self.gender_var.get(), self.phase_var.get()
+        session.num_paddlers = self.num_paddlers_var.get()
+        for p_key, var in self.athlete_name_vars.items():
+            session.athlete_names[p_key] = var.get()
+        try:
+            result = action(*args)
+        except TaggingWarning as w:
+            if modal:
+                messagebox.showwarning(w.title, w.message)
+            else:
+                self.root.bell()
+                self.log_to_display(f"WARNING: {w.title}: {w.message}")
+            result = None
+        with self.timings.timed(UI_REFRESH):
+            self._sync_ui()
+        self._checkpoint_race()
+        if self._results_due:
+            self._results_due = False
+            self._show_race_results()
+        return result
+
+    def _sync_ui(self):
+        """Redraws bibs, ramp positions, gates, actions and names from the session state."""
+        session = self.session
         disabled_color = "#404040"
-
-        for i in range(1, 5):
-            p_key = f"P{i}"
-            p_button = self.paddler_buttons[p_key]
-            combo = self.athlete_name_comboboxes[p_key]
-
-            if i <= num_paddlers:
-                p_button.config(bg=self.bib_data[p_key]["color"])
-                p_button.bind("<Button-1>", lambda e, n=p_key: self.on_paddler_press(n))
-                combo.config(state="normal")
+        for i, (p_key, bib_info) in enumerate(self.bib_data.items(), start=1):
+            if i > session.num_paddlers:
+                bg = disabled_color
+            elif p_key in session.faulted_bibs:
+                bg = "#808080"
             else:
-                p_button.config(bg=disabled_color)
-                p_button.unbind("<Button-1>")
-                self.athlete_name_vars[p_key].set("")
-                combo.config(state="disabled")
+                bg = bib_info["color"]
+            text = bib_info["name"]
+            if p_key in session.paddler_order_sequence:
+                order_num = session.paddler_order_sequence.index(p_key) + 1
+                text = f"{bib_info['name']}\n({order_num}{get_ordinal_suffix(order_num)})"
+            relief = tk.SUNKEN if p_key == session.selected_paddler_setup else tk.RAISED
+            self.paddler_buttons[p_key].config(bg=bg, text=text, relief=relief)
+
+            self.athlete_name_comboboxes[p_key].config(state="normal" if i <= session.num_paddlers else "disabled")
+            if self.athlete_name_vars[p_key].get() != session.athlete_names[p_key]:
+                self.athlete_name_vars[p_key].set(session.athlete_names[p_key])
+
+        owners = {pos: p_key for p_key, pos in session.paddler_ramp_positions.items()}
+        for pos, r_button in self.ramp_position_buttons.items():
+            r_button.config(bg=self.bib_data[owners[pos]]["color"] if pos in owners else "#CCCCCC")
+
+        for gate_name, btn in self.gate_buttons.items():
+            btn.config(style="Active.TButton" if gate_name == session.selected_gate else "TButton")
+
+        for action_name, btn in self.action_buttons.items():
+            style = btn.cget("style").replace(".Active", "")
+            # Up/Down keep their red/green look and are never shown as active
+            if action_name in session.selected_actions and action_name not in ["Up", "Down"]:
+                style = style.replace(".TButton", ".Active.TButton")
+            btn.config(style=style)
+
+    def _on_paddler_click(self, name):
+        index = list(self.bib_data).index(name) + 1
+        if index > self.num_paddlers_var.get() or name in self.session.faulted_bibs:
+            return
+        self.on_paddler_press(name)
 
-        for i in range(1, 5):
-            r_button = self.ramp_position_buttons[i]
-            r_button.config(bg="#CCCCCC")
-            r_button.bind("<Button-1>", lambda e, p=i: self.assign_ramp_position(p))
+    def _on_ramp_click(self, position):
+        if position not in self.session.disabled_positions:
+            self.assign_ramp_position(position)
 
-        self.clear_all_assignments()
+    # --- TAGGING ---
+    def on_paddler_count_change(self, event=None):
+        self._run(self.session.set_num_paddlers, self.num_paddlers_var.get())
 
     def on_phase_change(self, event=None):
-        self.log_to_display(
-            f"--- NEW PHASE: {self.phase_var.get()}. Clearing assignments. ---"
-        )
-        self.finish_line_sequence.clear()
-        self.faulted_bibs.clear()
-        self.phase_final_positions.clear()
-        self.upstream_tactic_actions.clear()
-        self.clear_all_assignments()
-        for var in self.athlete_name_vars.values():
-            var.set("")
-
-    def _get_athlete_name_for_paddler(self, paddler_key):
-        """Finds the athlete name for a given paddler from the initial 'Ramp' tag in the current race."""
-        bib_csv_char = self.bib_data[paddler_key]["csv_char"]
-        current_phase = self.phase_var.get()
-        current_comp = self.comp_var.get()
-        current_year = self.year_var.get()
-
-        for row in reversed(self.tagged_data):
-            if (row.get("Year") == current_year and
-                row.get("Competition") == current_comp and
-                row.get("Phase") == current_phase and
-                row.get("BIB") == bib_csv_char and
-                row.get("Athlete Name")):
-                return row.get("Athlete Name")
-        return "" 
-
-    def _backfill_final_position(self, bib_key, final_pos):
-        """Updates internal state tracking for a bib's final position. Does NOT backfill old CSV rows."""
-        bib_csv_char = self.bib_data[bib_key]["csv_char"]
-        self.phase_final_positions[bib_csv_char] = final_pos
-
-    def _find_and_copy_extra_data(self, new_entry):
-        for existing_row in reversed(self.tagged_data):
-            is_match = (
-                existing_row.get('Year') == new_entry.get('Year') and
-                existing_row.get('Competition') == new_entry.get('Competition') and
-                existing_row.get('Phase') == new_entry.get('Phase') and
-                existing_row.get('BIB') == new_entry.get('BIB')
-            )
-            if is_match:
-                for header in self.extra_headers:
-                    if existing_row.get(header):
-                        new_entry[header] = existing_row[header]
-                return
+        self._run(self.session.change_phase, self.phase_var.get())
 
     def on_paddler_press(self, name):
-        if name in self.faulted_bibs:
-            self.log_to_display(
-                f"NOTE: {self.bib_data[name]['name']} has FAULTED and cannot be tagged further."
-            )
-            return
+        self._run(self.session.press_paddler, name)
+        self._focus_setup_name(name)
 
-        num_paddlers = self.num_paddlers_var.get()
-        if len(self.paddler_ramp_positions) < num_paddlers:
-            self.select_paddler_for_setup(name)
-        else:
-            self.add_paddler_to_sequence(name)
-
-    def select_paddler_for_setup(self, name):
-        if self.selected_paddler_setup:
-            if self.selected_paddler_setup not in self.paddler_ramp_positions:
-                self.paddler_buttons[self.selected_paddler_setup].config(
-                    relief=tk.RAISED
-                )
-        self.selected_paddler_setup = name
-        self.paddler_buttons[name].config(relief=tk.SUNKEN)
-        if self.athlete_name_comboboxes.get(name):
+    def _focus_setup_name(self, name):
+        """Moves focus to a BIB's name box if the BIB was just picked for ramp setup."""
+        if self.session.selected_paddler_setup == name and self.athlete_name_comboboxes.get(name):
             self.athlete_name_comboboxes[name].focus_set()
 
     def assign_ramp_position(self, position):
-        if not self.selected_paddler_setup:
-            messagebox.showwarning(
-                "No BIB Selected", "Please select a BIB before assigning a position."
-            )
-            return
-        if position in self.disabled_positions:
-            messagebox.showwarning(
-                "Position Taken", f"Position {position} is already assigned."
-            )
-            return
-        paddler_name = self.selected_paddler_setup
-
-        if paddler_name in self.paddler_ramp_positions:
-            old_pos = self.paddler_ramp_positions[paddler_name]
-            self.ramp_position_buttons[old_pos].config(bg="#CCCCCC")
-            self.disabled_positions.remove(old_pos)
-
-        paddler_color = self.bib_data[paddler_name]["color"]
-        self.paddler_ramp_positions[paddler_name] = position
-        self.ramp_position_buttons[position].config(bg=paddler_color)
-        self.ramp_position_buttons[position].unbind("<Button-1>")
-        self.disabled_positions.add(position)
-        self.paddler_buttons[paddler_name].config(relief=tk.RAISED)
-
-        entry = {
-            "Year": self.year_var.get(), "Competition": self.comp_var.get(),
-            "Gender": self.gender_var.get(), "Phase": self.phase_var.get(),
-            "Gate": "Ramp", "BIB": self.bib_data[paddler_name]["csv_char"],
-            "Ramp Position": position, "Action": "Assigned", "Order": "",
-            "Final Position": "", "Upstream Tactic": "",
-        }
-        
-        athlete_name = self.athlete_name_vars[paddler_name].get().strip()
-        if athlete_name:
-            entry['Athlete Name'] = athlete_name
-            gender = self.gender_var.get()
-            if gender == "M":
-                self.male_athlete_names.add(athlete_name)
+        entry = self._run(self.session.assign_ramp_position, position)
+        if entry and entry.get('Athlete Name'):
+            if entry["Gender"] == "M":
+                self.male_athlete_names.add(entry['Athlete Name'])
             else:
-                self.female_athlete_names.add(athlete_name)
+                self.female_athlete_names.add(entry['Athlete Name'])
             self._update_athlete_name_dropdowns()
 
-        self.tagged_data.append(entry)
-        self.autosave_csv()
-        log_msg = f"--> SAVED: Ramp, {self.bib_data[paddler_name]['name']}[{entry['Ramp Position']}], {entry['Action']}"
-        if athlete_name:
-            log_msg += f" [{athlete_name}]"
-        self.log_to_display(log_msg)
-        self.selected_paddler_setup = None
-
     def clear_all_assignments(self):
-        """Clears all ramp positions, selections, and resets faulted bibs."""
-        self.paddler_ramp_positions.clear()
-        self.selected_paddler_setup = None
-        self.disabled_positions.clear()
-        self.faulted_bibs.clear()
-        self.dns_bibs.clear() 
-        self.phase_final_positions.clear()
-        self.finish_line_sequence.clear()
-        self.upstream_tactic_actions.clear()
-
-        for i in range(1, 5):
-            p_key = f"P{i}"
-            self.paddler_buttons[p_key].config(relief=tk.RAISED)
-            pos_button = self.ramp_position_buttons[i]
-            pos_button.config(bg="#CCCCCC")
-            pos_button.bind("<Button-1>", lambda e, p=i: self.assign_ramp_position(p))
-
-        self.on_paddler_count_change()
-        self.clear_tag_selection()
-        self.log_to_display("--- All ramp positions and states cleared ---")
+        self._run(self.session.clear_all_assignments)
+
+    def clear_tag_selection(self, keep_context=False):
+        self._run(self.session.clear_tag_selection, keep_context)
 
     def select_gate(self, gate_name):
-        if "Roll" in self.selected_actions:
-            self.selected_actions.remove("Roll")
-            self.action_buttons["Roll"].config(style="ExtraSmall.TButton")
-            self.paddler_order_sequence.clear()
-            self.update_paddler_sequence_ui()
-
-        if self.selected_gate != gate_name:
-            if self.selected_gate:
-                self.gate_buttons[self.selected_gate].config(style="TButton")
-
-            self.paddler_order_sequence.clear()
-            self.update_paddler_sequence_ui()
-            self.upstream_tactic_actions.clear()
-
-            self.selected_gate = gate_name
-            self.gate_buttons[gate_name].config(style="Active.TButton")
-        else:
-            self.log_to_display(f"Gate {gate_name.split(' ')[1]} is active.")
+        self._run(self.session.select_gate, gate_name)
 
     def select_next_gate(self, event=None):
-        if not self.gate_order: return
-        if not self.selected_gate:
-            next_gate_name = self.gate_order[0]
-        else:
-            try:
-                current_index = self.gate_order.index(self.selected_gate)
-                if current_index + 1 < len(self.gate_order):
-                    next_gate_name = self.gate_order[current_index + 1]
-                else: return
-            except ValueError:
-                next_gate_name = self.gate_order[0]
-        self.select_gate(next_gate_name)
+        self._run(self.session.select_next_gate)
 
     def select_action(self, action_name):
-        if action_name in ["Up", "Down"]:
-            self.selected_actions.add(action_name)
-            return
-
-        current_style = self.action_buttons[action_name].cget("style")
-        is_active = "Active" in current_style
-
-        if is_active:
-            self.selected_actions.remove(action_name)
-            self.action_buttons[action_name].config(style=current_style.replace(".Active", ""))
-            if action_name == "Roll":
-                self.clear_tag_selection(keep_context=False)
-        else:
-            if action_name == "Roll":
-                if self.selected_gate:
-                    self.gate_buttons[self.selected_gate].config(style="TButton")
-                    self.selected_gate = None
-                for other_action in list(self.selected_actions):
-                    if other_action not in ["Up", "Down"]:
-                        style = self.action_buttons[other_action].cget("style").replace(".Active", "")
-                        self.action_buttons[other_action].config(style=style)
-                self.selected_actions.clear()
-                self.paddler_order_sequence.clear()
-                self.upstream_tactic_actions.clear()
-                self.update_paddler_sequence_ui()
-            else:
-                if "Roll" in self.selected_actions:
-                    self.selected_actions.remove("Roll")
-                    self.action_buttons["Roll"].config(style="ExtraSmall.TButton")
-                    self.paddler_order_sequence.clear()
-                    self.update_paddler_sequence_ui()
-
-            if "Up" in self.selected_actions:
-                if action_name == "Left" and "Right" in self.selected_actions:
-                    self.selected_actions.remove("Right")
-                    style = self.action_buttons["Right"].cget("style").replace(".Active", "")
-                    self.action_buttons["Right"].config(style=style)
-                elif action_name == "Right" and "Left" in self.selected_actions:
-                    self.selected_actions.remove("Left")
-                    style = self.action_buttons["Left"].cget("style").replace(".Active", "")
-                    self.action_buttons["Left"].config(style=style)
-
-            self.selected_actions.add(action_name)
-            self.action_buttons[action_name].config(style=current_style.replace(".TButton", ".Active.TButton"))
+        self._run(self.session.select_action, action_name)
 
     def add_paddler_to_sequence(self, paddler_name):
-        if not self.selected_actions:
-            messagebox.showwarning("Action Needed", "Please select an action.")
-            return
-
-        is_roll_only = ("Roll" in self.selected_actions) and (len(self.selected_actions) == 1)
-        is_finish = "Finish" in self.selected_actions
-        is_upstream_gate = "Up" in self.selected_actions
-
-        if not self.selected_gate and not is_roll_only and not is_finish:
-            messagebox.showwarning("Gate Needed", "A gate must be selected.")
-            return
-
-        if paddler_name in self.paddler_order_sequence: return
-
-        num_paddlers = self.num_paddlers_var.get()
-        active_paddlers = num_paddlers - len(self.faulted_bibs)
+        self._run(self.session.add_paddler_to_sequence, paddler_name)
 
-        if len(self.paddler_order_sequence) >= active_paddlers: return
+    def undo(self):
+        self._run(self.session.undo)
 
-        self.paddler_order_sequence.append(paddler_name)
-        order_num = len(self.paddler_order_sequence)
-
-        action_string = "-".join(sorted(list(self.selected_actions)))
-        gate_value = self.selected_gate if self.selected_gate else "Course"
-        if is_finish: gate_value = "Finish"
-
-        bib_csv_char = self.bib_data[paddler_name]["csv_char"]
-        
-        # --- NEW FINAL POSITION LOGIC ---
-        final_pos = "" 
-        if is_finish:
-            if paddler_name not in self.finish_line_sequence:
-                self.finish_line_sequence.append(paddler_name)
-            final_pos = self.finish_line_sequence.index(paddler_name) + 1
-            self._backfill_final_position(paddler_name, final_pos)
-
-        upstream_tactic = ""
-        if is_upstream_gate:
-            if not self.upstream_tactic_actions:
-                upstream_tactic = action_string
-            else:
-                previous_action = self.upstream_tactic_actions[-1]
-                upstream_tactic = "FOLLOW" if action_string == previous_action else "SPLIT"
-            self.upstream_tactic_actions.append(action_string)
-
-        entry = {
-            "Year": self.year_var.get(), "Competition": self.comp_var.get(),
-            "Gender": self.gender_var.get(), "Phase": self.phase_var.get(),
-            "Gate": gate_value, "BIB": bib_csv_char,
-            "Ramp Position": self.paddler_ramp_positions.get(paddler_name, "N/A"),
-            "Action": action_string, "Order": order_num,
-            "Final Position": final_pos, "Upstream Tactic": upstream_tactic,
-        }
-        
-        athlete_name = self._get_athlete_name_for_paddler(paddler_name)
-        self._find_and_copy_extra_data(entry)
-        self.tagged_data.append(entry)
-        self.autosave_csv()
-
-        self.update_paddler_sequence_ui()
-        suffix = self.get_ordinal_suffix(order_num)
-        log_msg = f"--> SAVED: {gate_value}, {self.bib_data[paddler_name]['name']} ({order_num}{suffix}), Action: {action_string}"
-        if athlete_name: log_msg += f" [{athlete_name}]"
-        if is_finish: log_msg += f" [Rank: {final_pos}]"
-        self.log_to_display(log_msg)
-
-        if len(self.paddler_order_sequence) >= active_paddlers:
-            self.clear_tag_selection(keep_context=False)
-
-    def undo_last_paddler(self):
-        if not self.paddler_order_sequence: return
-        last_paddler = self.paddler_order_sequence.pop()
-        if self.tagged_data:
-            self.tagged_data.pop()
-            self.autosave_csv()
-        if "Finish" in self.selected_actions and last_paddler in self.finish_line_sequence:
-            self.finish_line_sequence.remove(last_paddler)
-        if "Up" in self.selected_actions and self.upstream_tactic_actions:
-            self.upstream_tactic_actions.pop()
-        self.update_paddler_sequence_ui()
-
-    def get_ordinal_suffix(self, num):
-        if 10 <= num % 100 <= 20: return "th"
-        return {1: "st", 2: "nd", 3: "rd"}.get(num % 10, "th")
-
-    def update_paddler_sequence_ui(self):
-        for p_key, bib_info in self.bib_data.items():
-            if p_key in self.paddler_order_sequence:
-                order_num = self.paddler_order_sequence.index(p_key) + 1
-                self.paddler_buttons[p_key].config(text=f"{bib_info['name']}\n({order_num}{self.get_ordinal_suffix(order_num)})")
-            else:
-                self.paddler_buttons[p_key].config(text=bib_info["name"])
+    def redo(self):
+        self._run(self.session.redo)
 
     def save_dns_tag(self):
-        paddler_to_mark = self.selected_paddler_setup
-        if not paddler_to_mark: return
-        self.dns_bibs.add(paddler_to_mark)
-        entry = {
-            "Year": self.year_var.get(), "Competition": self.comp_var.get(),
-            "Gender": self.gender_var.get(), "Phase": self.phase_var.get(),
-            "Gate": "Start", "BIB": self.bib_data[paddler_to_mark]["csv_char"],
-            "Ramp Position": self.paddler_ramp_positions.get(paddler_to_mark, "N/A"),
-            "Action": "DNS", "Order": 0, "Final Position": "DNS", "Upstream Tactic": "",
-        }
-        entry['Athlete Name'] = self._get_athlete_name_for_paddler(paddler_to_mark)
-        self.tagged_data.append(entry)
-        self.autosave_csv()
-        self.log_to_display(f"--> SAVED: {self.bib_data[paddler_to_mark]['name']} DNS")
-        self.paddler_buttons[paddler_to_mark].config(relief=tk.RAISED)
-        self.selected_paddler_setup = None
+        self._run(self.session.save_dns_tag)
 
     def save_fault_tag(self):
-        total = self.num_paddlers_var.get()
-        expected = total - len(self.dns_bibs)
-        if len(self.finish_line_sequence) < expected:
-            messagebox.showwarning("Race Not Finished", f"Tag all finishers before faults.")
+        try:
+            self.session.check_race_finished()
+        except TaggingWarning as w:
+            messagebox.showwarning(w.title, w.message)
             return
         self.open_fault_selection_popup()
 
@@ -1035,7 +1106,7 @@ class KXTaggerApp:
         popup.title("Fault Entry"); popup.config(bg=self.bg_color); popup.geometry("450x550")
         
         selected_bibs = set()
-        if self.selected_paddler_setup: selected_bibs.add(self.selected_paddler_setup)
+        if self.session.selected_paddler_setup: selected_bibs.add(self.session.selected_paddler_setup)
 
         bib_frame = ttk.Frame(popup, style="TFrame"); bib_frame.pack(fill="x", padx=20, pady=5)
         def toggle_bib(btn, k, c):
@@ -1071,50 +1142,31 @@ class KXTaggerApp:
         ttk.Button(popup, text="CONFIRM", style="Small.Red.TButton", command=lambda: [self._finalize_fault_tag(list(selected_bibs), selected_faults), popup.destroy()]).pack(pady=20)
 
     def _finalize_fault_tag(self, bib_keys, selected_faults):
-        num_paddlers = self.num_paddlers_var.get()
-        current_phase = self.phase_var.get()
-        for bib_key in bib_keys:
-            self.faulted_bibs.add(bib_key)
-            bib_csv_char = self.bib_data[bib_key]["csv_char"]
-            final_pos = num_paddlers - (len(self.faulted_bibs) - 1)
-            self._backfill_final_position(bib_key, final_pos)
-            
-            for fault_item in selected_faults:
-                target_gate = f"Gate {fault_item}" if fault_item.isdigit() else fault_item
-                fault_str = f"FLT {fault_item}" if fault_item.isdigit() else f"FLT R" if fault_item == "Roll" else "FLT Course"
-                found_row = False
-                for row in reversed(self.tagged_data):
-                    if (row.get("Phase") == current_phase and row.get("BIB") == bib_csv_char):
-                        if (target_gate and row.get("Gate") == target_gate) or (fault_item == "Roll" and "Roll" in row.get("Action", "")) or (fault_item == "Course" and row.get("Gate") == "Finish"):
-                            row["Faults"] = (row.get("Faults", "") + ", " + fault_str).strip(", ")
-                            row["Final Position"] = final_pos
-                            found_row = True; break 
-                if not found_row:
-                    new_entry = {"Year": self.year_var.get(), "Competition": self.comp_var.get(), "Gender": self.gender_var.get(), "Phase": current_phase, "Gate": target_gate if target_gate != "Roll" else "Course", "BIB": bib_csv_char, "Ramp Position": self.paddler_ramp_positions.get(bib_key, "N/A"), "Action": "FLT", "Order": "", "Final Position": final_pos, "Faults": fault_str}
-                    self._find_and_copy_extra_data(new_entry); self.tagged_data.append(new_entry)
-            self.paddler_buttons[bib_key].config(bg="#808080"); self.paddler_buttons[bib_key].unbind("<Button-1>")
-        self.autosave_csv(); self.selected_paddler_setup = None
-
-    def clear_tag_selection(self, keep_context=False):
-        self.paddler_order_sequence.clear(); self.update_paddler_sequence_ui()
-        if self.selected_paddler_setup and not keep_context:
-            if self.selected_paddler_setup not in self.faulted_bibs: self.paddler_buttons[self.selected_paddler_setup].config(relief=tk.RAISED)
-            self.selected_paddler_setup = None
-        if not keep_context:
-            self.upstream_tactic_actions.clear()
-            if self.selected_gate: self.gate_buttons[self.selected_gate].config(style="TButton")
-            for a in list(self.selected_actions):
-                if a not in ["Up", "Down"]: self.action_buttons[a].config(style=self.action_buttons[a].cget("style").replace(".Active", ""))
-            self.selected_gate = None; self.selected_actions.clear()
+        self._run(self.session.finalize_fault_tag, bib_keys, selected_faults)
 
     def toggle_gender(self):
         self.gender_var.set("W" if self.gender_var.get() == "M" else "M")
         self._update_athlete_name_dropdowns()
 
 
-def main():
-    root = tk.Tk(); app = KXTaggerApp(root); root.mainloop()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tag kayak cross races from video.")
+    parser.add_argument("--live", action="store_true", help="stream tags to report pages on the local network")
+    parser.add_argument("--live-host", default="0.0.0.0", help="address the live server listens on (default: %(default)s)")
+    parser.add_argument("--live-port", type=int, default=LIVE_PORT, help="live server port (default: %(default)s)")
+    parser.add_argument("--station", help="tag as one of several stations on the same race, e.g. --station gates1-4")
+    args = parser.parse_args(argv)
+    if args.station:
+        try:
+            check_station_name(args.station)
+        except ValueError as e:
+            parser.error(str(e))
+    root = tk.Tk(); app = KXTaggerApp(root, station=args.station)
+    if args.live:
+        app.start_live_server(args.live_host, args.live_port)
+    root.mainloop()
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,450 @@
+"""GUI-free tagging engine.
+
+`TaggingSession` holds the live race state (ramp positions, the current gate and
+actions, order and finish sequences, faults, DNS, upstream tactics) and applies
+the tagging rules, writing rows through a `TagStore`. The Tk app drives it and
+mirrors its state on screen; replays and benchmarks drive it directly.
+
+Each tagging method that writes rows is one command on the store's undo stack,
+together with the race state before and after it, so `undo` and `redo` step
+back and forth through ramp assignments, sequence tags, DNS and faults alike.
+"""
+import functools
+
+from key_queue import format_key_time
+from tag_store import TagStore
+
+# Internal P-number to UI name, color, and CSV character
+BIB_DATA = {
+    "P1": {"name": "RED", "color": "#E5296B", "csv_char": "R"},
+    "P2": {"name": "GREEN", "color": "#0BC2A3", "csv_char": "G"},
+    "P3": {"name": "BLUE", "color": "#095cd9", "csv_char": "B"},
+    "P4": {"name": "YELLOW", "color": "#FEEA63", "csv_char": "Y"},
+}
+GATE_ORDER = [f"Gate {i}" for i in range(1, 9)]
+# Keyboard shortcuts for the actions
+ACTION_KEYS = {"d": "Down", "f": "Finish", "l": "Left", "o": "Roll", "r": "Right", "t": "Through", "u": "Up"}
+# Race state put back by undo and redo; everything else about the race comes from the UI
+RACE_STATE_FIELDS = (
+    "paddler_ramp_positions", "disabled_positions", "faulted_bibs", "dns_bibs", "selected_paddler_setup",
+    "selected_gate", "selected_actions", "paddler_order_sequence", "finish_line_sequence",
+    "phase_final_positions", "upstream_tactic_actions",
+)
+
+
+class TaggingWarning(Exception):
+    """A tag that cannot be applied as asked; the GUI shows it as a warning dialog."""
+
+    def __init__(self, title, message):
+        super().__init__(message)
+        self.title = title
+        self.message = message
+
+
+def command(method):
+    """Makes a session method one undoable command, unless it runs inside another one."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.store.recording:
+            return method(self, *args, **kwargs)
+        before = self.race_state()
+        self.store.begin_command()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.store.end_command(before, self.race_state())
+    return wrapper
+
+
+def get_ordinal_suffix(num):
+    if 10 <= num % 100 <= 20: return "th"
+    return {1: "st", 2: "nd", 3: "rd"}.get(num % 10, "th")
+
+
+class TaggingSession:
+    """Race state and tagging rules for one tagger, independent of any UI."""
+
+    def __init__(self, store=None, log=None):
+        self.store = store if store is not None else TagStore()
+        self.log = log or (lambda message: None)
+
+        # Race context, set by whoever drives the session
+        self.year = ""
+        self.comp = ""
+        self.gender = "M"
+        self.phase = ""
+        self.num_paddlers = 4
+        self.athlete_names = {p_key: "" for p_key in BIB_DATA}
+
+        self.paddler_ramp_positions = {}
+        self.disabled_positions = set()
+        self.faulted_bibs = set()
+        self.dns_bibs = set() # Track DNS bibs to exclude from finish count
+        self.selected_paddler_setup = None
+        self.selected_gate = None
+        self.selected_actions = set()
+        self.paddler_order_sequence = []
+        self.finish_line_sequence = []
+        self.phase_final_positions = {}
+        self.upstream_tactic_actions = []
+        self.key_time = None  # When the key being handled was pressed (time.time()), if it came from a key
+
+    def _race_key(self):
+        return (self.year, self.comp, self.phase)
+
+    def _stamp(self, message):
+        """Prefixes a log line with the time its key was pressed, when it came from a key."""
+        return f"{format_key_time(self.key_time)} {message}" if self.key_time else message
+
+    def race_state(self):
+        """A copy of the race state (a few entries per BIB), as restore_race_state takes it."""
+        state = {}
+        for field in RACE_STATE_FIELDS:
+            value = getattr(self, field)
+            state[field] = value.copy() if isinstance(value, (dict, set, list)) else value
+        return state
+
+    def restore_race_state(self, state):
+        for field, value in state.items():
+            setattr(self, field, value.copy() if isinstance(value, (dict, set, list)) else value)
+
+    def checkpoint(self):
+        """The race context and state as plain JSON data, for restore_checkpoint after a restart."""
+        race = {field: sorted(value) if isinstance(value, set) else value for field, value in self.race_state().items()}
+        race.update(year=self.year, comp=self.comp, gender=self.gender, phase=self.phase,
+                    num_paddlers=self.num_paddlers, athlete_names=dict(self.athlete_names))
+        return race
+
+    def restore_checkpoint(self, race):
+        self.year, self.comp, self.gender, self.phase = race["year"], race["comp"], race["gender"], race["phase"]
+        self.num_paddlers = race["num_paddlers"]
+        self.athlete_names.update(race["athlete_names"])
+        state = {field: race[field] for field in RACE_STATE_FIELDS}
+        for field, value in state.items():
+            if isinstance(getattr(self, field), set):
+                state[field] = set(value)
+        self.restore_race_state(state)
+
+    def _entry(self, **fields):
+        entry = {"Year": self.year, "Competition": self.comp, "Gender": self.gender, "Phase": self.phase}
+        entry.update(fields)
+        return entry
+
+    # --- RACE SETUP ---
+    def set_num_paddlers(self, num_paddlers):
+        self.num_paddlers = num_paddlers
+        for i, p_key in enumerate(BIB_DATA, start=1):
+            if i > num_paddlers:
+                self.athlete_names[p_key] = ""
+        self.clear_all_assignments()
+
+    def change_phase(self, phase):
+        self.phase = phase
+        self.log(f"--- NEW PHASE: {phase}. Clearing assignments. ---")
+        self.clear_all_assignments()
+        for p_key in self.athlete_names:
+            self.athlete_names[p_key] = ""
+
+    def clear_all_assignments(self):
+        """Clears all ramp positions, selections, and resets faulted bibs."""
+        self.paddler_ramp_positions.clear()
+        self.selected_paddler_setup = None
+        self.disabled_positions.clear()
+        self.faulted_bibs.clear()
+        self.dns_bibs.clear()
+        self.phase_final_positions.clear()
+        self.finish_line_sequence.clear()
+        self.upstream_tactic_actions.clear()
+        self.clear_tag_selection()
+        self.log("--- All ramp positions and states cleared ---")
+
+    def clear_tag_selection(self, keep_context=False):
+        self.paddler_order_sequence.clear()
+        if self.selected_paddler_setup and not keep_context:
+            self.selected_paddler_setup = None
+        if not keep_context:
+            self.upstream_tactic_actions.clear()
+            self.selected_gate = None
+            self.selected_actions.clear()
+
+    # --- LOOKUPS ---
+    def get_athlete_name(self, paddler_key):
+        """Finds the athlete name for a given paddler from the initial 'Ramp' tag in the current race."""
+        return self.store.athlete_name(self._race_key(), BIB_DATA[paddler_key]["csv_char"])
+
+    def _backfill_final_position(self, bib_key, final_pos):
+        """Updates internal state tracking for a bib's final position. Does NOT backfill old CSV rows."""
+        self.phase_final_positions[BIB_DATA[bib_key]["csv_char"]] = final_pos
+
+    # --- KEYBOARD ---
+    def handle_key(self, char, keysym=""):
+        """Applies a keyboard shortcut: 1-4 press a BIB, F1-F8 pick a gate, BackSpace marks
+        DNS, z undoes, y redoes, n moves to the next gate and d/f/l/o/r/t/u pick actions.
+        Returns False for keys that are not shortcuts."""
+        if char in ["1", "2", "3", "4"]:
+            self.press_paddler(f"P{char}")
+        elif keysym.startswith("F") and keysym[1:].isdigit():
+            gate_num = int(keysym[1:])
+            if 1 <= gate_num <= 8:
+                self.select_gate(f"Gate {gate_num}")
+        elif keysym == "BackSpace":
+            self.save_dns_tag()
+        elif char.lower() == "z":
+            self.undo()
+        elif char.lower() == "y":
+            self.redo()
+        elif char.lower() == "n":
+            self.select_next_gate()
+        elif char.lower() in ACTION_KEYS:
+            self.select_action(ACTION_KEYS[char.lower()])
+        else:
+            return False
+        return True
+
+    # --- BIBS & RAMP ---
+    def press_paddler(self, name):
+        """A BIB press: picks the BIB for ramp setup until every BIB has a position, then tags it."""
+        if name in self.faulted_bibs:
+            self.log(f"NOTE: {BIB_DATA[name]['name']} has FAULTED and cannot be tagged further.")
+            return None
+        if len(self.paddler_ramp_positions) < self.num_paddlers:
+            self.select_paddler_for_setup(name)
+            return None
+        return self.add_paddler_to_sequence(name)
+
+    def select_paddler_for_setup(self, name):
+        self.selected_paddler_setup = name
+
+    @command
+    def assign_ramp_position(self, position):
+        if not self.selected_paddler_setup:
+            raise TaggingWarning("No BIB Selected", "Please select a BIB before assigning a position.")
+        if position in self.disabled_positions:
+            raise TaggingWarning("Position Taken", f"Position {position} is already assigned.")
+        paddler_name = self.selected_paddler_setup
+
+        if paddler_name in self.paddler_ramp_positions:
+            self.disabled_positions.remove(self.paddler_ramp_positions[paddler_name])
+        self.paddler_ramp_positions[paddler_name] = position
+        self.disabled_positions.add(position)
+
+        entry = self._entry(
+            Gate="Ramp", BIB=BIB_DATA[paddler_name]["csv_char"],
+            **{"Ramp Position": position, "Action": "Assigned", "Order": "",
+               "Final Position": "", "Upstream Tactic": ""},
+        )
+        athlete_name = self.athlete_names.get(paddler_name, "").strip()
+        if athlete_name:
+            entry['Athlete Name'] = athlete_name
+
+        self.store.append(entry)
+        log_msg = f"--> SAVED: Ramp, {BIB_DATA[paddler_name]['name']}[{entry['Ramp Position']}], {entry['Action']}"
+        if athlete_name:
+            log_msg += f" [{athlete_name}]"
+        self.log(log_msg)
+        self.selected_paddler_setup = None
+        return entry
+
+    # --- GATES & ACTIONS ---
+    def select_gate(self, gate_name):
+        if "Roll" in self.selected_actions:
+            self.selected_actions.remove("Roll")
+            self.paddler_order_sequence.clear()
+
+        if self.selected_gate != gate_name:
+            self.paddler_order_sequence.clear()
+            self.upstream_tactic_actions.clear()
+            self.selected_gate = gate_name
+        else:
+            self.log(f"Gate {gate_name.split(' ')[1]} is active.")
+
+    def select_next_gate(self):
+        if not self.selected_gate:
+            next_gate_name = GATE_ORDER[0]
+        else:
+            try:
+                current_index = GATE_ORDER.index(self.selected_gate)
+                if current_index + 1 < len(GATE_ORDER):
+                    next_gate_name = GATE_ORDER[current_index + 1]
+                else: return
+            except ValueError:
+                next_gate_name = GATE_ORDER[0]
+        self.select_gate(next_gate_name)
+
+    def select_action(self, action_name):
+        if action_name in ["Up", "Down"]:
+            self.selected_actions.add(action_name)
+            return
+
+        if action_name in self.selected_actions:
+            self.selected_actions.remove(action_name)
+            if action_name == "Roll":
+                self.clear_tag_selection(keep_context=False)
+            return
+
+        if action_name == "Roll":
+            self.selected_gate = None
+            self.selected_actions.clear()
+            self.paddler_order_sequence.clear()
+            self.upstream_tactic_actions.clear()
+        elif "Roll" in self.selected_actions:
+            self.selected_actions.remove("Roll")
+            self.paddler_order_sequence.clear()
+
+        if "Up" in self.selected_actions:
+            if action_name == "Left":
+                self.selected_actions.discard("Right")
+            elif action_name == "Right":
+                self.selected_actions.discard("Left")
+
+        self.selected_actions.add(action_name)
+
+    # --- SEQUENCE TAGGING ---
+    @command
+    def add_paddler_to_sequence(self, paddler_name):
+        if not self.selected_actions:
+            raise TaggingWarning("Action Needed", "Please select an action.")
+
+        is_roll_only = ("Roll" in self.selected_actions) and (len(self.selected_actions) == 1)
+        is_finish = "Finish" in self.selected_actions
+        is_upstream_gate = "Up" in self.selected_actions
+
+        if not self.selected_gate and not is_roll_only and not is_finish:
+            raise TaggingWarning("Gate Needed", "A gate must be selected.")
+
+        if paddler_name in self.paddler_order_sequence: return None
+
+        active_paddlers = self.num_paddlers - len(self.faulted_bibs)
+        if len(self.paddler_order_sequence) >= active_paddlers: return None
+
+        self.paddler_order_sequence.append(paddler_name)
+        order_num = len(self.paddler_order_sequence)
+
+        action_string = "-".join(sorted(list(self.selected_actions)))
+        gate_value = self.selected_gate if self.selected_gate else "Course"
+        if is_finish: gate_value = "Finish"
+
+        # Final position is only recorded on the finish line
+        final_pos = ""
+        if is_finish:
+            if paddler_name not in self.finish_line_sequence:
+                self.finish_line_sequence.append(paddler_name)
+            final_pos = self.finish_line_sequence.index(paddler_name) + 1
+            self._backfill_final_position(paddler_name, final_pos)
+
+        # Upstream gates: the first boat sets the line, later boats FOLLOW or SPLIT from the one before
+        upstream_tactic = ""
+        if is_upstream_gate:
+            if not self.upstream_tactic_actions:
+                upstream_tactic = action_string
+            else:
+                previous_action = self.upstream_tactic_actions[-1]
+                upstream_tactic = "FOLLOW" if action_string == previous_action else "SPLIT"
+            self.upstream_tactic_actions.append(action_string)
+
+        entry = self._entry(
+            Gate=gate_value, BIB=BIB_DATA[paddler_name]["csv_char"],
+            **{"Ramp Position": self.paddler_ramp_positions.get(paddler_name, "N/A"),
+               "Action": action_string, "Order": order_num,
+               "Final Position": final_pos, "Upstream Tactic": upstream_tactic},
+        )
+
+        athlete_name = self.get_athlete_name(paddler_name)
+        self.store.copy_extra_data(entry)
+        self.store.append(entry)
+
+        suffix = get_ordinal_suffix(order_num)
+        log_msg = f"--> SAVED: {gate_value}, {BIB_DATA[paddler_name]['name']} ({order_num}{suffix}), Action: {action_string}"
+        if athlete_name: log_msg += f" [{athlete_name}]"
+        if is_finish: log_msg += f" [Rank: {final_pos}]"
+        self.log(self._stamp(log_msg))
+
+        if len(self.paddler_order_sequence) >= active_paddlers:
+            self.clear_tag_selection(keep_context=False)
+        return entry
+
+    # --- UNDO & REDO ---
+    def undo(self):
+        """Reverts the latest tagging command (rows and race state). Returns False if there is none."""
+        undone = self.store.undo_command()
+        if undone is None:
+            self.log("NOTE: Nothing to undo.")
+            return False
+        self.restore_race_state(undone.before)
+        self.log(self._stamp(f"<-- UNDONE: {self._describe(undone)}"))
+        return True
+
+    def redo(self):
+        """Applies the latest undone command again. Returns False if there is none."""
+        redone = self.store.redo_command()
+        if redone is None:
+            self.log("NOTE: Nothing to redo.")
+            return False
+        self.restore_race_state(redone.after)
+        self.log(self._stamp(f"--> REDONE: {self._describe(redone)}"))
+        return True
+
+    def _describe(self, done):
+        parts = []
+        for step in done.steps:
+            if step[0] == "add":
+                row = step[2]
+                parts.append(f"{row.get('Gate')}, {row.get('BIB')}, {row.get('Action')}")
+            elif step[0] == "amend":
+                row = self.store.rows[step[1]]
+                parts.append(f"{row.get('Gate')}, {row.get('BIB')}, {step[3].get('Faults') or 'amended'}")
+        return "; ".join(parts)
+
+    # --- DNS & FAULTS ---
+    @command
+    def save_dns_tag(self):
+        paddler_to_mark = self.selected_paddler_setup
+        if not paddler_to_mark: return None
+        self.dns_bibs.add(paddler_to_mark)
+        entry = self._entry(
+            Gate="Start", BIB=BIB_DATA[paddler_to_mark]["csv_char"],
+            **{"Ramp Position": self.paddler_ramp_positions.get(paddler_to_mark, "N/A"),
+               "Action": "DNS", "Order": 0, "Final Position": "DNS", "Upstream Tactic": ""},
+        )
+        entry['Athlete Name'] = self.get_athlete_name(paddler_to_mark)
+        self.store.append(entry)
+        self.log(self._stamp(f"--> SAVED: {BIB_DATA[paddler_to_mark]['name']} DNS"))
+        self.selected_paddler_setup = None
+        return entry
+
+    def race_finished(self):
+        """True once every starter has been tagged across the finish."""
+        return len(self.finish_line_sequence) >= self.num_paddlers - len(self.dns_bibs)
+
+    def check_race_finished(self):
+        """Faults are entered once every starter has been tagged across the finish."""
+        if not self.race_finished():
+            raise TaggingWarning("Race Not Finished", "Tag all finishers before faults.")
+
+    @command
+    def finalize_fault_tag(self, bib_keys, selected_faults):
+        """Marks bibs as faulted: ranks them last and records each fault on the matching
+        gate row of the race (or on a new FLT row if the bib has none)."""
+        race = self._race_key()
+        for bib_key in bib_keys:
+            self.faulted_bibs.add(bib_key)
+            bib_csv_char = BIB_DATA[bib_key]["csv_char"]
+            final_pos = self.num_paddlers - (len(self.faulted_bibs) - 1)
+            self._backfill_final_position(bib_key, final_pos)
+
+            for fault_item in selected_faults:
+                target_gate = f"Gate {fault_item}" if fault_item.isdigit() else fault_item
+                fault_str = f"FLT {fault_item}" if fault_item.isdigit() else f"FLT R" if fault_item == "Roll" else "FLT Course"
+                row_index = self.store.fault_row(race, bib_csv_char, fault_item)
+                if row_index is not None:
+                    row = self.store.rows[row_index]
+                    self.store.amend(row_index, {"Faults": (row.get("Faults", "") + ", " + fault_str).strip(", "), "Final Position": final_pos})
+                else:
+                    new_entry = self._entry(
+                        Gate=target_gate if target_gate != "Roll" else "Course", BIB=bib_csv_char,
+                        **{"Ramp Position": self.paddler_ramp_positions.get(bib_key, "N/A"),
+                           "Action": "FLT", "Order": "", "Final Position": final_pos, "Faults": fault_str},
+                    )
+                    self.store.copy_extra_data(new_entry)
+                    self.store.append(new_entry)
+        self.selected_paddler_setup = None
@@ -0,0 +1,81 @@
+"""Batch tools on a copy of the committed data: --dry-run writes nothing, and old data is only
+upgraded when asked to."""
+import contextlib
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import import_events  # noqa: E402
+import replay  # noqa: E402
+from tag_schema import SCHEMA_VERSION, read_schema_version  # noqa: E402
+
+COMMITTED_CSV = os.path.join(ROOT, "data", "kx_race_analysis_git.csv")
+EVENTS = """\
+{"race": {"year": "2026", "comp": "WC9", "gender": "W", "phase": "H1", "paddlers": 4}}
+{"key": "1"}
+{"ramp": 1}
+"""
+
+
+def digest(path):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+class BatchToolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.csv_path = os.path.join(self.directory, "kx_race_analysis_git.csv")
+        shutil.copy(COMMITTED_CSV, self.csv_path)
+        self.events_path = os.path.join(self.directory, "events.jsonl")
+        with open(self.events_path, "w", encoding="utf-8") as f:
+            f.write(EVENTS)
+        self.event_csv = os.path.join(self.directory, "event.csv")
+        with open(COMMITTED_CSV, "r", encoding="utf-8") as source, open(self.event_csv, "w", encoding="utf-8") as f:
+            f.writelines(line for number, line in enumerate(source) if number < 50)
+
+    def run_tool(self, tool, *args):
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            code = tool.main([*args, "--data", self.csv_path])
+        return code, out.getvalue(), err.getvalue()
+
+    def test_replay_dry_run_writes_nothing(self):
+        before, files = digest(self.csv_path), sorted(os.listdir(self.directory))
+        code, out, err = self.run_tool(replay, self.events_path, "--dry-run")
+        self.assertEqual(code, 0)
+        self.assertIn("Dry run: nothing written.", out)
+        self.assertIn("NOTE: The data is at version 0", err)
+        self.assertEqual(digest(self.csv_path), before)
+        self.assertEqual(sorted(os.listdir(self.directory)), files)
+
+    def test_import_dry_run_writes_nothing(self):
+        before, files = digest(self.csv_path), sorted(os.listdir(self.directory))
+        code, out, _ = self.run_tool(import_events, self.event_csv, "--dry-run")
+        self.assertEqual(code, 0)
+        self.assertEqual(digest(self.csv_path), before)
+        self.assertEqual(sorted(os.listdir(self.directory)), files)
+
+    def test_save_keeps_old_data_at_its_version(self):
+        code, _, _ = self.run_tool(replay, self.events_path)
+        self.assertEqual(code, 0)
+        self.assertEqual(read_schema_version(self.csv_path), 0)
+
+    def test_upgrade_on_request(self):
+        code, out, err = self.run_tool(replay, self.events_path, "--upgrade")
+        self.assertEqual(code, 0)
+        self.assertIn(f"Upgraded the data to version {SCHEMA_VERSION}", out)
+        self.assertNotIn("NOTE:", err)
+        self.assertEqual(read_schema_version(self.csv_path), SCHEMA_VERSION)
+
+
+if __name__ == "__main__":
+    unittest.main()
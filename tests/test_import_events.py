@@ -0,0 +1,56 @@
+"""Merging event files into the committed archive replaces only the races they hold."""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from import_events import merge_events  # noqa: E402
+from tag_table import TagTable  # noqa: E402
+
+COMMITTED_CSV = os.path.join(ROOT, "data", "kx_race_analysis_git.csv")
+EVENT_FIELDS = ("Year", "Competition", "Location", "Gender")
+
+
+def rows_of(table, *event):
+    values = zip(*(table.column_values(field) for field in EVENT_FIELDS[:len(event)]))
+    return [i for i, key in enumerate(values) if key == event]
+
+
+class MergeEventsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(COMMITTED_CSV, "r", newline="", encoding="utf-8") as f:
+            cls.master = TagTable.from_csv(f)
+
+    def test_partial_event_keeps_the_rest_of_the_event(self):
+        # 2026 WRR was raced at Penrith and at Oklahoma; the file holds Penrith women only
+        imported = self.master.take(rows_of(self.master, "2026", "WRR", "Penrith", "W"))
+        merged, dropped = merge_events(self.master, [imported])
+        self.assertEqual(len(merged), len(self.master))
+        self.assertEqual({race[:4] for race in dropped}, {("2026", "WRR", "Penrith", "W")})
+        self.assertEqual(sum(dropped.values()), len(imported))
+        for event in (("2026", "WRR", "Penrith", "M"), ("2026", "WRR", "Oklahoma", "W"), ("2026", "WRR", "Oklahoma", "M")):
+            self.assertEqual(len(rows_of(merged, *event)), len(rows_of(self.master, *event)), event)
+
+    def test_one_race_replaces_only_that_race(self):
+        race = self.master.row_dict(rows_of(self.master, "2026", "WRR", "Oklahoma", "M")[0])
+        races = zip(*(self.master.column_values(f) for f in ("Year", "Competition", "Location", "Gender", "Phase")))
+        key = tuple(race[f] for f in ("Year", "Competition", "Location", "Gender", "Phase"))
+        imported = self.master.take([i for i, values in enumerate(races) if values == key])
+        merged, dropped = merge_events(self.master, [imported])
+        self.assertEqual(list(dropped), [key])
+        self.assertEqual(len(merged), len(self.master))
+
+    def test_file_without_location_matches_any_venue(self):
+        imported = TagTable(["Year", "Competition", "Gender", "Phase", "Gate", "BIB"])
+        race = self.master.row_dict(rows_of(self.master, "2026", "WRR", "Penrith", "W")[0])
+        imported.append({f: race[f] for f in imported.headers})
+        _, dropped = merge_events(self.master, [imported])
+        self.assertTrue(dropped)
+        self.assertTrue(all(key[:2] == ("2026", "WRR") and key[3:] == (race["Gender"], race["Phase"]) for key in dropped))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+"""The integrity gate checks the Full Report data wherever it is kept."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from publish import check_data  # noqa: E402
+from tag_archive import TagArchive, write_csv  # noqa: E402
+from tag_partitions import split  # noqa: E402
+from tag_table import TagTable  # noqa: E402
+from test_tag_integrity import new_session, tag_race  # noqa: E402
+
+
+def tagged_race(misranked=False):
+    session = new_session()
+    tag_race(session, ["P1", "P2", "P3", "P4"])
+    if misranked:
+        finish = [i for i, row in enumerate(session.store.rows) if row["Gate"] == "Finish"]
+        session.store.amend(finish[0], {"Final Position": 2})
+        session.store.amend(finish[1], {"Final Position": 1})
+    table = TagTable(session.store.rows.headers)
+    table.extend(session.store.rows)
+    return table
+
+
+class CheckDataTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        self.csv_path = os.path.join(self.data_dir, "kx_race_analysis_git.csv")
+
+    def test_flat_csv(self):
+        write_csv(self.csv_path, tagged_race(misranked=True))
+        self.assertEqual(list(check_data(self.data_dir)), ["kx_race_analysis_git.csv"])
+
+    def test_partitioned_data(self):
+        archive = TagArchive(self.csv_path)
+        archive.open_journal()
+        archive.save_all(tagged_race(misranked=True))
+        archive.close()
+        split(self.csv_path)
+        # The CSV left behind is clean; the partitions the report loads are not
+        write_csv(self.csv_path, tagged_race())
+        found = check_data(self.data_dir)
+        self.assertEqual([v.check for v in found["kx_race_analysis_git.csv"]], ["finish", "finish"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""The finish and fault rank checks against the ranks the tagger writes and the committed archive."""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tag_archive import open_archive  # noqa: E402
+from tag_integrity import check_table  # noqa: E402
+from tagging_session import TaggingSession  # noqa: E402
+
+RANK_CHECKS = ("finish", "fault rank")
+
+
+def tag_race(session, finish_order, faults=None, dns=()):
+    """Tags a four-boat race as the tagger would: ramp positions, any DNS, Gate 1 and the
+    finish in `finish_order`, then the `faults` ({bib: fault items}) once everyone is across."""
+    for position, bib in enumerate(["P1", "P2", "P3", "P4"], start=1):
+        session.press_paddler(bib)
+        session.assign_ramp_position(position)
+    for bib in dns:
+        session.select_paddler_for_setup(bib)
+        session.save_dns_tag()
+    session.select_gate("Gate 1")
+    session.select_action("Down")
+    for bib in sorted(finish_order):
+        session.press_paddler(bib)
+    session.clear_tag_selection()
+    session.select_action("Finish")
+    for bib in finish_order:
+        session.press_paddler(bib)
+    session.check_race_finished()
+    for bib, items in (faults or {}).items():
+        session.finalize_fault_tag([bib], items)
+
+
+def new_session(phase="H1"):
+    session = TaggingSession()
+    session.year, session.comp, session.phase = "2026", "WC1", phase
+    return session
+
+
+class TaggedRaceTest(unittest.TestCase):
+    def assertPasses(self, session):
+        violations = check_table(session.store.rows, RANK_CHECKS)
+        self.assertEqual(violations, [])
+
+    def test_clean_race(self):
+        session = new_session()
+        tag_race(session, ["P2", "P1", "P3", "P4"])
+        self.assertPasses(session)
+
+    def test_faulted_boat_finished_ahead_of_clean_ones(self):
+        session = new_session()
+        tag_race(session, ["P2", "P1", "P3", "P4"], faults={"P1": ["1"]})
+        self.assertPasses(session)
+
+    def test_two_faults_and_a_fault_without_a_gate_row(self):
+        session = new_session()
+        tag_race(session, ["P1", "P2", "P3", "P4"], faults={"P1": ["1"], "P3": ["Roll"]})
+        self.assertPasses(session)
+
+    def test_fault_on_the_finish_row(self):
+        session = new_session()
+        tag_race(session, ["P1", "P2", "P3", "P4"], faults={"P1": ["Course"]})
+        self.assertPasses(session)
+
+    def test_fault_on_the_finish_row_ranked_first_is_flagged(self):
+        session = new_session()
+        tag_race(session, ["P1", "P2", "P3", "P4"], faults={"P1": ["Course"]})
+        fault_row = next(i for i, row in enumerate(session.store.rows) if row.get("Faults"))
+        self.assertEqual(session.store.rows[fault_row]["Gate"], "Finish")
+        session.store.amend(fault_row, {"Final Position": 1})
+        checks = [v.check for v in check_table(session.store.rows, RANK_CHECKS)]
+        self.assertEqual(checks, ["fault rank"])
+
+    def test_fault_with_dns(self):
+        session = new_session()
+        tag_race(session, ["P1", "P3", "P4"], faults={"P1": ["1"]}, dns=["P2"])
+        self.assertPasses(session)
+
+    def test_finish_out_of_crossing_order_is_flagged(self):
+        session = new_session()
+        tag_race(session, ["P1", "P2", "P3", "P4"])
+        finish = [i for i, row in enumerate(session.store.rows) if row["Gate"] == "Finish"]
+        session.store.amend(finish[0], {"Final Position": 2})
+        session.store.amend(finish[1], {"Final Position": 1})
+        checks = [v.check for v in check_table(session.store.rows, RANK_CHECKS)]
+        self.assertEqual(checks, ["finish", "finish"])
+
+    def test_faulted_boat_ranked_ahead_is_flagged(self):
+        session = new_session()
+        tag_race(session, ["P1", "P2", "P3", "P4"], faults={"P1": ["1"]})
+        fault_row = next(i for i, row in enumerate(session.store.rows) if row.get("Faults"))
+        session.store.amend(fault_row, {"Final Position": 1})
+        checks = [v.check for v in check_table(session.store.rows, RANK_CHECKS)]
+        self.assertEqual(checks, ["fault rank"])
+
+
+class CommittedArchiveTest(unittest.TestCase):
+    def test_ranks_pass(self):
+        table = open_archive(os.path.join(ROOT, "data", "kx_race_analysis_git.csv")).read_table()
+        self.assertEqual(check_table(table, RANK_CHECKS), [])
+
+
+if __name__ == "__main__":
+    unittest.main()